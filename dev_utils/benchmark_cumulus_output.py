@@ -0,0 +1,122 @@
+import argparse
+import re
+import time
+from unittest.mock import patch
+
+from task.discover_granules_base import DiscoverGranulesBase
+
+"""
+This script is only intended to be used by developers to compare generate_cumulus_output with the compiled file
+definitions against matching every file definition regex and scanning the buckets for every file, as it did before.
+Run it from the repository root:
+PYTHONPATH=. python dev_utils/benchmark_cumulus_output.py --files 100000
+"""
+
+PROVIDER_PATH = 'ssmi/f16/bmaps_v07/'
+BUCKETS = {
+    'private': {'name': 'sharedsbx-private', 'type': 'private'},
+    'protected': {'name': 'sharedsbx-protected', 'type': 'protected'},
+    'public': {'name': 'sharedsbx-public', 'type': 'public'},
+    'internal': {'name': 'sharedsbx-internal', 'type': 'internal'}
+}
+FILES = [
+    {'bucket': 'protected', 'regex': '^f16_\\d{8}v7(_d3d)?\\.gz$', 'type': 'data'},
+    {'bucket': 'public', 'regex': '^f16_\\d{8}v7(_d3d)?\\.gz\\.cmr\\.xml$', 'type': 'metadata'},
+    {'bucket': 'public', 'regex': '\\.png$', 'type': 'browse'},
+    {'bucket': 'private', 'regex': '\\.md5$'}
+]
+SUFFIXES = ('.gz', '.gz.cmr.xml', '_d3d.gz', '.png', '.gz.md5')
+
+
+def synthetic_granules(count):
+    granules = []
+    for index in range(count):
+        name = f'f16_{20000101 + index // len(SUFFIXES):08d}v7{SUFFIXES[index % len(SUFFIXES)]}'
+        granules.append({'name': f's3://bucket/{PROVIDER_PATH}y{2000 + index % 22}/{name}', 'size': index})
+
+    return granules
+
+
+def file_description(filename):
+    file_desc = {}
+    for file_def in FILES:
+        if re.search(file_def.get('regex'), filename):
+            file_desc = file_def
+
+    return file_desc
+
+
+def bucket_name(bucket_type):
+    name = ''
+    for bucket in BUCKETS.values():
+        if bucket.get('type') == bucket_type:
+            name = bucket.get('name')
+
+    return name
+
+
+def per_file_regexes(dg_client, granule_dict_list):
+    # What generate_cumulus_output did for every file
+    temp_dict = {}
+    for granule in granule_dict_list:
+        granule_name = granule.get('name')
+        res = granule_name.find(dg_client.meta.get('provider_path'))
+        path, filename = granule_name[res:].rsplit('/', maxsplit=1)
+        file_def = file_description(filename)
+        granule_id = dg_client.matcher.cumulus_granule_id(filename)
+        if granule_id not in temp_dict:
+            temp_dict[granule_id] = dg_client.generate_cumulus_granule(granule_id)
+        temp_dict[granule_id].get('files').append(dg_client.generate_cumulus_file(
+            filename, path, granule.get('size'), bucket_name(file_def.get('bucket', '')),
+            file_def.get('type', '')
+        ))
+
+    return list(temp_dict.values())
+
+
+def without_times(granules):
+    return [
+        dict(granule, files=[{k: v for k, v in file.items() if k != 'time'} for file in granule['files']])
+        for granule in granules
+    ]
+
+
+def measure(func, *args):
+    st = time.time()
+    ret = func(*args)
+    return ret, time.time() - st
+
+
+@patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+def create_discoverer():
+    event = {
+        'config': {
+            'buckets': BUCKETS,
+            'collection': {
+                'name': 'rssmif16d', 'version': '7', 'granuleIdExtraction': '^(f16_\\d{8}v7).*$',
+                'granuleId': '^f16_\\d{8}v7$', 'files': FILES, 'meta': {'provider_path': PROVIDER_PATH}
+            }
+        }
+    }
+    return DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark generating the Cumulus output.')
+    arg_parser.add_argument('--files', type=int, default=100000, help='Number of synthetic files')
+    args = arg_parser.parse_args()
+
+    dg_client = create_discoverer()
+    granules = synthetic_granules(args.files)
+    expected, regex_time = measure(per_file_regexes, dg_client, granules)
+    actual, compiled_time = measure(dg_client.generate_cumulus_output, granules)
+    if without_times(expected) != without_times(actual):
+        raise ValueError('The outputs are different')
+    print(f'{args.files} files, {len(actual)} granules')
+    print(f'  Regexes and bucket scan per file: {regex_time:.2f} s')
+    print(f'  FileDefinitions:                  {compiled_time:.2f} s')
+    print(f'  Speedup: {regex_time / compiled_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import random
+import re
+import time
+
+from task.granule_matcher import GranuleMatcher
+
+"""
+This script is only intended to be used by developers to compare the compiled granule matcher against running the
+granule_id_extraction with re.search on every key, as the discoverers did before. Run it from the repository root:
+PYTHONPATH=. python dev_utils/benchmark_granule_matcher.py --keys 2000000
+"""
+
+GRANULE_ID_EXTRACTION = '^(f16_\\d{8}v7).*\\.gz$'
+DIR_REG_EX = 'y20\\d{2}'
+# Share of the keys that are granules. Buckets usually hold many other files alongside the ones a collection wants.
+MATCH_RATIO = 0.05
+OTHER_SUFFIXES = ('.nc', '.nc.md5', '.txt', '.cmr.xml', '.png', '.json')
+
+
+def synthetic_keys(count):
+    rng = random.Random(0)
+    keys = []
+    for index in range(count):
+        directory = f'ssmi/f16/bmaps_v07/y{2000 + index % 22}/m{index % 12 + 1:02d}'
+        name = f'f16_{20000101 + index:08d}v7'
+        if rng.random() < MATCH_RATIO:
+            name = f'{name}.gz'
+        else:
+            name = f'{name}{rng.choice(OTHER_SUFFIXES)}'
+        keys.append((f's3://bucket/{directory}/{name}', directory, name))
+
+    return keys
+
+
+def regex_strings(keys):
+    # What the S3 discoverer did: check the extraction and dir_reg_ex, then run the extraction again for the ID
+    granules = []
+    for key, directory, name in keys:
+        if re.search(GRANULE_ID_EXTRACTION, name) and re.search(DIR_REG_EX, directory):
+            granules.append((key, re.search(GRANULE_ID_EXTRACTION, name).group(1)))
+
+    return granules
+
+
+def compiled_matcher(keys):
+    matcher = GranuleMatcher(GRANULE_ID_EXTRACTION, dir_reg_ex=DIR_REG_EX)
+    granules = []
+    for key, directory, name in keys:
+        granule = matcher.match_granule(key, name)
+        if granule and matcher.match_directory(directory):
+            granules.append(granule)
+
+    return granules
+
+
+def measure(func, keys):
+    st = time.time()
+    ret = func(keys)
+    return ret, time.time() - st
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark granule matching.')
+    arg_parser.add_argument('--keys', type=int, default=2000000, help='Number of synthetic keys to match')
+    args = arg_parser.parse_args()
+
+    keys = synthetic_keys(args.keys)
+    expected, regex_time = measure(regex_strings, keys)
+    actual, matcher_time = measure(compiled_matcher, keys)
+    if expected != actual:
+        raise ValueError('The matchers found different granules')
+    print(f'{args.keys} keys, {len(actual)} granules')
+    print(f'  re.search on pattern strings: {regex_time:.2f} s')
+    print(f'  GranuleMatcher:               {matcher_time:.2f} s')
+    print(f'  Speedup: {regex_time / matcher_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import gc
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from task.http_listing import ListingParser
+
+"""
+This script is only intended to be used by developers to compare the streaming listing parser against the previous
+BeautifulSoup html.parser link extraction on large synthetic directory pages. Run it from the repository root:
+PYTHONPATH=. python dev_utils/benchmark_http_listing.py --links 20000
+BeautifulSoup gets much slower than linear on the Apache table page so 100000+ links takes a long time to run.
+"""
+
+BASE_URL = 'https://data.example.com/ssmi/f16/bmaps_v07/y2020/'
+CHUNK_SIZE = 64 * 1024
+
+
+def apache_page(links):
+    rows = ''.join(
+        f'<tr><td valign="top"><img src="/icons/compressed.gif" alt="[   ]"></td>'
+        f'<td><a href="f16_{x:08d}v7.gz">f16_{x:08d}v7.gz</a></td>'
+        f'<td align="right">2021-05-07 09:27  </td><td align="right">{1882122 + x}</td><td>&nbsp;</td></tr>\n'
+        for x in range(links)
+    )
+    return (
+        '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN"><html><head><title>Index of /ssmi</title></head><body>'
+        '<h1>Index of /ssmi</h1><table><tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a>'
+        '</th><th><a href="?C=S;O=A">Size</a></th></tr><tr><th colspan="5"><hr></th></tr>\n'
+        '<tr><td><a href="/ssmi/f16/bmaps_v07/">Parent Directory</a></td><td>&nbsp;</td>'
+        '<td align="right">  - </td></tr>\n'
+        f'{rows}</table></body></html>'
+    )
+
+
+def nginx_page(links):
+    rows = ''.join(
+        f'<a href="f16_{x:08d}v7.gz">f16_{x:08d}v7.gz</a>                                07-May-2021 09:27'
+        f'             {1882122 + x}\n'
+        for x in range(links)
+    )
+    return (
+        f'<html><head><title>Index of /ssmi/</title></head><body><pre><a href="../">../</a>\n{rows}</pre></body></html>'
+    )
+
+
+def iis_page(links):
+    rows = ''.join(
+        f'  4/2/2020  3:06 PM      {1882122 + x} <A HREF="/ssmi/f16/bmaps_v07/y2020/f16_{x:08d}v7.gz">'
+        f'f16_{x:08d}v7.gz</A><br>'
+        for x in range(links)
+    )
+    return (
+        f'<html><body><pre><A HREF="/ssmi/f16/bmaps_v07/">[To Parent Directory]</A><br><br>{rows}</pre></body></html>'
+    )
+
+
+def soup_links(url, page):
+    # The link extraction DiscoverGranulesHTTP.get_links used before the streaming parser
+    html = BeautifulSoup(page, features='html.parser')
+    urls = []
+    for a_tag in html.find_all('a', href=True):
+        href = a_tag.get('href')
+        if href.startswith(('?', '#')) or href in url:
+            continue
+        url_segment = href.rstrip('/').rsplit('/', 1)[-1]
+        urls.append(f'{url.rstrip("/")}/{url_segment}')
+
+    return urls
+
+
+def streaming_links(url, page):
+    parser = ListingParser(url)
+    for index in range(0, len(page), CHUNK_SIZE):
+        parser.feed(page[index:index + CHUNK_SIZE])
+
+    return parser.close()
+
+
+def measure(func, *args):
+    # Timed separately from the memory measurement since tracing allocations slows both parsers down considerably
+    gc.collect()
+    st = time.time()
+    ret = func(*args)
+    et = time.time() - st
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ret, et, peak
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark HTML directory listing parsers.')
+    arg_parser.add_argument('--links', type=int, default=20000, help='Number of file links on each page')
+    args = arg_parser.parse_args()
+
+    for name, page_func in (('apache', apache_page), ('nginx', nginx_page), ('iis', iis_page)):
+        page = page_func(args.links)
+        print(f'{name}: {args.links} links, {len(page) / 2 ** 20:.1f} MiB page')
+        soup_urls, soup_time, soup_peak = measure(soup_links, BASE_URL, page)
+        entries, stream_time, stream_peak = measure(streaming_links, BASE_URL, page)
+        # The old extraction also returned the "../" parent link, which the listing parser drops
+        if [x.url for x in entries] != [x for x in soup_urls if not x.endswith('/..')]:
+            raise ValueError(f'{name}: the parsers returned different links')
+        print(f'  BeautifulSoup html.parser: {soup_time:.2f} s, peak {soup_peak / 2 ** 20:.1f} MiB')
+        print(f'  ListingParser:             {stream_time:.2f} s, peak {stream_peak / 2 ** 20:.1f} MiB')
+        print(f'  Speedup: {soup_time / stream_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
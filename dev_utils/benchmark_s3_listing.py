@@ -0,0 +1,36 @@
+import argparse
+import time
+
+from tests.s3_listing_pages import list_contents, list_objects_v2_page, stubbed_client
+
+"""
+This script is only intended to be used by developers to compare listing S3 with and without s3_fast_listing. The
+ListObjectsV2 responses are stubbed so only botocore's request handling and response parsing are timed. Run it from
+the repository root:
+PYTHONPATH=. python dev_utils/benchmark_s3_listing.py --pages 200
+"""
+
+PAGE_SIZE = 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark S3 ListObjectsV2 response parsing.')
+    arg_parser.add_argument('--pages', type=int, default=200, help='Number of 1000 key pages to list')
+    args = arg_parser.parse_args()
+
+    pages = {}
+    for page in range(args.pages):
+        keys = [f'ssmi/f16/bmaps_v07/f16_{x:08d}v7.gz' for x in range(page * PAGE_SIZE, (page + 1) * PAGE_SIZE)]
+        pages[f'page{page}' if page else ''] = list_objects_v2_page(
+            keys, token=f'page{page}' if page else None, next_token=f'page{page + 1}' if page + 1 < args.pages else None
+        )
+
+    for fast_listing in (False, True):
+        client, _ = stubbed_client(pages, fast_listing)
+        st = time.time()
+        count = len(list_contents(client))
+        print(f's3_fast_listing {fast_listing}: {time.time() - st:.2f} s for {count} keys')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import datetime
+import os
+import time
+from unittest.mock import MagicMock
+
+from task.discover_granules_s3 import DiscoverGranulesS3
+
+"""
+This script is only intended to be used by developers to measure how S3 discovery scales with match_processes on
+synthetic ListObjectsV2 pages. The database manager is replaced so only listing and matching are timed. Run it from
+the repository root:
+PYTHONPATH=. python dev_utils/benchmark_s3_matching.py --keys 2000000 --processes 4
+"""
+
+PAGE_SIZE = 1000
+
+
+def synthetic_pages(keys):
+    last_modified = datetime.datetime(2021, 5, 7, 9, 27, tzinfo=datetime.timezone.utc)
+    for start in range(0, keys, PAGE_SIZE):
+        yield {
+            'Contents': [
+                {
+                    'Key': f'ssmi/f16/bmaps_v07/y{2000 + x % 22}/f16_{x:08d}v7.{"gz" if x % 20 == 0 else "nc"}',
+                    'ETag': f'"{x:032x}"', 'LastModified': last_modified, 'Size': x
+                } for x in range(start, min(start + PAGE_SIZE, keys))
+            ]
+        }
+
+
+def create_discoverer(processes):
+    event = {
+        'config': {
+            'provider': {'protocol': 's3', 'host': 'bucket'},
+            'collection': {
+                'name': 'benchmark', 'version': '1', 'granuleIdExtraction': '^(f16_\\d{8}v7).*\\.gz$',
+                'meta': {'provider_path': 'ssmi/', 'discover_tf': {'dir_reg_ex': 'y20\\d{2}'}}
+            }
+        }
+    }
+    dg = DiscoverGranulesS3(event, None)
+    dg.dbm = MagicMock()
+    dg.match_processes = processes
+    return dg
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark S3 discovery matching processes.')
+    arg_parser.add_argument('--keys', type=int, default=2000000, help='Number of synthetic keys to list')
+    arg_parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Matching processes to compare')
+    args = arg_parser.parse_args()
+
+    for processes in sorted({0, args.processes}):
+        dg = create_discoverer(processes)
+        st = time.time()
+        dg.discover(synthetic_pages(args.keys))
+        print(f'match_processes {processes}: {time.time() - st:.2f} s for {args.keys} keys, '
+              f'{dg.dbm.add_record.call_count} granules')
+
+
+if __name__ == '__main__':
+    main()
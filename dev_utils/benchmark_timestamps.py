@@ -0,0 +1,46 @@
+import argparse
+import time
+
+import dateparser
+
+from task.timestamp import parse_timestamp
+
+"""
+This script is only intended to be used by developers to compare the timestamp parser used by discovery against
+calling dateparser for every file. Run it from the repository root:
+PYTHONPATH=. python dev_utils/benchmark_timestamps.py --count 20000
+"""
+
+SAMPLES = {
+    'http': [f'Thu, {x % 28 + 1:02d} Apr 2020 15:{x % 60:02d}:03 GMT' for x in range(100)],
+    'ftp': [f'May {x % 28 + 1:02d} {x % 24:02d}:08' for x in range(50)] + [f'May 01 {2000 + x}' for x in range(50)],
+    'sftp': [1625000000 + x * 3600 for x in range(100)],
+    'iso': [f'2021-05-{x % 28 + 1:02d}T09:27:{x % 60:02d}.000Z' for x in range(100)]
+}
+
+
+def measure(func, values):
+    st = time.time()
+    ret = [func(x) for x in values]
+    return ret, time.time() - st
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark timestamp parsing.')
+    arg_parser.add_argument('--count', type=int, default=20000, help='Number of timestamps of each kind to parse')
+    args = arg_parser.parse_args()
+
+    for name, samples in SAMPLES.items():
+        values = [samples[x % len(samples)] for x in range(args.count)]
+        expected, dateparser_time = measure(lambda x: dateparser.parse(str(x)), values)
+        actual, fast_time = measure(parse_timestamp, values)
+        if expected != actual:
+            raise ValueError(f'{name}: the parsers returned different timestamps')
+        print(f'{name}: {args.count} timestamps')
+        print(f'  dateparser:      {dateparser_time:.2f} s')
+        print(f'  parse_timestamp: {fast_time:.3f} s')
+        print(f'  Speedup: {dateparser_time / fast_time:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import base64
+import os
+
+import boto3
+
+
+def decrypt_credential(credential, encrypted):
+    """
+    Handles decrypting username and password credentials
+    :param credential: Expected to be the username or password
+    :param encrypted: Whether or not the value is encrypted
+    :return The
+    """
+    ret = credential
+    if encrypted and credential:
+        ret = kms_decrypt_ciphertext(credential)
+
+    return ret
+
+
+def kms_decrypt_ciphertext(_ciphertext, kms_client=None):
+    if not kms_client:
+        kms_client = boto3.client('kms')
+    response = kms_client.decrypt(
+        CiphertextBlob=base64.b64decode(_ciphertext),
+        KeyId=os.getenv('AWS_DECRYPT_KEY_ARN')
+    )
+    decrypted_text = response["Plaintext"].decode()
+
+    return decrypted_text
+
+
+if __name__ == '__main__':
+    pass
@@ -1,7 +1,13 @@
+import datetime
 import time
 from abc import ABC, abstractmethod
 
 TABLE_NAME = 'granule'
+FIELD_COUNT = 8
+DIRECTORY_TABLE_NAME = 'directory_cache'
+DIRECTORY_FIELD_COUNT = 6
+# The columns output generation needs from a claimed batch
+BATCH_COLUMNS = ('name', 'size')
 
 def get_db_params(secrets):
     db_params = {'sslmode': 'disable'} # Will revisit when/if SSL becomes required
@@ -43,6 +49,19 @@ class DBManagerBase(ABC):
     def flush_dict(self):
         raise NotImplementedError
 
+    def read_directory_cache(self, url):
+        """
+        :return: The cached listing of a directory or None. Database managers without a directory cache table always
+        return None.
+        """
+        return None
+
+    def write_directory_cache(self, url, etag, last_modified, entries):
+        pass
+
+    def flush_directory_cache(self):
+        return 0
+
     @abstractmethod
     def read_batch(self):
         raise NotImplementedError
@@ -51,10 +70,12 @@ class DBManagerBase(ABC):
 class DBManagerPeewee(DBManagerBase):
     def __init__(
             self, database, model_class, var_limit, excluded, chunked,  collection_id,
-            provider_url, auto_batching=True, cumulus_filter_dbm=None, **kwargs
+            provider_url, auto_batching=True, cumulus_filter_dbm=None, directory_model=None, **kwargs
     ):
         super().__init__(**kwargs)
         self.model_class = model_class
+        self.directory_model = directory_model
+        self.directory_list = []
         self.database = database
         self.auto_batching = auto_batching
         self.list_dict = []
@@ -85,6 +106,63 @@ class DBManagerPeewee(DBManagerBase):
     def flush_dict(self):  # TODO: Rename to list
         return self.write_batch()
 
+    def read_directory_cache(self, url):
+        """
+        Looks up the validators and listing stored for a directory by a previous discovery of this collection.
+        :param url: URL of the directory
+        :return: Dictionary with the etag, last_modified and entries columns or None if the directory is not cached
+        """
+        if not self.directory_model:
+            return None
+
+        record = self.directory_model.select(
+            self.directory_model.etag, self.directory_model.last_modified, self.directory_model.entries
+        ).where(
+            (self.directory_model.collection_id == self.collection_id) & (self.directory_model.url == url)
+        ).dicts().first()
+
+        return record
+
+    def write_directory_cache(self, url, etag, last_modified, entries):
+        """
+        Queues the listing of a directory to be stored by flush_directory_cache.
+        :param url: URL of the directory
+        :param etag: ETag header of the directory page
+        :param last_modified: Last-Modified header of the directory page
+        :param entries: Serialized listing of the directory
+        """
+        if self.directory_model:
+            self.directory_list.append({
+                'url': url,
+                'collection_id': self.collection_id,
+                'etag': etag,
+                'last_modified': last_modified,
+                'entries': entries,
+                'updated_date': datetime.datetime.now()
+            })
+
+    def flush_directory_cache(self):
+        """
+        Stores the queued directory listings, replacing any previous listing of the same directory.
+        :return: The number of directories written
+        """
+        records_written = 0
+        if self.directory_list:
+            with self.database.atomic():
+                for batch in self.chunked(self.directory_list, self.var_limit // DIRECTORY_FIELD_COUNT):
+                    records_written += self.upsert_directory_chunk(batch)
+            print(f'Cached {records_written} directory listings.')
+            self.directory_list.clear()
+
+        return records_written
+
+    def upsert_directory_chunk(self, batch):
+        model = self.directory_model
+        return model.insert_many(batch).on_conflict(
+            conflict_target=[model.collection_id, model.url],
+            preserve=[model.etag, model.last_modified, model.entries, model.updated_date]
+        ).as_rowcount().execute()
+
     def write_batch(self):
         records_inserted = 0
         if self.cumulus_filter and self.duplicate_handling == 'skip' and self.list_dict:
@@ -227,18 +305,22 @@ class DBManagerPeewee(DBManagerBase):
         print(f'Inserting {len(self.list_dict)} records...')
         records_inserted = 0
 
-        field_count = 8
-        var_limit = self.var_limit // field_count
+        var_limit = self.var_limit // FIELD_COUNT
         db_st = time.time()
         with self.database.atomic():
             for batch in self.chunked(self.list_dict, var_limit):
-                num = self.model_class.insert_many(batch).on_conflict(**conflict_resolution).as_rowcount().execute()
-
-                if isinstance(num, int):
-                    records_inserted += num
-                else:
-                    records_inserted += len(num)
+                records_inserted += self.insert_chunk(batch, conflict_resolution)
         db_et = time.time() - db_st
         print(f'Inserted {records_inserted}/{len(self.list_dict)} records in {db_et} seconds.')
         print(f'Rate: {int(len(self.list_dict) / db_et)}/s')
         return records_inserted
+
+    def insert_chunk(self, batch, conflict_resolution):
+        """
+        Inserts a single chunk of records that fits within the variable limit of the database
+        :param batch: List of record dictionaries
+        :param conflict_resolution: conflict resolution object
+        :return: The number of records inserted or updated
+        """
+        num = self.model_class.insert_many(batch).on_conflict(**conflict_resolution).as_rowcount().execute()
+        return num if isinstance(num, int) else len(num)
@@ -5,31 +5,83 @@ import time
 
 import boto3
 from playhouse.postgres_ext import PostgresqlExtDatabase, Model, CharField, DateTimeField, EXCLUDED, chunked,\
-    BigIntegerField
+    BigIntegerField, TextField, CompositeKey
+from peewee import OperationalError
 from psycopg2 import sql
 
-from task.dbm_base import DBManagerPeewee, TABLE_NAME, get_db_params
+from task.dbm_base import DBManagerPeewee, TABLE_NAME, DIRECTORY_TABLE_NAME, BATCH_COLUMNS, get_db_params
 
 DB_PSQL = PostgresqlExtDatabase(None)
 VAR_LIMIT_PSQL = 32766
-
-
-def get_db_manager_psql(database, **kwargs):
+SECRET_TTL = int(os.getenv('postgresql_secret_ttl', 300))
+# Connection parameters fetched from secrets manager, by ARN, with the monotonic time they expire at
+SECRET_CACHE = {}
+
+# Selects the names of the discovered records for up to batch_limit granules that have at least file_count files.
+# Parameters: provider prefix, collection_id, file_count, batch_limit, provider prefix, collection_id
+CLAIM_ROWS_CTE = """
+WITH granule_ids AS (
+SELECT granule_id
+FROM granule
+WHERE granule.name LIKE (%s) AND
+    granule.collection_id = (%s) AND
+    granule.status = 'discovered'
+GROUP BY granule_id
+HAVING COUNT(granule_id) >= (%s)
+ORDER BY MIN(discovered_date)
+LIMIT (%s)
+),
+rows AS (
+SELECT name
+FROM granule, granule_ids
+WHERE granule.name LIKE (%s) AND
+    granule.collection_id = (%s) AND
+    granule.status = 'discovered' AND
+    granule.granule_id = granule_ids.granule_id
+FOR UPDATE OF granule
+)"""
+
+
+def get_secret_db_params(secrets_arn, ttl=SECRET_TTL, refresh=False):
+    """
+    Fetches the database connection parameters from secrets manager. The result is kept for ttl seconds so warm
+    invocations do not repeat the request.
+    :param secrets_arn: ARN of the secret holding the database credentials
+    :param ttl: Seconds a fetched secret is used for
+    :param refresh: If True the secret is fetched again even if a cached copy has not expired
+    :return: Dictionary of connection parameters
+    """
+    cached = SECRET_CACHE.get(secrets_arn)
+    if cached and not refresh and time.monotonic() < cached[0]:
+        return dict(cached[1])
+
+    sm_client = boto3.client('secretsmanager')
+    secrets = json.loads(sm_client.get_secret_value(SecretId=secrets_arn).get('SecretString'))
+    db_params = get_db_params(secrets)
+    SECRET_CACHE[secrets_arn] = (time.monotonic() + ttl, db_params)
+    return dict(db_params)
+
+
+def get_db_manager_psql(database, create_tables=True, **kwargs):
     global DB_PSQL # noqa: F824
-    db_init_kwargs = {}
     if database:
         db_init_kwargs = get_db_params(kwargs)
         db_init_kwargs.update({'database': database})
+        DB_PSQL.init(**db_init_kwargs)
     else:
         secrets_arn = os.getenv('postgresql_secret_arn', None)
-        sm_client = boto3.client('secretsmanager')
-        secrets = json.loads(sm_client.get_secret_value(SecretId=secrets_arn).get('SecretString'))
-        db_init_kwargs = get_db_params(secrets)
+        DB_PSQL.init(**get_secret_db_params(secrets_arn))
+        try:
+            DB_PSQL.connect(reuse_if_open=True)
+        except OperationalError as e:
+            # The cached credentials may be from before the secret was rotated
+            print(f'Unable to connect, fetching {secrets_arn} again: {e}')
+            DB_PSQL.init(**get_secret_db_params(secrets_arn, refresh=True))
 
-    DB_PSQL.init(**db_init_kwargs)
-    DB_PSQL.create_tables([GranulePSQL], safe=True)
+    if create_tables:
+        DB_PSQL.create_tables([GranulePSQL, DirectoryCachePSQL], safe=True)
 
-    return DBManagerPSQL(DB_PSQL, GranulePSQL, **kwargs)
+    return DBManagerPSQL(DB_PSQL, GranulePSQL, directory_model=DirectoryCachePSQL, **kwargs)
 
 
 class GranulePSQL(Model):
@@ -47,6 +99,20 @@ class GranulePSQL(Model):
         table_name = TABLE_NAME
 
 
+class DirectoryCachePSQL(Model):
+    url = CharField()
+    collection_id = CharField()
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+    entries = TextField()
+    updated_date = DateTimeField(formats='YYYY-mm-dd HH:MM:SS', default=datetime.datetime.now)
+
+    class Meta:
+        database = DB_PSQL
+        table_name = DIRECTORY_TABLE_NAME
+        primary_key = CompositeKey('collection_id', 'url')
+
+
 class DBManagerPSQL(DBManagerPeewee):
     def __init__(self, database, model_class, **kwargs):
         self.model_class = model_class
@@ -94,56 +160,35 @@ class DBManagerPSQL(DBManagerPeewee):
             ignore_count = cur.rowcount
         print(f'Set status for {ignore_count} records to "ignored"')
 
-    def read_batch(self):
+    def claim_args(self):
         repeat_args = [f'{self.provider_full_url}%', self.collection_id]
-        query_args = repeat_args + [self.file_count, self.batch_limit] + repeat_args
+        return repeat_args + [self.file_count, self.batch_limit] + repeat_args
 
+    def read_batch(self):
+        """
+        Sets a batch of records to "queued".
+        :return: A list of dictionaries with the BATCH_COLUMNS of the claimed records, which is all the output needs
+        """
+        returning = ', '.join(f'granule.{column}' for column in BATCH_COLUMNS)
         update_query = sql.SQL(
-            """
-            WITH granule_ids AS (
-            SELECT granule_id
-            FROM granule
-            WHERE granule.name LIKE (%s) AND
-                granule.collection_id = (%s) AND
-                granule.status = 'discovered'
-            GROUP BY granule_id
-            HAVING COUNT(granule_id) >= (%s)
-            ORDER BY MIN(discovered_date)
-            LIMIT (%s)
-            ),
-            rows AS (
-            SELECT name
-            FROM granule, granule_ids
-            WHERE granule.name LIKE (%s) AND
-                granule.collection_id = (%s) AND
-                granule.status = 'discovered' AND
-                granule.granule_id = granule_ids.granule_id
-            FOR UPDATE OF granule
-            )
+            f"""
+            {CLAIM_ROWS_CTE}
             UPDATE granule
             SET status = 'queued'
             FROM rows
             WHERE rows.name = granule.name
-            RETURNING granule.*
+            RETURNING {returning}
             """
         )
 
         st = time.time()
         with self.database.cursor() as cur:
-            cur.execute(update_query, query_args)
-            # print(cur.mogrify(update_query, query_args).decode().replace('\n', '\r').strip()) # Uncomment when troubleshooting queries
+            cur.execute(update_query, self.claim_args())
+            # print(cur.mogrify(update_query, self.claim_args()).decode().replace('\n', '\r').strip()) # Uncomment when troubleshooting queries
             res = cur.fetchall()
 
         self.database.commit()
-        td = []
-        column_names = [
-            'name', 'granule_id', 'collection_id', 'status', 'etag', 'last_modified', 'discovered_date', 'size'
-        ]
-        for row in res:
-            temp_dict = {}
-            for column_name, value  in zip(column_names, row):
-                temp_dict.update({column_name: value})
-            td.append(temp_dict)
+        td = [dict(zip(BATCH_COLUMNS, row)) for row in res]
 
         et = time.time() - st
         print(f'Updated {len(td)} records in {et} seconds.')
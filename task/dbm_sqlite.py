@@ -1,15 +1,32 @@
 import datetime
 import os
+import random
+import time
 
-from playhouse.apsw_ext import APSWDatabase, CharField, DateTimeField, Model, EXCLUDED, chunked, BigIntegerField
+import apsw
+from playhouse.apsw_ext import APSWDatabase, CharField, DateTimeField, Model, EXCLUDED, chunked, BigIntegerField, \
+    TextField, CompositeKey
 
-from task.dbm_base import DBManagerPeewee, TABLE_NAME
+from task.dbm_base import DBManagerPeewee, TABLE_NAME, FIELD_COUNT, BATCH_COLUMNS, DIRECTORY_TABLE_NAME, \
+    DIRECTORY_FIELD_COUNT
 
 DB_SQLITE = APSWDatabase(None, vfs='unix-excl')
 VAR_LIMIT_SQLITE = 999
+SQLITE_BUSY_TIMEOUT = 30
+SQLITE_BUSY_RETRIES = 8
+SQLITE_RETRY_BASE_DELAY = 0.05
+SQLITE_RETRY_MAX_DELAY = 2
 
 
-def get_db_manager_sqlite(database, **kwargs):
+def get_db_manager_sqlite(database, sqlite_shared=False, create_tables=True, **kwargs):
+    """
+    Initializes the SQLite database and returns a database manager for it.
+    :param database: Path to the SQLite database file
+    :param sqlite_shared: If True the database is opened with normal file locking so several processes on the same host
+    can discover into and claim from the same file. Otherwise, the file is exclusively locked by this process.
+    :param create_tables: If False the tables are only created when the database file does not exist yet
+    :return: DBManagerSqlite
+    """
     db_init_kwargs = {
         'database': database,
         'timeout': 900,
@@ -20,10 +37,21 @@ def get_db_manager_sqlite(database, **kwargs):
             'temp_store': os.getenv('sqlite_temp_store')
         }
     }
+    if sqlite_shared:
+        db_init_kwargs.update({
+            'timeout': int(os.getenv('sqlite_busy_timeout', SQLITE_BUSY_TIMEOUT)),
+            'vfs': 'unix'
+        })
+        db_init_kwargs.get('pragmas').update({'synchronous': 'normal'})
+
     DB_SQLITE.init(**db_init_kwargs)
-    DB_SQLITE.create_tables([GranuleSQLite], safe=True)
+    dbm = DBManagerSqlite(
+        DB_SQLITE, GranuleSQLite, sqlite_shared=sqlite_shared, directory_model=DirectoryCacheSQLite, **kwargs
+    )
+    if create_tables or not os.path.isfile(database):
+        dbm.run_write(DB_SQLITE.create_tables, [GranuleSQLite, DirectoryCacheSQLite], safe=True)
 
-    return DBManagerSqlite(DB_SQLITE, GranuleSQLite, **kwargs)
+    return dbm
 
 
 class GranuleSQLite(Model):
@@ -39,11 +67,38 @@ class GranuleSQLite(Model):
     class Meta:
         database = DB_SQLITE
         table_name = TABLE_NAME
+        indexes = (
+            # Keyset scan over the discovered records of a collection in discovery order. The name is included so the
+            # provider prefix is checked from the index without reading each row.
+            (('collection_id', 'status', 'discovered_date', 'granule_id', 'name'), False),
+            # Per-granule file counts and claims
+            (('collection_id', 'status', 'granule_id', 'name'), False),
+        )
+
+
+class DirectoryCacheSQLite(Model):
+    url = CharField()
+    collection_id = CharField()
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+    entries = TextField()
+    updated_date = DateTimeField(formats='YYYY-mm-dd HH:MM:SS', default=datetime.datetime.now)
+
+    class Meta:
+        database = DB_SQLITE
+        table_name = DIRECTORY_TABLE_NAME
+        primary_key = CompositeKey('collection_id', 'url')
 
 
 class DBManagerSqlite(DBManagerPeewee):
-    def __init__(self, database, model_class, **kwargs):
+    def __init__(self, database, model_class, sqlite_shared=False, batch_cursor=None, **kwargs):
+        """
+        :param batch_cursor: The keyset_cursor returned by the read_batch of the previous invocation, if any
+        """
         self.model_class = model_class
+        self.sqlite_shared = sqlite_shared
+        self.busy_retries = int(os.getenv('sqlite_busy_retries', SQLITE_BUSY_RETRIES))
+        self.keyset_cursor = tuple(batch_cursor) if batch_cursor else ('', '')
         super().__init__(database, model_class, VAR_LIMIT_SQLITE, EXCLUDED, chunked, **kwargs)
 
     def db_replace(self):
@@ -53,6 +108,154 @@ class DBManagerSqlite(DBManagerPeewee):
         conflict_handling = {'action': 'replace'}
         return self.insert_many(conflict_handling)
 
+    def run_write(self, func, *args, **kwargs):
+        """
+        Runs func in its own write transaction. In shared mode the write lock is taken when the transaction begins and
+        the transaction is retried with jittered exponential backoff if another process holds the lock past the busy
+        timeout.
+        :param func: The function performing the writes
+        :return: The return value of func
+        """
+        if not self.sqlite_shared:
+            return func(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            try:
+                with self.database.atomic(lock_type='immediate'):
+                    return func(*args, **kwargs)
+            except (apsw.BusyError, apsw.LockedError) as e:
+                attempt += 1
+                if attempt > self.busy_retries:
+                    raise
+                delay = min(SQLITE_RETRY_MAX_DELAY, SQLITE_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1)
+                print(f'Database busy ({e}). Retry {attempt}/{self.busy_retries} in {delay:.2f} seconds...')
+                time.sleep(delay)
+
+    def insert_many(self, conflict_resolution):
+        """
+        In shared mode every chunk is committed in a separate short transaction so other processes are not locked out
+        for the duration of a large batch.
+        :param conflict_resolution: conflict resolution object
+        """
+        if not self.sqlite_shared:
+            return super().insert_many(conflict_resolution)
+
+        print(f'Inserting {len(self.list_dict)} records using short transactions...')
+        records_inserted = 0
+        db_st = time.time()
+        for batch in self.chunked(self.list_dict, self.var_limit // FIELD_COUNT):
+            records_inserted += self.run_write(self.insert_chunk, batch, conflict_resolution)
+        db_et = time.time() - db_st
+        print(f'Inserted {records_inserted}/{len(self.list_dict)} records in {db_et} seconds.')
+        print(f'Rate: {int(len(self.list_dict) / db_et)}/s')
+        return records_inserted
+
+    def flush_directory_cache(self):
+        """
+        In shared mode every chunk is written in a separate short transaction.
+        """
+        if not self.sqlite_shared:
+            return super().flush_directory_cache()
+
+        records_written = 0
+        for batch in self.chunked(self.directory_list, self.var_limit // DIRECTORY_FIELD_COUNT):
+            records_written += self.run_write(self.upsert_directory_chunk, batch)
+        print(f'Cached {records_written} directory listings.')
+        self.directory_list.clear()
+        return records_written
+
+    def read_batch(self):
+        """
+        Claims up to batch_limit granules that have at least file_count discovered files for the collection and
+        provider path, oldest first, and sets their status to "queued".
+        :return: A list of dictionaries containing the columns needed to generate output for the claimed files
+        """
+        st = time.time()
+        updated_records = self.run_write(self.claim_batch)
+        et = time.time() - st
+        print(f'Updated {len(updated_records)} records in {et} seconds.')
+        print(f'Rate: {int(len(updated_records) / et)}/s')
+
+        self.queued_files_count += len(updated_records)
+        return updated_records
+
+    def claim_batch(self):
+        """
+        Walks the discovered records in (discovered_date, granule_id) order one indexed page at a time, starting after
+        the keyset cursor of the previous call. The cursor is passed on between invocations as batch_cursor, so each
+        batch only scans the rows after the previous one instead of every incomplete granule before them. Granules
+        that are not yet complete are stepped over and will be seen again when a newly discovered file for them lands
+        after the cursor.
+        """
+        granule_ids = []
+        # A granule's rows can span pages, so one already chosen must not be chosen again from a later page
+        chosen = set()
+        cursor = self.keyset_cursor
+        scan_size = (self.batch_limit or VAR_LIMIT_SQLITE) * max(int(self.file_count), 1)
+        with self.database.atomic():
+            while not self.batch_limit or len(granule_ids) < self.batch_limit:
+                rows = self.scan_discovered(cursor, scan_size)
+                if not rows:
+                    break
+
+                complete = self.complete_granules(list(dict.fromkeys(row[1] for row in rows)))
+                for discovered_date, granule_id in rows:
+                    if self.batch_limit and len(granule_ids) >= self.batch_limit:
+                        break
+                    cursor = (discovered_date, granule_id)
+                    if granule_id in complete and granule_id not in chosen:
+                        chosen.add(granule_id)
+                        granule_ids.append(granule_id)
+
+            records = self.claim_granules(granule_ids)
+
+        self.keyset_cursor = cursor
+        return records
+
+    def provider_filter_params(self):
+        return [self.collection_id, len(self.provider_full_url), self.provider_full_url]
+
+    def scan_discovered(self, cursor, scan_size):
+        query = (
+            f'SELECT discovered_date, granule_id FROM {TABLE_NAME} '
+            "WHERE collection_id = ? AND status = 'discovered' AND substr(name, 1, ?) = ? "
+            'AND (discovered_date, granule_id) > (?, ?) '
+            'ORDER BY discovered_date, granule_id '
+            'LIMIT ?'
+        )
+        params = self.provider_filter_params() + list(cursor) + [scan_size]
+        return list(self.database.execute_sql(query, params))
+
+    def complete_granules(self, granule_ids):
+        complete = set()
+        for id_batch in self.chunked(granule_ids, VAR_LIMIT_SQLITE - 4):
+            query = (
+                f'SELECT granule_id FROM {TABLE_NAME} '
+                "WHERE collection_id = ? AND status = 'discovered' AND substr(name, 1, ?) = ? "
+                f'AND granule_id IN ({",".join("?" * len(id_batch))}) '
+                'GROUP BY granule_id '
+                'HAVING COUNT(*) >= ?'
+            )
+            params = self.provider_filter_params() + id_batch + [int(self.file_count)]
+            complete.update(row[0] for row in self.database.execute_sql(query, params))
+
+        return complete
+
+    def claim_granules(self, granule_ids):
+        records = []
+        for id_batch in self.chunked(granule_ids, VAR_LIMIT_SQLITE - 3):
+            query = (
+                f"UPDATE {TABLE_NAME} SET status = 'queued' "
+                "WHERE collection_id = ? AND status = 'discovered' AND substr(name, 1, ?) = ? "
+                f'AND granule_id IN ({",".join("?" * len(id_batch))}) '
+                f'RETURNING {", ".join(BATCH_COLUMNS)}'
+            )
+            params = self.provider_filter_params() + id_batch
+            records.extend(dict(zip(BATCH_COLUMNS, row)) for row in self.database.execute_sql(query, params))
+
+        return records
+
 
 if __name__ == '__main__':
     pass
@@ -5,6 +5,8 @@ import re
 from tempfile import mkdtemp
 
 from task.dbm_get import get_db_manager
+from task.file_definitions import FileDefinitions
+from task.granule_matcher import GranuleMatcher
 from task.logger import gdg_logger
 
 
@@ -52,6 +54,7 @@ class DiscoverGranulesBase(ABC):
         if not self.granule_id_extraction:
             self.granule_id_extraction = self.collection.get('granuleIdExtraction', '')
         self.dir_reg_ex = self.discover_tf.get('dir_reg_ex', None)
+        self.granule_matcher = None
         self.host = self.provider.get('external_host', self.provider.get('host', ''))
         self.config_stack = self.config.get('stack', {})
         self.files_list = self.config.get('collection', {}).get('files', {})
@@ -65,6 +68,8 @@ class DiscoverGranulesBase(ABC):
 
         self.discovered_files_count = self.discover_tf.get('discovered_files_count', 0)
         self.queued_files_count = self.discover_tf.get('queued_files_count', 0)
+        # Discovery has already completed in a previous invocation and this one only needs to claim and format a batch
+        self.continuation = self.discovered_files_count > 0 and not self.discover_tf.get('bookmark')
 
         protocol = self.provider.get('protocol', '')
         host = self.host.strip('/')
@@ -77,10 +82,23 @@ class DiscoverGranulesBase(ABC):
         gdg_logger.info(f'init queued_files_count: {self.queued_files_count}')
 
         db_type = db_type if db_type else self.discover_tf.get('db_type', os.getenv('db_type', 'sqlite'))
+        # Whether the database is kept for the next discovery of the collection
+        self.persistent_db = db_type != 'sqlite'
+        self.sqlite_shared = string_to_bool(
+            'sqlite_shared', self.discover_tf.get('sqlite_shared', os.getenv('sqlite_shared', False))
+        )
         if db_type == 'sqlite':
             db_suffix = self.meta.get('collection_type', 'static')
             db_filename = f'ghrc_discover_granules_{db_suffix}.db'
-            db_file_path = f'{mkdtemp()}/{db_filename}'
+            shared_store = event.get('shared_store', os.getenv('EBS_MNT'))
+            if self.sqlite_shared and shared_store:
+                db_file_path = f'{shared_store}/{db_filename}'
+                self.persistent_db = True
+            elif self.continuation:
+                # The temporary directory discovery wrote to is gone, so there is no file to create one for
+                db_file_path = ':memory:'
+            else:
+                db_file_path = f'{mkdtemp()}/{db_filename}'
         else:
             db_file_path = None
         self.transaction_size = self.discover_tf.get('transaction_size', 100000)
@@ -93,10 +111,14 @@ class DiscoverGranulesBase(ABC):
             'batch_limit': self.discover_tf.get('batch_limit'),
             'collection_id': self.collection_id,
             'provider_url': self.provider_url,
-            'file_count': self.file_count
+            'file_count': self.file_count,
+            'sqlite_shared': self.sqlite_shared,
+            # Only batches of the same discovery carry on from where the previous invocation stopped
+            'batch_cursor': self.discover_tf.get('batch_cursor') if self.continuation else None,
+            'create_tables': not self.continuation
         }
 
-        if self.use_cumulus_filter:
+        if self.use_cumulus_filter and not self.continuation:
             cumulus_kwargs = dict(kwargs)
             cumulus_kwargs.update({'db_type': 'cumulus', 'database': None})
             cumulus_dbm = get_db_manager(**cumulus_kwargs)
@@ -124,21 +146,16 @@ class DiscoverGranulesBase(ABC):
 
         return output_lst
 
-    def get_bucket_name(self, bucket_type):
-        bucket_name = ''
-        for _, bv in self.buckets.items():
-            if bv.get('type') == bucket_type:
-                bucket_name = bv.get('name')
-
-        return bucket_name
-
-    def get_file_description(self, filename):
-        file_desc = {}
-        for file_def in self.collection.get('files'):
-            if re.search(file_def.get('regex'), filename):
-                file_desc = file_def
+    @property
+    def matcher(self):
+        """
+        GranuleMatcher for the collection. It is only rebuilt if granule_id_extraction, granule_id or dir_reg_ex change.
+        """
+        key = (self.granule_id_extraction, self.granule_id, self.dir_reg_ex)
+        if self.granule_matcher is None or self.granule_matcher.key != key:
+            self.granule_matcher = GranuleMatcher(*key)
 
-        return file_desc
+        return self.granule_matcher
 
     def generate_cumulus_output(self, granule_dict_list):
         """
@@ -148,34 +165,29 @@ class DiscoverGranulesBase(ABC):
         https://github.com/nasa/cumulus/blob/master/tasks/sync-granule/schemas/input.json
         """
         temp_dict = {}
+        # Compiled once for the batch rather than matched and looked up again for every file
+        file_definitions = FileDefinitions(self.collection.get('files'), self.buckets)
+        matcher = self.matcher
+        provider_path = self.meta.get('provider_path')
         for granule in granule_dict_list:
             granule_name = granule.get('name')
-            res = granule_name.find(self.meta.get('provider_path'))
+            res = granule_name.find(provider_path)
             absolute_path = granule_name[res:]
             path_and_name = absolute_path.rsplit('/', maxsplit=1)
             path = path_and_name[0]
             filename = path_and_name[1]
 
-            file_def = self.get_file_description(filename)
-            file_type = file_def.get('type', '')
-            bucket_type = file_def.get('bucket', '')
+            file_type, bucket_name = file_definitions.describe(filename)
 
             # TODO: This can be simplified to just use the granuleIdExtraction once collections use a corrected one
-            gid_match = re.search(self.granule_id_extraction, filename)
-            if gid_match:
-                granule_id = gid_match.group(1)
-            else:
-                granule_id = re.search(self.granule_id, filename).group(0)
+            granule_id = matcher.cumulus_granule_id(filename)
 
             if granule_id not in temp_dict:
                 temp_dict[granule_id] = self.generate_cumulus_granule(granule_id)
 
             file_list = temp_dict[granule_id].get('files')
             file_list.append(
-                self.generate_cumulus_file(
-                    filename, path, granule.get('size'),
-                    self.get_bucket_name(bucket_type), file_type
-                )
+                self.generate_cumulus_file(filename, path, granule.get('size'), bucket_name, file_type)
             )
 
         return list(temp_dict.values())
@@ -256,6 +268,28 @@ class DiscoverGranulesBase(ABC):
 
         return ret_lst
 
+    def directory_cache_enabled(self):
+        """
+        :return: The directory_cache option, or False when the database is not kept for the next discovery, as a
+        SQLite database in a temporary directory is not, so the cached listings could never be read
+        """
+        directory_cache = string_to_bool('directory_cache', self.discover_tf.get('directory_cache', False))
+        if directory_cache and not self.persistent_db:
+            gdg_logger.warning(
+                'directory_cache needs db_type postgresql or sqlite_shared with EBS_MNT, listings will not be cached'
+            )
+            return False
+
+        return directory_cache
+
+    def batch_cursor(self):
+        """
+        :return: The keyset cursor after the last batch claimed, for the next invocation to continue the scan from, or
+        None if the database manager does not keep one
+        """
+        cursor = getattr(self.dbm, 'keyset_cursor', None)
+        return list(cursor) if cursor else None
+
     def read_batch(self):
         try:
             batch = self.dbm.read_batch()
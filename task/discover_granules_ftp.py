@@ -1,12 +1,18 @@
-import io
-import re
-from contextlib import redirect_stdout
+import concurrent.futures
+import ftplib
+import os
+import queue
 from ftplib import FTP
 
-import dateparser
-
-from task.discover_granules_base import DiscoverGranulesBase, check_reg_ex
+from task.discover_granules_base import DiscoverGranulesBase, string_to_bool
+from task.ftp_listing import MLSD_FACTS, parse_list_line, parse_mlsd_line, parse_mlst_modify
 from task.logger import gdg_logger
+from task.mtime_cache import DIRECTORY_REVALIDATE_RUNS, DirectoryListing, MtimeCache
+
+FTP_CONNECTIONS = 4
+# A server closing an idle session (421) or the control connection dropping. The connection is replaced and the
+# directory listed again once.
+FTP_RECONNECT_ERRORS = (ftplib.error_temp, EOFError, OSError)
 
 
 def setup_ftp_client(**kwargs):
@@ -22,15 +28,23 @@ class DiscoverGranulesFTP(DiscoverGranulesBase):
     """
     def __init__(self, event, context):
         super().__init__(event, context=context)
-        self.provider_path = self.config.get('provider_path')
-        self.depth = self.discover_tf.get('depth')
+        self.provider_path = self.config.get('provider_path', self.meta.get('provider_path', ''))
+        self.depth = abs(int(self.discover_tf.get('depth', 0)))
+        self.connections = max(
+            int(self.discover_tf.get('ftp_connections', os.getenv('ftp_connections', FTP_CONNECTIONS))), 1
+        )
+        self.recursive_listing = string_to_bool(
+            'ftp_recursive_listing',
+            self.discover_tf.get('ftp_recursive_listing', os.getenv('ftp_recursive_listing', False))
+        )
+        self.directory_cache = self.directory_cache_enabled()
+        self.revalidate_runs = int(self.discover_tf.get('directory_revalidate_runs', DIRECTORY_REVALIDATE_RUNS))
 
     def discover_granules(self):
         try:
-            ftp_client = setup_ftp_client(**self.provider)
-            self.discover(ftp_client)
-            ftp_client.close()
+            self.discover()
             self.dbm.flush_dict()
+            self.dbm.flush_directory_cache()
             batch = self.dbm.read_batch()
         finally:
             self.dbm.close_db()
@@ -43,48 +57,313 @@ class DiscoverGranulesFTP(DiscoverGranulesBase):
 
         return ret
 
-    def discover(self, ftp_client):
+    def discover(self):
+        """
+        Adds a record for each file under provider_path that matches granuleIdExtraction. Directories are listed
+        concurrently up to depth levels below provider_path.
+        """
         gdg_logger.info(f'Discovering in {self.provider_url}')
-        ftp_client.cwd(self.provider_path)
-        directory_list = []
-        with io.StringIO() as buffer, redirect_stdout(buffer):
-            ftp_client.retrlines('LIST')
-            output = buffer.getvalue()
-
-        self.process_ftp_list_output(output, directory_list)
-
-        if self.depth > 0:
-            self.depth -= 1
-            for directory in directory_list:
-                self.provider_path = directory
-                print(f'new_path: {self.provider_path}')
-
-        ftp_client.cwd('../')
-
-    def process_ftp_list_output(self, output, directory_list):
-        output_rows = output.splitlines()
-        for row in output_rows:
-            column_list = row.split()
-            filename = column_list[-1]
-            if row.startswith('d') and check_reg_ex(self.dir_reg_ex, self.provider_path):
-                # gdg_logger.info(f'{filename} was a directory')
-                directory_list.append(filename)
-            else:
-                granule_id_match = re.search(self.granule_id_extraction, str(filename))
-                if granule_id_match:
-                    if len(column_list) == 9:
-                        size = column_list[4]
-                        last_mod = ' '.join(column_list[5:8])
-                        full_url = f'{self.provider_url}{filename}'
-                        self.dbm.add_record(
-                            name=full_url, granule_id=granule_id_match.group(), collection_id=self.collection_id,
-                            etag='N/A', last_modified=dateparser.parse(last_mod), size=size
-                        )
-                    else:
-                        raise ValueError(f'FTP row format is not the expected length: {column_list}')
-                else:
-                    # gdg_logger.info(f'The granuleIdExtraction {self.granule_id_extraction} did not match the file name.')
-                    pass
+        FTPCrawler(self).crawl()
+
+    def process_ftp_entry(self, entry, directory, directory_list, records):
+        """
+        :param entry: FTPEntry of a directory listing or None for a line that is not an entry
+        :param directory: Path of the listed directory relative to provider_path, '' or ending in /
+        :param directory_list: List the entry is appended to if it is a subdirectory that matches dir_reg_ex
+        :param records: List the record of the entry is appended to if it is a file that matches granuleIdExtraction
+        """
+        if entry is None:
+            return
+        full_url = f'{self.provider_url}{directory}{entry.name}'
+        if entry.is_dir:
+            if self.matcher.match_directory(f'{full_url}/'):
+                directory_list.append(f'{directory}{entry.name}/')
+            return
+
+        granule_id_match = self.matcher.search(entry.name)
+        if granule_id_match:
+            records.append({
+                'name': full_url, 'granule_id': granule_id_match.group(), 'collection_id': self.collection_id,
+                'etag': 'N/A', 'last_modified': entry.last_modified, 'size': entry.size
+            })
+
+
+class FTPCrawler:
+    """
+    Crawls an FTP directory tree with a pool of up to ftp_connections logged in connections. Each directory is listed
+    by its absolute path on whichever connection is free, and connections stay logged in between directories, so a
+    deep tree is listed several directories at a time without a login or cwd('../') per directory.
+    Directories are listed with MLSD, which gives exact sizes and UTC modification times, if the server supports it and
+    with LIST otherwise. Each line is parsed and matched as it arrives so only the granules and subdirectories of a
+    directory are kept, and they are recorded in the calling thread. With directory_cache set, directories whose
+    modification time has not changed since the last crawl are replayed from the database instead of listed.
+    """
+
+    def __init__(self, dg_client):
+        self.dg_client = dg_client
+        self.idle_clients = queue.SimpleQueue()
+        self.root = None
+        self.mlsd = False
+        self.mtime_cache = MtimeCache(dg_client.dbm, dg_client.revalidate_runs) if dg_client.directory_cache else None
+
+    def crawl(self):
+        client = self.connect()
+        if self.dg_client.provider_path:
+            client.cwd(str(self.dg_client.provider_path))
+        self.root = client.pwd().rstrip('/')
+        self.mlsd = supports_mlsd(client)
+        self.idle_clients.put(client)
+
+        try:
+            directories = [('', self.dg_client.depth)]
+            if self.dg_client.recursive_listing:
+                directories = self.list_recursive(self.acquire())
+            if directories:
+                gdg_logger.info(f'Listing FTP directories with {"MLSD" if self.mlsd else "LIST"}')
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.dg_client.connections) as executor:
+                    self.walk(executor, directories)
+                if self.mtime_cache:
+                    gdg_logger.info(
+                        f'Listed {self.mtime_cache.listed} directories and replayed {self.mtime_cache.replayed}'
+                    )
+        finally:
+            self.close()
+
+    def list_recursive(self, client):
+        """
+        Lists the whole tree with one LIST -R, recording granules as the lines arrive.
+        :return: List of (directory, remaining depth) still to walk, empty if the tree was listed, the subdirectories of
+        provider_path if the server ignored -R or provider_path itself if it refused it
+        """
+        gdg_logger.info(f'Listing {self.root or "/"} with LIST -R')
+        parser = RecursiveListingParser(self.dg_client, self.root)
+        try:
+            client.cwd(f'{self.root}/')
+            client.retrlines('LIST -R', parser.feed)
+        except ftplib.error_perm as e:
+            gdg_logger.warning(f'LIST -R failed, walking the directories instead: {e}')
+            return [('', self.dg_client.depth)]
+        finally:
+            self.idle_clients.put(client)
+
+        if parser.sections:
+            gdg_logger.info(f'Listed {parser.sections} directories with LIST -R')
+            return []
+        if not parser.lines:
+            gdg_logger.warning('LIST -R returned nothing, walking the directories instead')
+            return [('', self.dg_client.depth)]
+        # A plain listing of provider_path, which has been recorded
+        gdg_logger.warning('LIST -R was not recursive, walking the directories instead')
+        return [(directory, depth) for directory, depth in parser.remaining.items() if directory]
+
+    def walk(self, executor, directories):
+        """
+        :param directories: List of (directory relative to provider_path, remaining depth) to list first
+        """
+        pending = {}
+        try:
+            for directory, depth in directories:
+                self.submit(executor, pending, directory, depth)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    directory, depth = pending.pop(future)
+                    listing = future.result()
+                    if self.mtime_cache:
+                        self.mtime_cache.store(f'{self.dg_client.provider_url}{directory}', listing)
+                    for record in listing.records:
+                        self.dg_client.dbm.add_record(**record)
+                    if depth > 0:
+                        for sub_directory, mtime in listing.directories:
+                            self.submit(executor, pending, sub_directory, depth - 1, mtime)
+        finally:
+            # Directories not started yet are dropped if one fails
+            for future in pending:
+                future.cancel()
+
+    def submit(self, executor, pending, directory, depth, mtime=None):
+        # The stored listing is read here since the database is only used from this thread
+        cached = self.mtime_cache.read(f'{self.dg_client.provider_url}{directory}') if self.mtime_cache else None
+        pending[executor.submit(self.list_directory, directory, mtime, cached)] = (directory, depth)
+
+    def connect(self):
+        client = setup_ftp_client(**self.dg_client.provider)
+        if self.mlsd:
+            set_mlsd_facts(client)
+        return client
+
+    def acquire(self):
+        try:
+            return self.idle_clients.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def list_directory(self, directory, mtime=None, cached=None):
+        """
+        :param directory: Path relative to provider_path, '' or ending in /
+        :param mtime: Modification time of the directory from the listing of its parent, None if it is not known
+        :param cached: The listing stored for the directory by the last crawl or None
+        :return: DirectoryListing
+        """
+        path = f'{self.root}/{directory}'
+        gdg_logger.info(f'Discovering in {path}')
+        client = self.acquire()
+        try:
+            try:
+                return self.retrieve_listing(client, path, directory, mtime, cached)
+            except FTP_RECONNECT_ERRORS as e:
+                gdg_logger.warning(f'Reconnecting to list {path} after: {e}')
+                close_client(client)
+                client = None
+                client = self.connect()
+                return self.retrieve_listing(client, path, directory, mtime, cached)
+        finally:
+            if client is not None:
+                self.idle_clients.put(client)
+
+    def retrieve_listing(self, client, path, directory, mtime=None, cached=None):
+        if self.mtime_cache and mtime is None:
+            mtime = self.directory_mtime(client, path)
+        if cached is not None:
+            listing = self.mtime_cache.replay(cached, mtime)
+            if listing:
+                gdg_logger.info(f'Not modified, replaying cached listing for {path}')
+                return listing
+
+        client.cwd(path)
+        records = []
+        directories = []
+
+        def process_entry(entry, exact_mtime):
+            if entry is None:
+                return
+            directory_list = []
+            self.dg_client.process_ftp_entry(entry, directory, directory_list, records)
+            # LIST times are to the minute at best, so a directory changed again within the same minute would look
+            # unchanged. Subdirectories listed with LIST get no modification time and are always listed.
+            mtime = entry.last_modified if exact_mtime else None
+            directories.extend((sub_directory, mtime) for sub_directory in directory_list)
+
+        if self.mlsd:
+            try:
+                client.retrlines('MLSD', lambda line: process_entry(parse_mlsd_line(line), True))
+                return DirectoryListing(records, directories, mtime, 0)
+            except ftplib.error_perm as e:
+                if not str(e).startswith('50'):
+                    raise
+                # Advertised but not implemented for this directory or server
+                gdg_logger.warning(f'MLSD failed, listing with LIST from now on: {e}')
+                self.mlsd = False
+                records.clear()
+                directories.clear()
+
+        client.retrlines('LIST', lambda line: process_entry(parse_list_line(line), False))
+        return DirectoryListing(records, directories, mtime, 0)
+
+    def directory_mtime(self, client, path):
+        """
+        :return: The modification time MLST gives for path or None if the server does not support it
+        """
+        if not self.mlsd:
+            return None
+        try:
+            return parse_mlst_modify(client.sendcmd(f'MLST {path}'))
+        except ftplib.error_perm:
+            return None
+
+    def close(self):
+        while True:
+            try:
+                close_client(self.idle_clients.get_nowait())
+            except queue.Empty:
+                break
+
+
+class RecursiveListingParser:
+    """
+    Parses LIST -R output, a section for each directory headed by its path and a colon after a blank line, one line
+    at a time. Granules are recorded as their lines arrive. Sections of directories beyond depth or not matching
+    dir_reg_ex, or below one that is, are skipped. ls -R lists a directory before its subdirectories, so whether a
+    section is wanted is known from the sections before it.
+    """
+
+    def __init__(self, dg_client, root):
+        self.dg_client = dg_client
+        self.root = root
+        # Directories relative to the root whose entries are wanted and the depth remaining below them
+        self.remaining = {'': dg_client.depth}
+        # The directory of the current section or None if it is skipped. Entries before any header are the root's.
+        self.directory = ''
+        self.sections = 0
+        self.lines = 0
+        self.previous_blank = True
+
+    def feed(self, line):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            self.previous_blank = True
+            return
+
+        self.lines += 1
+        entry = parse_list_line(line)
+        if entry is None and self.previous_blank and line.endswith(':'):
+            self.sections += 1
+            directory = self.section_directory(line[:-1])
+            self.directory = directory if directory in self.remaining else None
+        elif self.directory is not None:
+            directory_list = []
+            records = []
+            self.dg_client.process_ftp_entry(entry, self.directory, directory_list, records)
+            for record in records:
+                self.dg_client.dbm.add_record(**record)
+            depth = self.remaining[self.directory]
+            if depth > 0:
+                for sub_directory in directory_list:
+                    self.remaining[sub_directory] = depth - 1
+        self.previous_blank = False
+
+    def section_directory(self, path):
+        """
+        :param path: Section header without the colon, relative as in ./y2021/m03 or y2021/m03, or absolute
+        :return: The directory relative to the root, '' or ending in /
+        """
+        if path.startswith('/'):
+            if path != self.root and not path.startswith(f'{self.root}/'):
+                return path
+            path = path[len(self.root):]
+        elif path.startswith('./'):
+            path = path[2:]
+        path = path.strip('/')
+        return '' if path in ('', '.') else f'{path}/'
+
+
+def supports_mlsd(client):
+    """
+    :return: True if the FEAT reply of the server lists MLST, which covers MLSD
+    """
+    try:
+        features = client.sendcmd('FEAT')
+    except ftplib.Error:
+        return False
+    if not any(line.split()[0].upper() == 'MLST' for line in features.splitlines()[1:-1] if line.split()):
+        return False
+    set_mlsd_facts(client)
+    return True
+
+
+def set_mlsd_facts(client):
+    try:
+        client.sendcmd(f'OPTS MLST {MLSD_FACTS}')
+    except ftplib.Error:
+        # The server's default facts are used
+        pass
+
+
+def close_client(client):
+    try:
+        client.close()
+    except OSError:
+        pass
 
 
 if __name__ == "__main__":
@@ -1,16 +1,31 @@
-import re
+import asyncio
+import codecs
+import datetime
+from collections import namedtuple
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
 
-import dateparser
-import requests
 import urllib3
-from bs4 import BeautifulSoup
 import concurrent.futures
 
-from task.discover_granules_base import DiscoverGranulesBase, check_reg_ex
+from task.credentials import decrypt_credential
+from task.discover_granules_base import DiscoverGranulesBase, string_to_bool
+from task.http_auth import EARTHDATA_AUTH_HOST, RedirectCache
+from task.http_catalog import get_catalog_reader
+from task.http_limiter import AdaptiveLimiter, THROTTLE_STATUS_CODES
+from task.http_listing import ListingEntry, ListingParser, dump_entries, entries_in_utc, load_entries
+from task.http_session import HTTP_RETRIES, HTTP_TIMEOUT, IDENTITY_ENCODING, create_session, log_connection_stats
 from task.logger import gdg_logger
+from task.timestamp import parse_timestamp
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+HTTP_CONCURRENCY = 16
+LISTING_CHUNK_SIZE = 64 * 1024
+
+# A requested directory page. entries is None when the server answered 304 Not Modified.
+DirectoryPage = namedtuple('DirectoryPage', ['url', 'entries', 'etag', 'last_modified'])
+
 
 class DiscoverGranulesHTTP(DiscoverGranulesBase):
     """
@@ -20,14 +35,31 @@ class DiscoverGranulesHTTP(DiscoverGranulesBase):
     def __init__(self, event, context):
         super().__init__(event, context=context)
         self.depth = abs(int(self.discover_tf.get('depth', 3)))
+        self.concurrency = max(int(self.discover_tf.get('http_concurrency', HTTP_CONCURRENCY)), 1)
+        self.listing_metadata = string_to_bool('listing_metadata', self.discover_tf.get('listing_metadata', False))
+        listing_timezone = self.discover_tf.get('listing_timezone', 'UTC')
+        self.listing_timezone = datetime.timezone.utc if listing_timezone == 'UTC' else ZoneInfo(listing_timezone)
+        self.catalog_reader = get_catalog_reader(self.discover_tf.get('http_catalog'), self.discover_tf)
+        self.directory_cache = self.directory_cache_enabled()
+        self.concurrency_metrics = {}
+        self.pool_size = max(int(self.discover_tf.get('http_pool_size', self.concurrency)), 1)
+        self.retries = max(int(self.discover_tf.get('http_retries', HTTP_RETRIES)), 0)
+        self.timeout = float(self.discover_tf.get('http_timeout', HTTP_TIMEOUT))
+        self.compression = string_to_bool('http_compression', self.discover_tf.get('http_compression', True))
+        self.auth_redirects = string_to_bool('http_auth_redirects', self.discover_tf.get('http_auth_redirects', False))
+        self.auth_host = self.discover_tf.get('http_auth_host', EARTHDATA_AUTH_HOST)
 
     def discover_granules(self):
         gdg_logger.info(f'granule_id_extraction": {self.granule_id_extraction}')
         gdg_logger.info(f'granule_id": {self.granule_id}')
         try:
-            session = requests.Session()
+            session = create_session(
+                self.pool_size, self.retries, self.compression, timeout=self.timeout, **self.auth_config()
+            )
             self.discover(session)
+            log_connection_stats(session)
             self.dbm.flush_dict()
+            self.dbm.flush_directory_cache()
             batch = self.dbm.read_batch()
         finally:
             self.dbm.close_db()
@@ -35,75 +67,324 @@ class DiscoverGranulesHTTP(DiscoverGranulesBase):
         ret = {
             'discovered_files_count': self.dbm.discovered_files_count + self.discovered_files_count,
             'queued_files_count': self.dbm.queued_files_count,
-            'batch': batch
+            'batch': batch,
+            'http_concurrency_settled': {
+                host: metrics.get('concurrency') for host, metrics in self.concurrency_metrics.items()
+            }
         }
 
         return ret
 
     def discover(self, session):
         """
-        Fetch the link of the granules in the host url_path
-        :return: Returns a dictionary containing the path, etag, and the last modified date of a granule
-        {'http://path/to/granule/file.extension': { 'ETag': 'S3ETag', 'Last-Modified': '1645564956.0},...}
-        """
-        gdg_logger.info(f'Discovering in {self.provider_url}')
-        directory_list = []
-        response = session.get(self.provider_url)
-        html = BeautifulSoup(response.text, features='html.parser')
-        urls = []
-        granule_count = 0
-        for a_tag in html.findAll('a', href=True):
-            href = a_tag.get('href')
-            if href not in self.provider_url:
-                url_segment = a_tag.get('href').rstrip('/').rsplit('/', 1)[-1]
-                # gdg_logger.info(f'segment: {url_segment}')
-                full_path = f'{self.provider_url.rstrip("/")}/{url_segment}'
-                urls.append(full_path)
-            else:
-                # gdg_logger.info(f'ignoring parent directory: {href}')
-                pass
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for url in urls:
-                futures.append(executor.submit(session.head, url, allow_redirects=True))
-
-            for future in concurrent.futures.as_completed(futures):
-                response = future.result()
-                full_path = response.url
-                headers = response.headers
-                etag = headers.get('ETag', '').strip('"')
-                last_modified = headers.get('Last-Modified', '')
-                size = int(headers.get('Content-Length', 0))
-                # print(f're.search {self.granule_id_extraction} vs {full_path}')
-                granule_id = re.search(self.granule_id_extraction, full_path)
-                # print(granule_id)
-                if granule_id:
-                    self.dbm.add_record(
-                        name=full_path, granule_id=granule_id.group(),
-                        collection_id=self.collection_id, etag=etag,
-                        last_modified=dateparser.parse(last_modified), size=size
-                    )
-                    granule_count += 1
-
-                elif (not etag and not last_modified) and check_reg_ex(self.dir_reg_ex, full_path):
-                    directory_list.append(f'{full_path.rstrip("/")}/')
-                    # gdg_logger.info(f'Directory found: {directory_list[-1]}')
-                else:
-                    # gdg_logger.warning(f'Notice: {full_path} not processed as granule or directory.')
-                    pass
-
-        # gdg_logger.info(f'Granules found: {granule_count}')
-        # gdg_logger.info(f'Directories found: {len(directory_list)}')
-
-        if self.depth > 0 and len(directory_list) > 0:
-            self.depth -= 1
-            current_path = self.provider_url
-            for directory in directory_list:
-                self.provider_url = directory
-                self.discover(session)
-            self.provider_url = current_path
-            self.depth += 1
+        Crawls the provider starting at provider_url and adds a record for every file that matches the
+        granuleIdExtraction. Directories are crawled concurrently up to depth levels below provider_url. When
+        http_catalog is set the provider's catalog pages are read instead of HTML directory listings.
+        """
+        asyncio.run(HTTPCrawler(self, session).crawl())
+
+    def auth_config(self):
+        """
+        :return: Keyword arguments for create_session with the login host and the provider's credentials when
+        http_auth_redirects is enabled
+        """
+        if not self.auth_redirects:
+            return {}
+        encrypted = self.provider.get('encrypted', False)
+        credentials = (
+            decrypt_credential(self.provider.get('username'), encrypted),
+            decrypt_credential(self.provider.get('password'), encrypted)
+        )
+        return {'auth_host': self.auth_host, 'credentials': credentials}
+
+    def read_listing(self, session, url, cached=None):
+        """
+        Requests a directory page and parses it while it downloads. If the directory is cached the request is made
+        conditional on the cached validators and the page is not parsed when the server reports it has not changed.
+        :param session: requests Session
+        :param url: URL of the directory
+        :param cached: The directory cache record for the directory or None
+        :return: DirectoryPage
+        """
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached.get('etag')
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached.get('last_modified')
+
+        with session.get(url, stream=True, headers=headers) as response:
+            if response.status_code in THROTTLE_STATUS_CODES:
+                response.raise_for_status()
+            directory = f'{str(response.url).rstrip("/")}/'
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if cached and response.status_code == 304:
+                return DirectoryPage(
+                    directory, None, etag or cached.get('etag'), last_modified or cached.get('last_modified')
+                )
+            return DirectoryPage(directory, self.get_links(directory, response), etag, last_modified)
+
+    def get_links(self, url, response):
+        """
+        Extracts the links on a directory page that are not the parent directory or the page itself. The body is
+        decoded and fed to the listing parser in chunks as it is received rather than loaded whole.
+        :param url: The URL of the directory page
+        :param response: The streamed response for the directory page
+        :return: List of ListingEntry for the links on the page with the size and modification time the listing shows
+        """
+        parser = ListingParser(url)
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        for chunk in response.iter_content(chunk_size=LISTING_CHUNK_SIZE):
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', final=True))
+        entries = parser.close()
+        if not self.listing_metadata:
+            return [entry._replace(size=None, last_modified=None) for entry in entries]
+
+        return entries_in_utc(entries, self.listing_timezone)
+
+    def process_listing_entry(self, entry, depth):
+        """
+        Handles a link from a directory listing without requesting it when the listing says enough about it. Files that
+        match the granuleIdExtraction and have a size and modification time on the page are added directly, and links
+        marked as directories are crawled if dir_reg_ex allows it.
+        :param entry: ListingEntry for the link
+        :param depth: Remaining depth below the directory the link was found in
+        :return: Tuple of (directory URL to crawl or None, True if the link still needs a HEAD request)
+        """
+        is_directory_candidate = depth > 0 and self.matcher.match_directory(entry.url)
+        if entry.is_dir:
+            # Catalog readers return the exact URL of the referenced catalog page
+            directory = entry.url if self.catalog_reader else f'{entry.url.rstrip("/")}/'
+            return directory if is_directory_candidate else None, False
+
+        granule = self.matcher.match_granule(entry.url, group=0)
+        if granule:
+            if entry.size is None or entry.last_modified is None:
+                return None, True
+            self.dbm.add_record(
+                name=entry.url, granule_id=granule[1],
+                collection_id=self.collection_id, etag=entry.etag or 'N/A',
+                last_modified=entry.last_modified, size=entry.size
+            )
+            return None, False
+
+        # A link the listing does not mark as a file may still be a directory
+        return None, entry.is_dir is None and is_directory_candidate
+
+    def head_entry(self, response):
+        """
+        :return: ListingEntry with what a HEAD response says about a link, for the directory cache
+        """
+        headers = response.headers
+        etag = headers.get('ETag', '').strip('"')
+        last_modified = headers.get('Last-Modified', '')
+        if not etag and not last_modified and not self.matcher.search(response.url):
+            return ListingEntry(response.url, True, None, None)
+
+        return ListingEntry(
+            response.url, False, int(headers.get('Content-Length', 0)), parse_timestamp(last_modified), etag
+        )
+
+    def process_head_response(self, response):
+        """
+        Adds a record for the response if it is a granule file.
+        :return: The URL of the directory if the response looks like one and it matches dir_reg_ex, otherwise None
+        """
+        full_path = response.url
+        headers = response.headers
+        etag = headers.get('ETag', '').strip('"')
+        last_modified = headers.get('Last-Modified', '')
+        size = int(headers.get('Content-Length', 0))
+        granule = self.matcher.match_granule(full_path, group=0)
+        if granule:
+            self.dbm.add_record(
+                name=full_path, granule_id=granule[1],
+                collection_id=self.collection_id, etag=etag,
+                last_modified=parse_timestamp(last_modified), size=size
+            )
+        elif (not etag and not last_modified) and self.matcher.match_directory(full_path):
+            return f'{full_path.rstrip("/")}/'
+        else:
+            # gdg_logger.warning(f'Notice: {full_path} not processed as granule or directory.')
+            pass
+
+        return None
+
+
+class HTTPCrawler:
+    """
+    Crawls a directory tree with a shared work queue of directories. All page GETs and HEADs go through an adaptive
+    concurrency limit per host that is capped at http_concurrency, and a visited set keeps cross-linked directories and
+    files from being requested twice. Files are only requested when the directory listing does not show what is needed
+    to record them.
+    """
+
+    def __init__(self, dg_client, session):
+        self.dg_client = dg_client
+        self.session = session
+        self.concurrency = dg_client.concurrency
+        self.visited_directories = set()
+        self.visited_urls = set()
+        self.queue = None
+        self.limiters = {}
+        self.executor = None
+        self.error = None
+        self.redirect_cache = RedirectCache() if dg_client.auth_redirects else None
+        self.auth_locks = {}
+        self.authenticated_hosts = set()
+
+    async def crawl(self):
+        self.queue = asyncio.Queue()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            root_url = self.dg_client.provider_url
+            if self.dg_client.catalog_reader:
+                root_url = self.dg_client.catalog_reader.root_url(root_url)
+            self.enqueue(root_url, self.dg_client.depth)
+            workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+            await self.queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            self.executor.shutdown()
+            for host, limiter in self.limiters.items():
+                metrics = limiter.metrics()
+                gdg_logger.info(f'HTTP concurrency for {host}: {metrics}')
+                self.dg_client.concurrency_metrics[host] = metrics
+            if self.redirect_cache:
+                gdg_logger.info(
+                    f'HEAD requests sent straight to a cached redirect target: {self.redirect_cache.hits}, '
+                    f'following redirects: {self.redirect_cache.misses}'
+                )
+
+        if self.error:
+            raise self.error
+
+    def enqueue(self, directory, depth):
+        if directory not in self.visited_directories:
+            self.visited_directories.add(directory)
+            self.queue.put_nowait((directory, depth))
+
+    async def worker(self):
+        while True:
+            directory, depth = await self.queue.get()
+            try:
+                if not self.error:
+                    await self.crawl_directory(directory, depth)
+            except Exception as e:  # pylint: disable=broad-except
+                gdg_logger.error(f'Error crawling {directory}: {e}')
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    async def request(self, url, method, *args, latency_signal=False, **kwargs):
+        """
+        Runs a blocking request for url in the thread pool under the limiter for the host of url.
+        """
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = AdaptiveLimiter(host, self.concurrency)
+        return await self.limiters[host].call(self.executor, lambda: method(*args, **kwargs), latency_signal)
+
+    async def head(self, url):
+        """
+        Requests the headers for url following any redirects. With http_auth_redirects the first request to a host
+        goes through the login before any other request is sent to it, and files are requested at the directory their
+        directory was seen redirecting to, so once the login cookies are set a HEAD is a single round trip.
+        """
+        if not self.redirect_cache:
+            return await self.request_head(url)
+
+        host = urlsplit(url).netloc
+        if host not in self.authenticated_hosts:
+            async with self.auth_locks.setdefault(host, asyncio.Lock()):
+                if host not in self.authenticated_hosts:
+                    response = await self.request_head(url)
+                    self.authenticated_hosts.add(host)
+                    self.redirect_cache.learn(url, response)
+                    return response
+
+        target = self.redirect_cache.resolve(url)
+        if target != url:
+            response = await self.request_head(target)
+            if response.status_code < 400:
+                self.redirect_cache.hit()
+                return response
+            self.redirect_cache.forget(url)
+
+        response = await self.request_head(url)
+        self.redirect_cache.learn(url, response)
+
+        return response
+
+    async def request_head(self, url):
+        # Asks for the uncompressed file so Content-Length is the size of the file as stored
+        return await self.request(
+            url, self.session.head, url, allow_redirects=True, headers=IDENTITY_ENCODING, latency_signal=True
+        )
+
+    async def list_directory(self, directory):
+        """
+        :return: Tuple of (list of ListingEntry, DirectoryPage or None if the listing should not be cached)
+        """
+        cached = self.dg_client.dbm.read_directory_cache(directory) if self.dg_client.directory_cache else None
+        page = await self.request(directory, self.dg_client.read_listing, self.session, directory, cached)
+        if page.url != directory:
+            if page.url in self.visited_directories:
+                # The directory redirected to one that has already been queued
+                return [], None
+            self.visited_directories.add(page.url)
+
+        if page.entries is None:
+            gdg_logger.info(f'Not modified, replaying cached listing for {directory}')
+            return load_entries(cached.get('entries')), None
+
+        cacheable = self.dg_client.directory_cache and (page.etag or page.last_modified)
+        return page.entries, page if cacheable else None
+
+    async def crawl_directory(self, directory, depth):
+        gdg_logger.info(f'Discovering in {directory}')
+        page = None
+        if self.dg_client.catalog_reader:
+            entries = await self.request(directory, self.dg_client.catalog_reader.read, self.session, directory)
+            entries = entries_in_utc(entries, self.dg_client.listing_timezone)
+        else:
+            entries, page = await self.list_directory(directory)
+
+        urls = set()
+        for entry in entries:
+            if entry.url in self.visited_urls:
+                continue
+            self.visited_urls.add(entry.url)
+            sub_directory, needs_head = self.dg_client.process_listing_entry(entry, depth)
+            if sub_directory:
+                self.enqueue(sub_directory, depth - 1)
+            elif needs_head:
+                urls.add(entry.url)
+
+        responses = await asyncio.gather(*[self.head(url) for url in urls])
+        resolved = {}
+        for url, response in zip(urls, responses):
+            if page:
+                resolved[url] = self.dg_client.head_entry(response)
+            if response.url not in urls:
+                if response.url in self.visited_urls:
+                    # A redirect resolved to a file or directory that has already been seen
+                    continue
+                self.visited_urls.add(response.url)
+
+            sub_directory = self.dg_client.process_head_response(response)
+            if sub_directory and depth > 0:
+                self.enqueue(sub_directory, depth - 1)
+
+        if page:
+            # Links that had to be requested are stored with what the HEAD returned so they are not requested again
+            # when the listing is replayed
+            cache_entries = dump_entries([resolved.get(entry.url, entry) for entry in entries])
+            self.dg_client.dbm.write_directory_cache(directory, page.etag, page.last_modified, cache_entries)
 
 
 if __name__ == '__main__':
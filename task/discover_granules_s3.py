@@ -1,13 +1,20 @@
 import concurrent.futures
 import os
 import re
+from collections import deque
 
 import boto3
 
-from task.discover_granules_base import DiscoverGranulesBase, check_reg_ex
+from task.discover_granules_base import DiscoverGranulesBase, string_to_bool
+from task.granule_matcher import GranuleMatcher
 from task.logger import gdg_logger
+from task.s3_listing import enable_fast_listing
 
 ONE_MEBIBIT = 1048576
+# Listing pages queued for each matching process before the oldest result is waited on
+MATCH_PAGES_PER_PROCESS = 2
+# The GranuleMatcher of a matching process, built once by init_match_worker
+WORKER_MATCHER = None
 
 
 def get_ssm_value(id_name, ssm_client):
@@ -66,6 +73,41 @@ def get_s3_resp_iterator(host, prefix, s3_client, pagination_config=None, start_
     )
 
 
+def match_s3_object(s3_object, key_prefix, matcher):
+    """
+    :param s3_object: Object from the Contents of a ListObjectsV2 page
+    :param key_prefix: protocol://host/ prepended to the key to make the record name
+    :param matcher: GranuleMatcher for the collection
+    :return: Tuple of (name, granule_id, etag, last_modified, size) or None if the object is not a granule
+    """
+    key = f'{key_prefix}{s3_object["Key"]}'
+    key_dir, url_segment = key.rsplit('/', 1)
+    granule = matcher.match_granule(key, url_segment)
+    if granule and matcher.match_directory(key_dir):
+        return key, granule[1], s3_object['ETag'].strip('"'), s3_object['LastModified'], int(s3_object['Size'])
+
+    return None
+
+
+def init_match_worker(matcher_key):
+    global WORKER_MATCHER  # pylint: disable=global-statement
+    WORKER_MATCHER = GranuleMatcher(*matcher_key)
+
+
+def match_s3_page(contents, key_prefix):
+    """
+    Runs in a matching process.
+    :return: List of record tuples from match_s3_object for the granules on a listing page
+    """
+    records = []
+    for s3_object in contents:
+        record = match_s3_object(s3_object, key_prefix, WORKER_MATCHER)
+        if record:
+            records.append(record)
+
+    return records
+
+
 class DiscoverGranulesS3(DiscoverGranulesBase):
     """
     Class to discover granules from S3 provider
@@ -77,6 +119,10 @@ class DiscoverGranulesS3(DiscoverGranulesBase):
         self.prefix = str(self.collection['meta']['provider_path']).lstrip('/')
         self.bookmark = self.discover_tf.get('bookmark', '')
         self.early_return_threshold = int(os.getenv('early_return_threshold', 0)) * 1000
+        self.match_processes = int(self.discover_tf.get('match_processes', os.getenv('match_processes', 0)))
+        self.fast_listing = string_to_bool(
+            's3_fast_listing', self.discover_tf.get('s3_fast_listing', os.getenv('s3_fast_listing', False))
+        )
 
     def discover_granules(self):
         ret = {}
@@ -84,6 +130,8 @@ class DiscoverGranulesS3(DiscoverGranulesBase):
             gdg_logger.info(f'Discovering in {self.provider_url}')
             s3_client = get_s3_client() if None in [self.key_id_name, self.secret_key_name] \
                 else get_s3_client_with_keys(self.key_id_name, self.secret_key_name)
+            if self.fast_listing:
+                enable_fast_listing(s3_client)
             start_after = self.discover_tf.get('bookmark', '')
             self.bookmark = self.discover(get_s3_resp_iterator(
                 self.host, self.prefix, s3_client, start_after=start_after)
@@ -124,40 +172,80 @@ class DiscoverGranulesS3(DiscoverGranulesBase):
            ...
         }
         """
+        if self.match_processes > 1:
+            pool = self.create_match_pool()
+            if pool:
+                with pool:
+                    return self.discover_parallel(response_iterator, pool)
+
+        matcher = self.matcher
+        key_prefix = f'{self.provider.get("protocol")}://{self.provider.get("host")}/'
         for page in response_iterator:
             for s3_object in page.get('Contents', {}):
                 last_s3_key = s3_object["Key"]
-                key = f'{self.provider.get("protocol")}://{self.provider.get("host")}/{s3_object["Key"]}'
-                sections = str(key).rsplit('/', 1)
-                key_dir = sections[0]
-                url_segment = sections[1]
-                if check_reg_ex(self.granule_id_extraction, url_segment) and check_reg_ex(self.dir_reg_ex, key_dir):
-                    etag = s3_object['ETag'].strip('"')
-                    last_modified = s3_object['LastModified']
-                    size = int(s3_object['Size'])
-                    reg_res = re.search(self.granule_id_extraction, url_segment)
-                    if reg_res:
-                        granule_id = reg_res.group(1)
-                        self.dbm.add_record(
-                            name=key, granule_id=granule_id,
-                            collection_id=self.collection_id, etag=etag,
-                            last_modified=last_modified, size=size
-                        )
-
-                    else:
-                        # gdg_logger.warning(
-                        #     f'The collection\'s granuleIdExtraction {self.granule_id_extraction}'
-                        #     f' did not match the filename {url_segment}.'
-                        # )
-                        pass
+                record = match_s3_object(s3_object, key_prefix, matcher)
+                if record:
+                    self.add_s3_records([record])
 
                 # Check Time
-                if self.lambda_context and self.lambda_context.get_remaining_time_in_millis() < self.early_return_threshold:
+                if self.out_of_time():
                     gdg_logger.info(f'Doing early return. Last key: {last_s3_key}')
                     return last_s3_key
 
         return None
 
+    def create_match_pool(self):
+        """
+        :return: ProcessPoolExecutor with match_processes processes or None if processes cannot be started here, as in
+        Lambda where there is no /dev/shm for the pool's semaphores
+        """
+        try:
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.match_processes, initializer=init_match_worker, initargs=(self.matcher.key,)
+            )
+        except (OSError, NotImplementedError) as e:
+            gdg_logger.warning(f'Unable to start {self.match_processes} matching processes, matching in-process: {e}')
+            return None
+
+    def discover_parallel(self, response_iterator, pool):
+        """
+        Hands each listing page to a matching process while the next page is requested. The records come back in page
+        order so an early return leaves every key up to the bookmark recorded.
+        :return: The last key on the last page matched if discovery is returning early, otherwise None
+        """
+        key_prefix = f'{self.provider.get("protocol")}://{self.provider.get("host")}/'
+        pending = deque()
+        for page in response_iterator:
+            contents = page.get('Contents', [])
+            if not contents:
+                continue
+            pending.append(pool.submit(match_s3_page, contents, key_prefix))
+            if len(pending) >= self.match_processes * MATCH_PAGES_PER_PROCESS:
+                self.add_s3_records(pending.popleft().result())
+
+            if self.out_of_time():
+                last_s3_key = contents[-1]['Key']
+                while pending:
+                    self.add_s3_records(pending.popleft().result())
+                gdg_logger.info(f'Doing early return. Last key: {last_s3_key}')
+                return last_s3_key
+
+        while pending:
+            self.add_s3_records(pending.popleft().result())
+
+        return None
+
+    def add_s3_records(self, records):
+        for name, granule_id, etag, last_modified, size in records:
+            self.dbm.add_record(
+                name=name, granule_id=granule_id,
+                collection_id=self.collection_id, etag=etag,
+                last_modified=last_modified, size=size
+            )
+
+    def out_of_time(self):
+        return self.lambda_context and self.lambda_context.get_remaining_time_in_millis() < self.early_return_threshold
+
     def move_granule(
             self, s3_client_source, s3_client_destination, granule_dict,
             destination_bucket=f'{os.getenv("stackName")}-private'
@@ -1,15 +1,31 @@
-import base64
+import concurrent.futures
 import os
-import re
+import queue
+import shlex
+import stat
 import tempfile
+import threading
+import time
 
 import boto3
-import dateparser
-
 import paramiko
 
-from task.discover_granules_base import DiscoverGranulesBase, check_reg_ex
+from task.credentials import kms_decrypt_ciphertext
+from task.discover_granules_base import DiscoverGranulesBase, string_to_bool
 from task.logger import gdg_logger
+from task.mtime_cache import DIRECTORY_REVALIDATE_RUNS, DirectoryListing, MtimeCache
+from task.timestamp import parse_timestamp
+
+SFTP_CHANNELS = 4
+SFTP_CREDENTIAL_TTL = 900
+# Decrypted provider configurations and connected SSH clients kept for later invocations in the same process
+CREDENTIAL_CACHE = {}
+SSH_CLIENT_CACHE = {}
+# Provider fields that determine the configuration create_ssh_sftp_config makes
+CREDENTIAL_FIELDS = ('host', 'port', 'username', 'password', 'privateKey', 'key_filename', 'encrypted')
+# Path, size, mtime in epoch seconds and type (d, f, l...) of each entry, tab separated. find is run with -L so these
+# describe the target of a symbolic link, as the SFTP walk records it, and only a broken link is reported as l.
+FIND_FORMAT = '%p\\t%s\\t%T@\\t%y\\n'
 
 
 def get_private_key(private_key, local_dir=None):
@@ -73,43 +89,105 @@ def create_ssh_sftp_config(**kwargs):
     return sftp_config
 
 
-def kms_decrypt_ciphertext(_ciphertext, kms_client=None):
-    if not kms_client:
-        kms_client = boto3.client('kms')
-    response = kms_client.decrypt(
-        CiphertextBlob=base64.b64decode(_ciphertext),
-        KeyId=os.getenv('AWS_DECRYPT_KEY_ARN')
-    )
-    decrypted_text = response["Plaintext"].decode()
+def get_ssh_sftp_config(ttl=0, **kwargs):
+    """
+    create_ssh_sftp_config with the result kept for ttl seconds per provider, so warm invocations do not decrypt the
+    credentials with KMS or download the private key from S3 again.
+    :param ttl: Seconds to keep the configuration for, 0 to always create it
+    :return sftp_config: A dictionary with provided configuration parameters
+    """
+    key = tuple((field, str(kwargs.get(field))) for field in CREDENTIAL_FIELDS)
+    expires, sftp_config = CREDENTIAL_CACHE.get(key, (0, None)) if ttl > 0 else (0, None)
+    if expires <= time.monotonic():
+        sftp_config = create_ssh_sftp_config(**kwargs)
+        if ttl > 0:
+            CREDENTIAL_CACHE[key] = (time.monotonic() + ttl, sftp_config)
 
-    return decrypted_text
+    return dict(sftp_config)
 
 
-def setup_ssh_sftp_client(**kwargs):
+def setup_ssh_sftp_client(reuse_connection=False, **kwargs):
     """
     Sets up and returns a paramiko ssh sftp client
+    :param reuse_connection: Keep the SSH connection for later calls with the same configuration and use the one kept
+    by an earlier call if it is still open, skipping the connection and authentication handshakes
     :return: A configured sftp client
     """
+    key = tuple(
+        (name, value.get_base64() if isinstance(value, paramiko.PKey) else str(value))
+        for name, value in sorted(kwargs.items())
+    )
+    ssh_client = SSH_CLIENT_CACHE.pop(key, None) if reuse_connection else None
+    if ssh_client is not None:
+        try:
+            transport = ssh_client.get_transport()
+            if transport is not None and transport.is_active():
+                # Opening the SFTP channel is a round trip, so it also checks the connection is alive
+                sftp_client = ssh_client.open_sftp()
+                SSH_CLIENT_CACHE[key] = ssh_client
+                gdg_logger.info(f'Reusing the SSH connection to {kwargs.get("hostname")}')
+                return sftp_client
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            gdg_logger.warning(f'The kept SSH connection to {kwargs.get("hostname")} failed, reconnecting: {e}')
+        ssh_client.close()
+
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
     ssh_client.connect(**kwargs)
+    if reuse_connection:
+        SSH_CLIENT_CACHE[key] = ssh_client
     return ssh_client.open_sftp()
 
 
+def close_sftp_client(sftp_client, reuse_connection=False):
+    """
+    Closes the SFTP channel and, unless it is being kept for reuse, the SSH connection it is on.
+    """
+    transport = sftp_client.get_channel().get_transport()
+    sftp_client.close()
+    if not reuse_connection:
+        transport.close()
+
+
+def open_sftp_channel(sftp_client):
+    """
+    :return: A new SFTP client on its own channel of the SSH transport sftp_client uses
+    """
+    return paramiko.SFTPClient.from_transport(sftp_client.get_channel().get_transport())
+
+
 class DiscoverGranulesSFTP(DiscoverGranulesBase):
     """
     Class to discover granules from an SFTP provider
     """
     def __init__(self, event, context):
         super().__init__(event, context=context)
-        self.path = self.config.get('provider_path')
-        self.depth = self.discover_tf.get('depth')
+        self.path = self.config.get('provider_path', self.meta.get('provider_path', ''))
+        self.depth = abs(int(self.discover_tf.get('depth', 0)))
+        self.channels = max(int(self.discover_tf.get('sftp_channels', os.getenv('sftp_channels', SFTP_CHANNELS))), 1)
+        self.credential_ttl = int(
+            self.discover_tf.get('sftp_credential_ttl', os.getenv('sftp_credential_ttl', SFTP_CREDENTIAL_TTL))
+        )
+        self.reuse_connection = string_to_bool(
+            'sftp_reuse_connection',
+            self.discover_tf.get('sftp_reuse_connection', os.getenv('sftp_reuse_connection', False))
+        )
+        self.find_listing = string_to_bool(
+            'sftp_find_listing', self.discover_tf.get('sftp_find_listing', os.getenv('sftp_find_listing', False))
+        )
+        self.directory_cache = self.directory_cache_enabled()
+        self.revalidate_runs = int(self.discover_tf.get('directory_revalidate_runs', DIRECTORY_REVALIDATE_RUNS))
 
     def discover_granules(self):
         try:
-            sftp_client = setup_ssh_sftp_client(**create_ssh_sftp_config(**self.provider))
-            self.discover(sftp_client)
+            sftp_config = get_ssh_sftp_config(self.credential_ttl, **self.provider)
+            sftp_client = setup_ssh_sftp_client(self.reuse_connection, **sftp_config)
+            try:
+                self.discover(sftp_client)
+            finally:
+                close_sftp_client(sftp_client, self.reuse_connection)
             self.dbm.flush_dict()
+            self.dbm.flush_directory_cache()
             batch = self.dbm.read_batch()
         finally:
             self.dbm.close_db()
@@ -123,46 +201,279 @@ class DiscoverGranulesSFTP(DiscoverGranulesBase):
         return ret
 
     def discover(self, sftp_client):
-        directory_list = []
+        """
+        Adds a record for each file under provider_path that matches granuleIdExtraction. Directories are listed
+        concurrently up to depth levels below provider_path.
+        """
         gdg_logger.info(f'Discovering in {self.provider_url}')
-        sftp_client.chdir(self.path)
+        crawler = SFTPCrawler(self, sftp_client)
+        if self.find_listing and crawler.list_with_find():
+            return
+        crawler.crawl()
+
+    def process_sftp_entry(self, file_attr, directory, directory_list, records):
+        """
+        :param file_attr: SFTPAttributes of a directory entry
+        :param directory: Path of the listed directory relative to provider_path, '' or ending in /
+        :param directory_list: List the entry is appended to if it is a subdirectory that matches dir_reg_ex
+        :param records: List the record of the entry is appended to if it is a file that matches granuleIdExtraction
+        """
+        dir_file = str(file_attr.filename)
+        full_path = f'{self.provider_url}{directory}{dir_file}'
+        if stat.S_ISDIR(file_attr.st_mode or 0):
+            if self.matcher.match_directory(f'{full_path}/'):
+                directory_list.append(f'{directory}{dir_file}/')
+            return
+
+        if not self.matcher.search(dir_file):
+            return
+        reg_match = self.matcher.match(dir_file)
+        if reg_match is None:
+            raise ValueError(f'The granuleIdExtraction {self.granule_id_extraction} '
+                             f'did not match the file name: {dir_file}')
+
+        records.append({
+            'name': full_path, 'granule_id': reg_match.group(1), 'collection_id': self.collection_id, 'etag': 'N/A',
+            'last_modified': parse_timestamp(file_attr.st_mtime), 'size': int(file_attr.st_size)
+        })
 
-        listdir_res = sftp_client.listdir()
-        for dir_file in listdir_res:
-            if not re.search(self.granule_id_extraction, str(dir_file)) or not check_reg_ex(self.dir_reg_ex, str(dir_file)):
+
+def follow_links(channel, path, file_attrs):
+    """
+    READDIR replies carry the attributes of symbolic links themselves, so each link is replaced by the attributes of
+    its target. Linked files are then recorded with the size and mtime of the target and linked directories are
+    descended into. Links whose target cannot be stat'ed are skipped.
+    :param channel: SFTPClient the directory was listed with
+    :param path: Absolute path of the listed directory ending in /
+    :param file_attrs: SFTPAttributes from listdir_attr(path)
+    :return: List of SFTPAttributes
+    """
+    resolved = []
+    for file_attr in file_attrs:
+        if stat.S_ISLNK(file_attr.st_mode or 0):
+            try:
+                target_attr = channel.stat(f'{path}{file_attr.filename}')
+            except OSError as e:
+                gdg_logger.warning(f'Skipping {path}{file_attr.filename}, unable to follow the link: {e}')
                 continue
-            file_stat = sftp_client.stat(dir_file)
-            file_type = str(file_stat)[0]
-            if file_type == 'd' and check_reg_ex(self.dir_reg_ex, self.path):
-                # gdg_logger.info(f'{dir_file} was a directory')
-                directory_list.append(dir_file)
-            elif check_reg_ex(self.granule_id_extraction, str(dir_file)):
-                reg_match = re.match(self.granule_id_extraction, str(dir_file))
-                if reg_match is not None:
-                    granule_id = re.match(self.granule_id_extraction, str(dir_file)).group(1)
-                    # gdg_logger.info(f'Checking {self.granule_id_extraction} against {str(dir_file)} resulted in {granule_id}')
-                else:
-                    raise ValueError(f'The granuleIdExtraction {self.granule_id_extraction} '
-                                     f'did not match the file name: {str(dir_file)}')
-
-                full_path = f'{self.provider_url.rstrip("/")}/{dir_file}'
-                self.dbm.add_record(
-                    name=full_path, granule_id=granule_id,
-                    collection_id=self.collection_id, etag='N/A',
-                    last_modified=dateparser.parse(str(file_stat.st_mtime)), size=int(file_stat.st_size)
+            target_attr.filename = file_attr.filename
+            file_attr = target_attr
+        resolved.append(file_attr)
+
+    return resolved
+
+
+class SFTPCrawler:
+    """
+    Walks an SFTP directory tree over up to sftp_channels SFTP channels multiplexed on the SSH transport of one
+    connection, so there is one login and handshake however many directories are listed at once. Directories are
+    listed by absolute path from a shared work queue and subdirectories that do not match dir_reg_ex are pruned before
+    they are listed. If the server refuses more sessions the channels already open are used. Listings are recorded in
+    the calling thread. With directory_cache set, directories whose modification time has not changed since the last
+    crawl are replayed from the database instead of listed.
+    """
+
+    def __init__(self, dg_client, sftp_client):
+        self.dg_client = dg_client
+        self.sftp_client = sftp_client
+        self.idle_channels = queue.Queue()
+        self.opened_channels = []
+        self.channel_limit = dg_client.channels
+        self.lock = threading.Lock()
+        self.root = None
+        self.mtime_cache = MtimeCache(dg_client.dbm, dg_client.revalidate_runs) if dg_client.directory_cache else None
+
+    def resolve_root(self):
+        if self.root is None:
+            self.root = self.sftp_client.normalize(str(self.dg_client.path or '.')).rstrip('/')
+        return self.root
+
+    def crawl(self):
+        self.resolve_root()
+        self.idle_channels.put(self.sftp_client)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.dg_client.channels) as executor:
+                self.walk(executor)
+            if self.mtime_cache:
+                gdg_logger.info(
+                    f'Listed {self.mtime_cache.listed} directories and replayed {self.mtime_cache.replayed}'
                 )
-            else:
-                # gdg_logger.warning(f'Notice: {dir_file} not processed as granule or directory. '
-                #                    f'The supplied regex [{self.granule_id_extraction}] may not match.')
-                pass
-
-        if self.depth > 0 and len(directory_list) > 0:
-            self.depth -= 1
-            for directory in directory_list:
-                self.path = directory
-            self.depth += 1
-
-        sftp_client.chdir('../')
+        finally:
+            for channel in self.opened_channels:
+                channel.close()
+
+    def walk(self, executor):
+        pending = {}
+        try:
+            self.submit(executor, pending, '', self.dg_client.depth)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    directory, depth = pending.pop(future)
+                    listing = future.result()
+                    if self.mtime_cache:
+                        self.mtime_cache.store(f'{self.dg_client.provider_url}{directory}', listing)
+                    for record in listing.records:
+                        self.dg_client.dbm.add_record(**record)
+                    if depth > 0:
+                        for sub_directory, mtime in listing.directories:
+                            self.submit(executor, pending, sub_directory, depth - 1, mtime)
+        finally:
+            # Directories not started yet are dropped if one fails
+            for future in pending:
+                future.cancel()
+
+    def submit(self, executor, pending, directory, depth, mtime=None):
+        # The stored listing is read here since the database is only used from this thread
+        cached = self.mtime_cache.read(f'{self.dg_client.provider_url}{directory}') if self.mtime_cache else None
+        pending[executor.submit(self.list_directory, directory, mtime, cached)] = (directory, depth)
+
+    def list_with_find(self):
+        """
+        Lists the tree with one find command run over the SSH connection, recording granules as its output arrives.
+        :return: True if the tree was listed, False if the server refused the command or find listed nothing
+        """
+        root = self.resolve_root()
+        command = (
+            f'find -L {shlex.quote(root or "/")} -mindepth 1 -maxdepth {self.dg_client.depth + 1} '
+            f'-printf {shlex.quote(FIND_FORMAT)}'
+        )
+        gdg_logger.info(f'Listing with: {command}')
+        try:
+            channel = self.sftp_client.get_channel().get_transport().open_session()
+            channel.exec_command(command)
+        except paramiko.SSHException as e:
+            gdg_logger.warning(f'Unable to run find, walking the directories instead: {e}')
+            return False
+
+        parser = FindOutputParser(self.dg_client, root)
+        # stdout and stderr share the channel's window, so stderr is drained while stdout is read or find blocks once
+        # the window fills with errors nobody reads
+        stderr_output = []
+        stderr_reader = threading.Thread(target=read_stderr, args=(channel, stderr_output), daemon=True)
+        try:
+            stderr_reader.start()
+            with channel.makefile('rb') as stdout:
+                for line in stdout:
+                    parser.feed(line.decode('utf-8', errors='replace'))
+            exit_status = channel.recv_exit_status()
+            stderr_reader.join()
+        finally:
+            channel.close()
+        errors = b''.join(stderr_output).decode('utf-8', errors='replace').strip()
+
+        if not parser.lines:
+            gdg_logger.warning(f'find exited with {exit_status}, walking the directories instead: {errors}')
+            return False
+        if exit_status != 0:
+            # GNU find exits with 1 when some directories cannot be read but still lists the rest
+            gdg_logger.warning(f'find exited with {exit_status}: {errors}')
+        gdg_logger.info(f'Listed {parser.lines} entries with find')
+        return True
+
+    def acquire(self):
+        try:
+            return self.idle_channels.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if 1 + len(self.opened_channels) < self.channel_limit:
+                try:
+                    channel = open_sftp_channel(self.sftp_client)
+                    self.opened_channels.append(channel)
+                    return channel
+                except paramiko.SSHException as e:
+                    self.channel_limit = 1 + len(self.opened_channels)
+                    gdg_logger.warning(f'Unable to open another SFTP channel, using {self.channel_limit}: {e}')
+
+        return self.idle_channels.get()
+
+    def list_directory(self, directory, mtime=None, cached=None):
+        """
+        :param directory: Path relative to provider_path, '' or ending in /
+        :param mtime: Modification time of the directory from the listing of its parent, None if it is not known
+        :param cached: The listing stored for the directory by the last crawl or None
+        :return: DirectoryListing
+        """
+        path = f'{self.root}/{directory}'
+        gdg_logger.info(f'Discovering in {path}')
+        channel = self.acquire()
+        try:
+            if self.mtime_cache and mtime is None:
+                mtime = channel.stat(path).st_mtime
+            if cached is not None:
+                listing = self.mtime_cache.replay(cached, mtime)
+                if listing:
+                    gdg_logger.info(f'Not modified, replaying cached listing for {path}')
+                    return listing
+            # The READDIR replies carry each entry's attributes so no stat is needed per file
+            file_attrs = follow_links(channel, path, channel.listdir_attr(path))
+        finally:
+            self.idle_channels.put(channel)
+
+        records = []
+        directories = []
+        for file_attr in file_attrs:
+            directory_list = []
+            self.dg_client.process_sftp_entry(file_attr, directory, directory_list, records)
+            directories.extend((sub_directory, file_attr.st_mtime) for sub_directory in directory_list)
+        return DirectoryListing(records, directories, mtime, 0)
+
+
+def read_stderr(channel, output):
+    """
+    Reads the stderr of channel until the command exits, appending the data to output.
+    """
+    with channel.makefile_stderr('rb') as stderr:
+        output.append(stderr.read())
+
+
+class FindOutputParser:
+    """
+    Parses the output of find -L -printf FIND_FORMAT one line at a time into the records the SFTP walk would make. Files
+    below a directory that does not match dir_reg_ex, or is below one that does not, are skipped, as the walk would not
+    list it. depth is applied by find's -maxdepth.
+    """
+
+    def __init__(self, dg_client, root):
+        self.dg_client = dg_client
+        self.root = root
+        self.lines = 0
+        self.allowed_directories = {'': True}
+
+    def feed(self, line):
+        fields = line.rstrip('\n').rsplit('\t', 3)
+        if len(fields) != 4 or not fields[0].startswith(f'{self.root}/'):
+            return
+        self.lines += 1
+        path, size, mtime, file_type = fields
+        directory, _, name = path[len(self.root) + 1:].rpartition('/')
+        directory = f'{directory}/' if directory else ''
+        # Directories, broken links and special files such as sockets and pipes are not granules
+        if file_type != 'f' or not self.allowed(directory):
+            return
+
+        file_attr = paramiko.SFTPAttributes()
+        file_attr.filename = name
+        file_attr.st_mode = stat.S_IFREG
+        file_attr.st_size = int(size)
+        file_attr.st_mtime = int(float(mtime))
+        records = []
+        self.dg_client.process_sftp_entry(file_attr, directory, [], records)
+        for record in records:
+            self.dg_client.dbm.add_record(**record)
+
+    def allowed(self, directory):
+        """
+        :param directory: Directory relative to the root, '' or ending in /
+        :return: True if the directory and every directory above it match dir_reg_ex
+        """
+        if directory not in self.allowed_directories:
+            parent = directory[:-1].rpartition('/')[0]
+            self.allowed_directories[directory] = self.allowed(f'{parent}/' if parent else '') and \
+                self.dg_client.matcher.match_directory(f'{self.dg_client.provider_url}{directory}')
+        return self.allowed_directories[directory]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+from task.granule_matcher import GranuleMatcher, literal_suffix_pattern
+
+
+def extension(filename):
+    """
+    :return: The text after the last . of filename, ignoring a trailing newline, or None if it has no .
+    """
+    name = filename[:-1] if filename.endswith('\n') else filename
+    dot = name.rfind('.')
+    return name[dot + 1:] if dot >= 0 else None
+
+
+class FileDefinitions:
+    """
+    The collection's files definitions compiled once to give the type and bucket of each file in the Cumulus output.
+    Definitions whose regex only matches a literal suffix, such as \\.nc$, are checked with str.endswith and the rest
+    with a GranuleMatcher, so the literal text they need is checked before the regular expression runs. A suffix
+    containing a . can only match names with the same extension, so the definitions a name has to be checked against
+    are cached per extension and the suffixes of other extensions are never tried. The last definition that matches a
+    name is used, as the workflow always has.
+    """
+
+    def __init__(self, files, buckets):
+        """
+        :param files: The collection's files, dictionaries with regex, type and bucket
+        :param buckets: The buckets of the workflow config, dictionaries with name and type
+        """
+        bucket_names = {}
+        for bucket in buckets.values():
+            # The last bucket of a type is used
+            bucket_names[bucket.get('type')] = bucket.get('name')
+
+        # (extension the definition needs or None if it can match any name, match function, description) with the
+        # last definition first so the first match is used
+        self.definitions = []
+        for file_def in reversed(files or []):
+            description = (file_def.get('type', ''), bucket_names.get(file_def.get('bucket', ''), ''))
+            suffix_pattern = literal_suffix_pattern(file_def.get('regex'))
+            if suffix_pattern is None:
+                self.definitions.append((None, GranuleMatcher(file_def.get('regex')).search, description))
+            else:
+                suffix, newline = suffix_pattern
+                suffixes = (suffix, f'{suffix}\n') if newline else (suffix,)
+                required = extension(suffix) if not suffix.endswith('\n') else None
+                self.definitions.append(
+                    (required, lambda name, suffixes=suffixes: name.endswith(suffixes), description)
+                )
+        self.default = ('', bucket_names.get('', ''))
+        self.extension_definitions = {}
+
+    def candidates(self, file_extension):
+        """
+        :return: The match functions and descriptions of the definitions a name with file_extension can match
+        """
+        candidates = self.extension_definitions.get(file_extension)
+        if candidates is None:
+            candidates = [
+                (matches, description) for required, matches, description in self.definitions
+                if required is None or required == file_extension
+            ]
+            self.extension_definitions[file_extension] = candidates
+
+        return candidates
+
+    def describe(self, filename):
+        """
+        :return: Tuple of (file type, bucket name) for filename
+        """
+        for matches, description in self.candidates(extension(filename)):
+            if matches(filename):
+                return description
+        return self.default
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,112 @@
+import datetime
+import re
+from collections import namedtuple
+
+from task.timestamp import parse_timestamp
+
+# A file or directory in an FTP listing. size and last_modified are None when the listing does not show them.
+FTPEntry = namedtuple('FTPEntry', ['name', 'is_dir', 'size', 'last_modified'])
+
+# Facts asked for with OPTS MLST. Servers that do not support the command send their default facts, which include these.
+MLSD_FACTS = 'type;size;modify;'
+# Unix ls -l: type and permissions, links, owner, an optional group, size, date and name. Symbolic links end in
+# " -> target".
+UNIX_LIST_RE = re.compile(
+    r'([bcdlps-])[\w-]{9}[+.@]?\s+\d+\s+\S+\s+(?:\S+\s+)?(\d+)\s+'
+    r'([A-Z][a-z]{2}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})) (.+)'
+)
+# IIS and other Windows servers: 05-07-21  09:27AM  <DIR>  name or 05-07-21  09:27AM  1234  name
+DOS_LIST_RE = re.compile(r'(\d{2}-\d{2}-(?:\d{4}|\d{2}))\s+(\d{1,2}:\d{2}\s*[AP]M)\s+(<DIR>|\d+)\s+(.+)', re.IGNORECASE)
+
+
+def parse_mlsd_modify(value):
+    """
+    :param value: MLSD modify fact, YYYYMMDDHHMMSS with optional fractional seconds, always UTC
+    :return: datetime or None if value is not in that format
+    """
+    seconds, _, fraction = value.partition('.')
+    try:
+        modified = datetime.datetime.strptime(seconds, '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    return modified.replace(microsecond=int(fraction[:6].ljust(6, '0') or 0), tzinfo=datetime.timezone.utc)
+
+
+def parse_mlsd_facts(line):
+    """
+    :param line: A line of MLSD output or of the MLST reply, facts followed by a space and the name
+    :return: Tuple of (dictionary of facts with lower case names, name)
+    """
+    facts_found, _, name = line.rstrip('\r\n').partition(' ')
+    facts = {}
+    for fact in facts_found.rstrip(';').split(';'):
+        key, _, value = fact.partition('=')
+        facts[key.lower()] = value
+    return facts, name
+
+
+def parse_mlsd_line(line):
+    """
+    :param line: A line of MLSD output, facts followed by a space and the name
+    :return: FTPEntry or None for the current and parent directories, links and other special entries
+    """
+    facts, name = parse_mlsd_facts(line)
+    entry_type = facts.get('type', '').lower()
+    if not name or entry_type not in ('file', 'dir'):
+        return None
+    size = facts.get('size', facts.get('sizd'))
+    return FTPEntry(
+        name=name, is_dir=entry_type == 'dir', size=int(size) if size and size.isdigit() else None,
+        last_modified=parse_mlsd_modify(facts.get('modify', ''))
+    )
+
+
+def parse_mlst_modify(reply):
+    """
+    :param reply: Reply to MLST, the facts of the path on the line between the first and last
+    :return: The modification time of the path or None if the reply does not give one
+    """
+    lines = reply.splitlines()
+    if len(lines) < 3:
+        return None
+    facts, _ = parse_mlsd_facts(lines[1].strip())
+    return parse_mlsd_modify(facts.get('modify', ''))
+
+
+def parse_list_line(line):
+    """
+    :param line: A line of Unix or DOS style LIST output
+    :return: FTPEntry or None for lines that are not entries, such as "total 12", lines with a date that cannot be
+    parsed, and the current and parent directories
+    """
+    line = line.rstrip('\r\n')
+    match = UNIX_LIST_RE.match(line)
+    if match:
+        entry_type, size, date, name = match.groups()
+        if entry_type == 'l':
+            name = name.split(' -> ', 1)[0]
+        elif entry_type not in ('-', 'd'):
+            return None
+        last_modified = parse_timestamp(' '.join(date.split()))
+        if last_modified is None:
+            return None
+        if ':' in date and last_modified > datetime.datetime.now() + datetime.timedelta(days=1):
+            # ls leaves the year out for files changed in the last six months, so a date ahead of now is last year's
+            last_modified = last_modified.replace(year=last_modified.year - 1)
+        entry = FTPEntry(name=name, is_dir=entry_type == 'd', size=int(size), last_modified=last_modified)
+    else:
+        match = DOS_LIST_RE.match(line)
+        if not match:
+            return None
+        date, time, size, name = match.groups()
+        date_format = '%m-%d-%Y' if len(date) == 10 else '%m-%d-%y'
+        time = ''.join(time.split()).upper()
+        last_modified = datetime.datetime.strptime(f'{date} {time}', f'{date_format} %I:%M%p')
+        is_dir = size.upper() == '<DIR>'
+        entry = FTPEntry(name=name, is_dir=is_dir, size=None if is_dir else int(size), last_modified=last_modified)
+
+    return entry if entry.name not in ('.', '..') else None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,162 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse  # pylint: disable=deprecated-module
+
+BEGIN = 'begin'
+END = 'end'
+END_OR_NEWLINE = 'end_or_newline'
+ANCHORS = {
+    sre_parse.AT_BEGINNING: BEGIN,
+    sre_parse.AT_BEGINNING_STRING: BEGIN,
+    sre_parse.AT_END: END_OR_NEWLINE,
+    sre_parse.AT_END_STRING: END
+}
+
+
+def flatten_pattern(items):
+    """
+    :param items: Parsed regular expression sequence
+    :return: List with a character for each literal, an anchor constant for ^, $, \\A and \\Z, and None for anything
+    else, with groups expanded in place
+    """
+    tokens = []
+    for op, arg in items:
+        if op is sre_parse.LITERAL:
+            tokens.append(chr(arg))
+        elif op is sre_parse.AT and arg in ANCHORS:
+            tokens.append(ANCHORS[arg])
+        elif op is sre_parse.SUBPATTERN and not arg[1] and not arg[2]:
+            tokens.extend(flatten_pattern(arg[-1]))
+        else:
+            tokens.append(None)
+
+    return tokens
+
+
+def literal_affixes(pattern):
+    """
+    Finds literal text that every string a pattern matches, searching anywhere in it, must contain.
+    :param pattern: Regular expression string
+    :return: Tuple of (prefix the string must start with, suffix the string must end with, True if the suffix may also
+    be followed by a newline, longest literal the string must contain). Each is '' if there is none.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, TypeError):
+        return '', '', False, ''
+    if parsed.state.flags & ~sre_parse.SRE_FLAG_UNICODE:
+        # Flags such as IGNORECASE or MULTILINE change what the literals and anchors match
+        return '', '', False, ''
+
+    tokens = flatten_pattern(parsed)
+    runs = []
+    run = ''
+    for token in tokens:
+        if token is None or len(token) > 1:
+            runs.append(run)
+            run = ''
+        else:
+            run += token
+    runs.append(run)
+
+    prefix = runs[1] if tokens and tokens[0] == BEGIN else ''
+    suffix = runs[-2] if tokens and tokens[-1] in (END, END_OR_NEWLINE) else ''
+    return prefix, suffix, bool(suffix) and tokens[-1] == END_OR_NEWLINE, max(runs, key=len)
+
+
+def literal_suffix_pattern(pattern):
+    """
+    :param pattern: Regular expression string
+    :return: Tuple of (suffix, True if it may also be followed by a newline) if the pattern only matches strings ending
+    in literal text, as \\.nc$ does, so whether it matches depends on nothing else, otherwise None
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, TypeError):
+        return None
+    if parsed.state.flags & ~sre_parse.SRE_FLAG_UNICODE:
+        return None
+
+    tokens = flatten_pattern(parsed)
+    if not tokens or tokens[-1] not in (END, END_OR_NEWLINE):
+        return None
+    if any(token is None or len(token) > 1 for token in tokens[:-1]):
+        return None
+    return ''.join(tokens[:-1]), tokens[-1] == END_OR_NEWLINE
+
+
+class GranuleMatcher:
+    """
+    The collection's granule_id_extraction, granule_id and dir_reg_ex compiled once. Names are checked against the
+    literal text the extraction requires, a prefix after ^, a suffix before $ and the longest literal anywhere, before
+    the regular expression runs, so most names that cannot match are rejected without it.
+    """
+
+    def __init__(self, granule_id_extraction, granule_id='', dir_reg_ex=None):
+        self.key = (granule_id_extraction, granule_id, dir_reg_ex)
+        self.extraction = re.compile(granule_id_extraction)
+        self.granule_id = re.compile(granule_id)
+        self.dir_reg_ex = re.compile(dir_reg_ex) if dir_reg_ex is not None else None
+        self.prefix, self.suffix, self.suffix_newline, self.literal = literal_affixes(granule_id_extraction)
+        if self.literal in (self.prefix, self.suffix):
+            # Already checked by the prefix or suffix
+            self.literal = ''
+
+    def prefilter(self, name):
+        """
+        :return: False if name cannot match granule_id_extraction. True does not mean it matches.
+        """
+        # The suffix is checked first since file extensions tell most names apart
+        if self.suffix and not name.endswith(self.suffix):
+            if not (self.suffix_newline and name.endswith(f'{self.suffix}\n')):
+                return False
+        if self.prefix and not name.startswith(self.prefix):
+            return False
+        return not self.literal or self.literal in name
+
+    def search(self, name):
+        """
+        :return: The re.search match of granule_id_extraction on name or None
+        """
+        return self.extraction.search(name) if self.prefilter(name) else None
+
+    def match(self, name):
+        """
+        :return: The re.match match of granule_id_extraction on name or None
+        """
+        return self.extraction.match(name) if self.prefilter(name) else None
+
+    def match_granule(self, path, name=None, group=1):
+        """
+        Matches a file against granule_id_extraction.
+        :param path: Path or URL of the file to record
+        :param name: The part of path to match, path itself if not given
+        :param group: Group of the match to use as the granule ID. The HTTP and FTP discoverers use the whole match.
+        :return: Tuple of (path, granule ID) or None if the file is not a granule
+        """
+        name = path if name is None else name
+        if not self.prefilter(name):
+            return None
+        match = self.extraction.search(name)
+        return (path, match.group(group)) if match else None
+
+    def cumulus_granule_id(self, filename):
+        """
+        :return: The granule ID Cumulus is given for filename, the first group of granule_id_extraction or the match
+        of granule_id if the extraction does not match
+        """
+        match = self.search(filename)
+        return match.group(1) if match else self.granule_id.search(filename).group(0)
+
+    def match_directory(self, path):
+        """
+        :return: True if dir_reg_ex is not set or it matches path
+        """
+        return self.dir_reg_ex is None or self.dir_reg_ex.search(path) is not None
+
+
+if __name__ == '__main__':
+    pass
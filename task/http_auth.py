@@ -0,0 +1,78 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+EARTHDATA_AUTH_HOST = 'urs.earthdata.nasa.gov'
+
+
+class AuthRedirectSession(requests.Session):
+    """
+    Session for providers that redirect requests through an OAuth login such as Earthdata Login. The credentials are
+    only sent to the login host when a redirect reaches it, and the cookies the provider sets once the login completes
+    are kept by the session so later requests skip the login.
+    """
+
+    def __init__(self, auth_host, credentials):
+        super().__init__()
+        self.auth_host = auth_host
+        self.credentials = credentials
+
+    def rebuild_auth(self, prepared_request, response):
+        super().rebuild_auth(prepared_request, response)
+        if urlsplit(prepared_request.url).netloc == self.auth_host:
+            prepared_request.prepare_auth(self.credentials)
+
+
+class RedirectCache:
+    """
+    Remembers where the directories of a provider redirect to. When a file is found to redirect to a file of the same
+    name in another directory, later files in the same directory are requested at the other directory directly instead
+    of following the redirect chain again. Redirects to signed URLs are not cached since the signature expires.
+    """
+
+    def __init__(self):
+        self.directories = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, url):
+        """
+        :param url: URL of a file
+        :return: The URL the file is expected to redirect to, or url if nothing is cached for its directory
+        """
+        directory, name = url.rsplit('/', 1)
+        target = self.directories.get(directory)
+        return f'{target}/{name}' if target else url
+
+    def learn(self, url, response):
+        """
+        Caches the directory url redirected to if the response ended at a file of the same name.
+        :param url: URL that was requested
+        :param response: Response after following the redirects
+        """
+        with self.lock:
+            self.misses += 1
+            final_url = response.url
+            if final_url == url or urlsplit(final_url).query:
+                return
+            directory, name = url.rsplit('/', 1)
+            final_directory, final_name = final_url.rsplit('/', 1)
+            if name and name == final_name:
+                self.directories[directory] = final_directory
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def forget(self, url):
+        """
+        Drops the cached redirect for the directory of url after the cached target failed.
+        """
+        with self.lock:
+            self.directories.pop(url.rsplit('/', 1)[0], None)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,311 @@
+import codecs
+import json
+from urllib.parse import quote, unquote, urljoin, urlsplit
+from xml.etree.ElementTree import XMLPullParser
+
+from task.http_listing import ListingEntry
+from task.timestamp import parse_timestamp
+
+CATALOG_CHUNK_SIZE = 64 * 1024
+S3_LIST_MAX_KEYS = 1000
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class CatalogReader:
+    """
+    Base class for readers of machine-readable directory listings. A reader is given the URL of a catalog page and
+    returns ListingEntry records for the files on it along with entries marked is_dir for the catalogs it references.
+    Directory entries are crawled as they are given so a reader returns the URL that should be requested for them.
+    """
+
+    def __init__(self, discover_tf):
+        self.discover_tf = discover_tf
+
+    def root_url(self, provider_url):
+        """
+        :return: The URL of the first catalog page to request for provider_url
+        """
+        return self.discover_tf.get('catalog_url', provider_url)
+
+    def read(self, session, url):
+        """
+        Requests and parses every page of the catalog at url.
+        :return: List of ListingEntry
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def stream_xml(session, url, **kwargs):
+        """
+        Feeds the catalog response to an incremental parser as it is received and yields each completed element. The
+        element is cleared once the caller is done with it so memory use does not grow with the size of the catalog.
+        """
+        parser = XMLPullParser(events=('end',))
+        with session.get(url, stream=True, **kwargs) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CATALOG_CHUNK_SIZE):
+                parser.feed(chunk)
+                for _, element in parser.read_events():
+                    yield element
+            parser.close()
+            for _, element in parser.read_events():
+                yield element
+
+
+class JSONStream:
+    """
+    Decodes JSON text that arrives in chunks one value at a time. Only the value being decoded is buffered, so the
+    items of a large array can be handled as they are received.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """
+        Appends the next chunk to the buffer, dropping what has been consumed.
+        :return: False if there are no more chunks
+        """
+        for chunk in self.chunks:
+            self.buffer = self.buffer[self.position:] + chunk
+            self.position = 0
+            return True
+        return False
+
+    def peek(self):
+        """
+        :return: The next character that is not whitespace, which is left unconsumed, or None at the end of the text
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return None
+
+    def skip(self, character):
+        """
+        Consumes the next character that is not whitespace if it is character.
+        """
+        if self.peek() == character:
+            self.position += 1
+
+    def decode(self):
+        """
+        :return: The next value, read from as many chunks as it spans
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.position = end
+            return value
+
+    def items(self, list_keys):
+        """
+        Generator of the items of the array the text holds, or of the array under the first of list_keys in the object
+        it holds. Other values of the object are decoded and dropped.
+        """
+        if self.peek() == '{':
+            self.position += 1
+            while self.peek() not in ('}', None):
+                key = self.decode()
+                self.skip(':')
+                if key in list_keys and self.peek() == '[':
+                    break
+                self.decode()
+                self.skip(',')
+        if self.peek() != '[':
+            return
+
+        self.position += 1
+        while self.peek() not in (']', None):
+            yield self.decode()
+            self.skip(',')
+
+
+class ThreddsCatalogReader(CatalogReader):
+    """
+    Reads THREDDS InvCatalog XML. Datasets with a urlPath are resolved against the base of the catalog's HTTPServer
+    service and catalogRef elements are followed as sub catalogs.
+    """
+    # Dataset sizes are only exact when reported in bytes. Larger units are rounded so the size comes from a HEAD
+    # request instead.
+    EXACT_SIZE_UNITS = ('bytes', 'byte', 'b')
+
+    def root_url(self, provider_url):
+        return self.discover_tf.get('catalog_url', f'{provider_url.rstrip("/")}/catalog.xml')
+
+    def read(self, session, url):
+        entries = []
+        service_base = '/thredds/fileServer/'
+        for element in self.stream_xml(session, url):
+            tag = local_name(element.tag)
+            if tag == 'service' and element.get('serviceType', '').lower() == 'httpserver':
+                service_base = element.get('base', service_base)
+            elif tag == 'catalogRef':
+                href = next((value for key, value in element.attrib.items() if local_name(key) == 'href'), None)
+                if href:
+                    entries.append(ListingEntry(urljoin(url, href), True, None, None))
+                element.clear()
+            elif tag == 'dataset':
+                url_path = element.get('urlPath')
+                if url_path:
+                    entries.append(self.dataset_entry(url, service_base, url_path, element))
+                    element.clear()
+
+        return entries
+
+    def dataset_entry(self, url, service_base, url_path, element):
+        size = None
+        last_modified = None
+        for child in element:
+            tag = local_name(child.tag)
+            if tag == 'dataSize' and child.get('units', '').lower() in self.EXACT_SIZE_UNITS:
+                size = int(float(child.text))
+            elif tag == 'date' and child.get('type') == 'modified':
+                last_modified = parse_timestamp(child.text)
+
+        file_url = urljoin(url, f'{service_base.rstrip("/")}/{url_path.lstrip("/")}')
+        return ListingEntry(file_url, False, size, last_modified)
+
+
+class S3ListingReader(CatalogReader):
+    """
+    Reads S3 style ListBucketResult XML from a public bucket or S3 compatible server with ListObjectsV2 and a "/"
+    delimiter. Common prefixes are followed as sub directories and truncated listings are paged through with the
+    continuation token. Objects are addressed as catalog_endpoint + key where catalog_endpoint defaults to the root of
+    the provider host.
+    """
+
+    def endpoint(self, url):
+        default_endpoint = '{0.scheme}://{0.netloc}/'.format(urlsplit(url))
+        return f'{self.discover_tf.get("catalog_endpoint", default_endpoint).rstrip("/")}/'
+
+    def read(self, session, url):
+        endpoint = self.endpoint(url)
+        prefix = unquote(url[len(endpoint):] if url.startswith(endpoint) else urlsplit(url).path.lstrip('/'))
+        entries = []
+        continuation_token = None
+        while True:
+            params = {'list-type': 2, 'delimiter': '/', 'prefix': prefix, 'max-keys': S3_LIST_MAX_KEYS}
+            if continuation_token:
+                params['continuation-token'] = continuation_token
+            continuation_token = None
+            for element in self.stream_xml(session, endpoint, params=params):
+                tag = local_name(element.tag)
+                if tag == 'Contents':
+                    key = self.child_text(element, 'Key')
+                    # Keys ending in "/" are folder placeholders and their contents are listed through CommonPrefixes
+                    if key and not key.endswith('/'):
+                        entries.append(self.object_entry(endpoint, key, element))
+                    element.clear()
+                elif tag == 'CommonPrefixes':
+                    sub_prefix = self.child_text(element, 'Prefix')
+                    entries.append(ListingEntry(f'{endpoint}{quote(sub_prefix)}', True, None, None))
+                    element.clear()
+                elif tag == 'NextContinuationToken':
+                    continuation_token = element.text
+
+            if not continuation_token:
+                break
+
+        return entries
+
+    @staticmethod
+    def child_text(element, name):
+        for child in element:
+            if local_name(child.tag) == name:
+                return child.text
+        return None
+
+    def object_entry(self, endpoint, key, element):
+        size = self.child_text(element, 'Size')
+        return ListingEntry(
+            f'{endpoint}{quote(key)}', False, int(size) if size is not None else None,
+            parse_timestamp(self.child_text(element, 'LastModified')),
+            (self.child_text(element, 'ETag') or '').strip('"') or None
+        )
+
+
+class JSONListingReader(CatalogReader):
+    """
+    Reads JSON directory listings such as nginx "autoindex_format json" or Caddy browse pages. The page is a list of
+    objects, or an object holding the list under "items", "entries" or "files", each with a name or url and optionally
+    type/is_dir, size, mtime/mod_time/last_modified and etag.
+    """
+    LIST_KEYS = ('items', 'entries', 'files')
+    TIME_KEYS = ('mtime', 'mod_time', 'last_modified', 'modified')
+
+    def read(self, session, url):
+        entries = []
+        with session.get(url, stream=True, headers={'Accept': 'application/json'}) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+            chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=CATALOG_CHUNK_SIZE))
+            # Each item is made into an entry as it is decoded rather than loading the whole listing first
+            for item in JSONStream(chunks).items(self.LIST_KEYS):
+                entry = self.item_entry(url, item)
+                if entry:
+                    entries.append(entry)
+
+        return entries
+
+    def item_entry(self, url, item):
+        name = item.get('url', item.get('name'))
+        if not name or name.rstrip('/') in ('', '.', '..'):
+            return None
+        is_dir = item.get('is_dir', item.get('type') == 'directory' or name.endswith('/'))
+        entry_url = urljoin(f'{url.rstrip("/")}/', name)
+        if is_dir:
+            return ListingEntry(f'{entry_url.rstrip("/")}/', True, None, None)
+
+        size = item.get('size')
+        last_modified = next((item[key] for key in self.TIME_KEYS if key in item), None)
+        if isinstance(last_modified, (int, float)):
+            last_modified = str(last_modified)
+
+        return ListingEntry(
+            entry_url, False, int(size) if size is not None else None, parse_timestamp(last_modified), item.get('etag')
+        )
+
+
+CATALOG_READERS = {
+    'thredds': ThreddsCatalogReader,
+    's3': S3ListingReader,
+    'json': JSONListingReader
+}
+
+
+def get_catalog_reader(catalog_type, discover_tf):
+    """
+    :param catalog_type: One of the keys of CATALOG_READERS or None for HTML directory listings
+    :param discover_tf: The discover_tf configuration, used for the catalog_url and catalog_endpoint overrides
+    :return: CatalogReader or None
+    """
+    if not catalog_type:
+        return None
+    try:
+        return CATALOG_READERS[str(catalog_type).lower()](discover_tf)
+    except KeyError as e:
+        raise ValueError(
+            f'Unsupported http_catalog "{catalog_type}". Use one of {", ".join(CATALOG_READERS)}.'
+        ) from e
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,185 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import time
+
+import requests
+
+from task.logger import gdg_logger
+
+THROTTLE_STATUS_CODES = (429, 503)
+THROTTLE_RETRIES = 5
+# Seconds to back off after a throttle or timeout without a Retry-After header, doubled on every retry
+THROTTLE_BASE_DELAY = 1
+RETRY_AFTER_MAX = 300
+AIMD_DECREASE_FACTOR = 0.5
+LATENCY_EWMA_WEIGHT = 0.2
+# A request taking this many times longer than the fastest seen for the host counts as congestion
+LATENCY_SPIKE_FACTOR = 4
+# Latencies below this are treated as noise and never count as a spike
+LATENCY_SPIKE_FLOOR = 0.25
+
+
+class ThrottledError(Exception):
+    """
+    Raised when a host is still throttling or timing out a request after THROTTLE_RETRIES retries.
+    """
+
+
+def parse_retry_after(value):
+    """
+    :param value: Retry-After header, either a number of seconds or an HTTP date
+    :return: Seconds to wait or None if the header is missing or not understood
+    """
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+    return min(max(delay, 0), RETRY_AFTER_MAX)
+
+
+def timed_call(func):
+    # The latency is measured in the worker thread so time spent queued for a thread is not counted
+    st = time.time()
+    result = func()
+    return result, time.time() - st
+
+
+class AdaptiveLimiter:
+    """
+    Limits the requests in flight to one host and adapts the limit AIMD style. The limit starts at one and grows by one
+    per successful request until the host first shows congestion, then by 1/limit per success, which is about one per
+    round of requests. A 429 or 503 response, a timeout or a latency spike halves the limit, at most once per round
+    trip so a burst of failures from the same round only counts once. Retry-After pauses every request to the host for
+    the time the server asked for.
+    """
+
+    def __init__(self, host, max_limit, min_limit=1):
+        self.host = host
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.limit = float(min_limit)
+        self.slow_start = True
+        self.in_flight = 0
+        self.paused_until = 0
+        self.latency = None
+        self.base_latency = None
+        self.last_decrease = 0
+        self.peak_limit = self.limit
+        self.requests = 0
+        self.throttled = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self.condition:
+            while True:
+                delay = self.paused_until - loop.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                else:
+                    await self.condition.wait()
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    async def call(self, executor, func, latency_signal=False):
+        """
+        Runs func in executor once the host has capacity, retrying it with backoff while the host throttles it.
+        :param executor: Executor to run the blocking request in
+        :param func: Callable making the request. Its result is checked for a throttling status_code and
+        requests.HTTPError raised for one is treated the same way.
+        :param latency_signal: True if the time func takes should be used to detect congestion. Requests that download
+        a whole page vary too much with the size of the page to be used.
+        :return: The result of func
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(THROTTLE_RETRIES + 1):
+            await self.acquire()
+            try:
+                result, latency = await loop.run_in_executor(executor, timed_call, func)
+                throttle_response = result if getattr(result, 'status_code', None) in THROTTLE_STATUS_CODES else None
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in THROTTLE_STATUS_CODES:
+                    raise
+                result, throttle_response = e, e.response
+            except (requests.Timeout, requests.ConnectionError) as e:
+                result, throttle_response = e, None
+                self.on_congestion(loop, None, attempt)
+            else:
+                if throttle_response is None:
+                    self.on_success(loop, latency if latency_signal else None)
+                    return result
+            finally:
+                await self.release()
+
+            if throttle_response is not None:
+                self.on_congestion(loop, parse_retry_after(throttle_response.headers.get('Retry-After')), attempt)
+
+        raise ThrottledError(f'{self.host} is still throttling after {THROTTLE_RETRIES} retries: {result}')
+
+    def on_success(self, loop, latency):
+        self.requests += 1
+        if latency is not None:
+            if self.latency is None:
+                self.latency = self.base_latency = latency
+            else:
+                self.latency = LATENCY_EWMA_WEIGHT * latency + (1 - LATENCY_EWMA_WEIGHT) * self.latency
+                self.base_latency = min(self.base_latency, latency)
+            if latency > max(LATENCY_SPIKE_FACTOR * self.base_latency, LATENCY_SPIKE_FLOOR):
+                self.decrease(loop)
+                return
+
+        self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+    def on_congestion(self, loop, retry_after, attempt):
+        self.requests += 1
+        self.throttled += 1
+        self.decrease(loop)
+        if retry_after is None:
+            retry_after = THROTTLE_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1)
+        self.paused_until = max(self.paused_until, loop.time() + retry_after)
+        gdg_logger.warning(
+            f'{self.host} is throttling or not responding. Concurrency reduced to {int(self.limit)}, '
+            f'retrying in {retry_after:.2f} seconds...'
+        )
+
+    def decrease(self, loop):
+        now = loop.time()
+        if now - self.last_decrease < (self.latency or THROTTLE_BASE_DELAY):
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.limit = max(self.min_limit, self.limit * AIMD_DECREASE_FACTOR)
+
+    def metrics(self):
+        """
+        :return: Dictionary with the concurrency the limiter settled on, its peak and the request counts
+        """
+        return {
+            'concurrency': int(self.limit),
+            'peak_concurrency': int(self.peak_limit),
+            'requests': self.requests,
+            'throttled': self.throttled
+        }
+
+
+if __name__ == '__main__':
+    pass
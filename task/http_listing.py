@@ -0,0 +1,218 @@
+import datetime
+import html
+import json
+import re
+from collections import namedtuple
+
+# A file or directory found on a directory listing page. is_dir, size, last_modified and etag are None when the listing
+# does not show them.
+ListingEntry = namedtuple('ListingEntry', ['url', 'is_dir', 'size', 'last_modified', 'etag'], defaults=(None,))
+
+ANCHOR_RE = re.compile(r'<a\s[^>]*?href\s*=\s*["\']?([^"\'\s>]+)["\']?[^>]*>.*?</a\s*>', re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r'<[^>]*>')
+BR_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+TR_RE = re.compile(r'<tr[\s>]', re.IGNORECASE)
+NEWLINE_RE = re.compile(r'\r?\n')
+# Characters of a page to look through for <br> or <tr> before treating it as one entry per line
+ROW_MODE_DETECT_SIZE = 16 * 1024
+
+# (pattern, strptime format) pairs for the timestamp columns of the supported autoindex formats
+LISTING_DATE_FORMATS = [
+    # Apache fancy index: 2021-05-07 09:27
+    (re.compile(r'(\d{4}-\d{2}-\d{2})\s+(\d{1,2}:\d{2}(?::\d{2})?)'), '%Y-%m-%d'),
+    # nginx autoindex and older Apache: 07-May-2021 09:27
+    (re.compile(r'(\d{1,2}-[A-Za-z]{3}-\d{4})\s+(\d{1,2}:\d{2}(?::\d{2})?)'), '%d-%b-%Y'),
+    # IIS: 4/2/2020  3:06 PM
+    (re.compile(r'(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}(?::\d{2})?\s*[AP]M)', re.IGNORECASE), '%m/%d/%Y'),
+    # IIS long date: Thursday, April 2, 2020  3:06 PM
+    (re.compile(r'[A-Za-z]+,\s+([A-Za-z]+\s+\d{1,2},\s+\d{4})\s+(\d{1,2}:\d{2}(?::\d{2})?\s*[AP]M)', re.IGNORECASE),
+     '%B %d, %Y')
+]
+# Exact byte counts, "-" for Apache/nginx directories and <dir> for IIS directories. Human readable sizes such as 47K
+# are rounded so they are deliberately not matched and the file falls back to a HEAD request.
+SIZE_RE = re.compile(r'(?<!\S)(\d+|-|<dir>)(?!\S)', re.IGNORECASE)
+
+
+def parse_listing_time(date_part, time_part, date_format):
+    time_part = ' '.join(time_part.upper().split())
+    if time_part.endswith('M'):
+        time_format = '%I:%M:%S %p' if time_part.count(':') == 2 else '%I:%M %p'
+    else:
+        time_format = '%H:%M:%S' if time_part.count(':') == 2 else '%H:%M'
+    try:
+        return datetime.datetime.strptime(f'{date_part} {time_part}', f'{date_format} {time_format}')
+    except ValueError:
+        return None
+
+
+def parse_row_metadata(text):
+    """
+    Pulls the modification time and size out of the text of a listing row with the link removed.
+    :param text: Row text with tags stripped
+    :return: (last_modified, size_token) where either may be None
+    """
+    last_modified = None
+    for pattern, date_format in LISTING_DATE_FORMATS:
+        match = pattern.search(text)
+        if match:
+            last_modified = parse_listing_time(match.group(1), match.group(2), date_format)
+            text = f'{text[:match.start()]} {text[match.end():]}'
+            break
+
+    sizes = SIZE_RE.findall(text)
+    return last_modified, sizes[-1].lower() if sizes else None
+
+
+def entry_from_row(base_url, href, url_segment, row_text):
+    url = f'{base_url.rstrip("/")}/{url_segment}'
+    last_modified, size_token = parse_row_metadata(html.unescape(TAG_RE.sub(' ', row_text)))
+
+    is_dir = None
+    size = None
+    if href.endswith('/') or size_token == '<dir>':
+        is_dir = True
+    elif size_token and size_token.isdigit():
+        is_dir = False
+        size = int(size_token)
+
+    return ListingEntry(url, is_dir, size, last_modified if not is_dir else None)
+
+
+class ListingParser:
+    """
+    Incremental parser for HTML directory listings. Text is fed as it is downloaded and every complete row is parsed
+    with regular expressions as soon as it arrives, so only the current row is buffered and no document tree is built.
+    IIS separates entries with <br>, Apache fancy indexes use table rows and nginx and plain Apache indexes put one
+    entry per line of a <pre> block. <br> or <tr> is only used as the delimiter if one sits between the first two entry
+    links, so a <br> in a header above a <pre> listing does not make the whole listing one row. Otherwise rows are
+    lines, falling back to the first <br> or <tr> if the page has fewer than two entries.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.buffer = ''
+        self.row_re = None
+        self.entries = []
+
+    def feed(self, text):
+        self.buffer += text
+        if not self.row_re:
+            self.row_re = self.detect_row_delimiter(final=False)
+            if not self.row_re:
+                return
+
+        rows = self.row_re.split(self.buffer)
+        # The last piece may be an incomplete row or the start of a delimiter
+        self.buffer = rows.pop()
+        for row in rows:
+            self.parse_row(row)
+
+    def close(self):
+        """
+        Parses whatever is left in the buffer.
+        :return: List of ListingEntry for the whole page
+        """
+        if not self.row_re:
+            self.row_re = self.detect_row_delimiter(final=True)
+        for row in self.row_re.split(self.buffer):
+            self.parse_row(row)
+        self.buffer = ''
+
+        return self.entries
+
+    def detect_row_delimiter(self, final):
+        entry_anchors = []
+        for match in ANCHOR_RE.finditer(self.buffer):
+            if self.entry_segment(match):
+                entry_anchors.append(match)
+                if len(entry_anchors) == 2:
+                    break
+        if len(entry_anchors) == 2:
+            return self.first_delimiter(entry_anchors[0].end(), entry_anchors[1].start()) or NEWLINE_RE
+        if final or len(self.buffer) >= ROW_MODE_DETECT_SIZE:
+            return self.first_delimiter(0, len(self.buffer)) or NEWLINE_RE
+        return None
+
+    def first_delimiter(self, start, end):
+        """
+        :return: BR_RE or TR_RE, whichever is found first in the buffer between start and end, or None
+        """
+        first_row_re = None
+        for row_re in (BR_RE, TR_RE):
+            match = row_re.search(self.buffer, start, end)
+            if match:
+                first_row_re = row_re
+                end = match.start()
+        return first_row_re
+
+    def entry_segment(self, match):
+        """
+        :param match: ANCHOR_RE match
+        :return: Tuple of (href, last segment of its path) or None for links that are not entries of the directory
+        """
+        href = html.unescape(match.group(1))
+        url_segment = href.rstrip('/').rsplit('/', 1)[-1]
+        if href.startswith(('?', '#', 'mailto:', 'javascript:')) or href in self.base_url:
+            return None
+        if url_segment in ('', '.', '..'):
+            return None
+        return href, url_segment
+
+    def parse_row(self, row):
+        matches = [(match, self.entry_segment(match)) for match in ANCHOR_RE.finditer(row)]
+        matches = [(match, segment) for match, segment in matches if segment]
+        for index, (match, (href, url_segment)) in enumerate(matches):
+            if len(matches) == 1:
+                row_text = f'{row[:match.start()]} {row[match.end():]}'
+            else:
+                # Several entries in one row, each is followed by its own size and time
+                end = matches[index + 1][0].start() if index + 1 < len(matches) else len(row)
+                row_text = row[match.end():end]
+            self.entries.append(entry_from_row(self.base_url, href, url_segment, row_text))
+
+
+def parse_listing(base_url, page):
+    """
+    Parses an HTML directory listing. Apache fancy indexes, nginx autoindex and IIS directory browsing pages carry the
+    size and modification time of each file next to its link, and those are returned along with the link so the file
+    does not have to be requested. Links to the parent directory, the page itself and column sort links are skipped.
+    :param base_url: URL of the directory the page lists
+    :param page: HTML text of the page
+    :return: List of ListingEntry
+    """
+    parser = ListingParser(base_url)
+    parser.feed(page)
+    return parser.close()
+
+
+def entries_in_utc(entries, tzinfo=datetime.timezone.utc):
+    """
+    Converts the modification times of listing entries to UTC so they compare with the GMT Last-Modified of a HEAD.
+    :param entries: List of ListingEntry
+    :param tzinfo: Time zone of the times that do not carry one, the server's local time for autoindex pages
+    :return: List of ListingEntry with aware UTC modification times
+    """
+    return [
+        entry._replace(last_modified=entry.last_modified.replace(
+            tzinfo=entry.last_modified.tzinfo or tzinfo
+        ).astimezone(datetime.timezone.utc)) if isinstance(entry.last_modified, datetime.datetime) else entry
+        for entry in entries
+    ]
+
+
+def dump_entries(entries):
+    """
+    Serializes listing entries for the directory cache. Modification times are stored as the string the database
+    would store for them so a replayed entry produces an identical record.
+    """
+    return json.dumps([
+        [entry.url, entry.is_dir, entry.size, str(entry.last_modified) if entry.last_modified else None, entry.etag]
+        for entry in entries
+    ])
+
+
+def load_entries(text):
+    return [ListingEntry(*values) for values in json.loads(text)]
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,96 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from task.http_auth import AuthRedirectSession
+from task.logger import gdg_logger
+
+HTTP_RETRIES = 3
+# Seconds to wait to connect and between bytes of a response before the request fails with a timeout
+HTTP_TIMEOUT = 30
+HTTP_BACKOFF_FACTOR = 0.5
+# 429 and 503 are left to the adaptive limiter so the concurrency for the host is reduced as well
+HTTP_RETRY_STATUS_CODES = (500, 502, 504)
+# Number of hosts to keep a connection pool for. Stats for pools evicted beyond this are lost.
+HTTP_POOL_HOSTS = 10
+COMPRESSED_ENCODINGS = 'gzip, deflate'
+IDENTITY_ENCODING = {'Accept-Encoding': 'identity'}
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that gives requests sent without a timeout its own, as requests waits forever by default
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):  # pylint: disable=arguments-differ
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+def create_session(
+        pool_size, retries=HTTP_RETRIES, compression=True, auth_host=None, credentials=None, timeout=HTTP_TIMEOUT
+):
+    """
+    Creates a requests Session whose connection pools can hold a connection for every worker thread. The default
+    adapter only keeps 10 connections per host, so with more threads than that connections are discarded after each
+    request and new ones, with new TLS handshakes, are opened for the next.
+    :param pool_size: Number of connections to keep alive per host. Should be at least the number of threads using
+    the session.
+    :param retries: Number of times to retry a request that fails to connect, fails to read or gets a 500, 502 or 504
+    :param compression: True to ask for gzip or deflate compressed responses, False to ask for uncompressed ones
+    :param auth_host: Host of the login the provider redirects to, for an AuthRedirectSession
+    :param credentials: Tuple of (username, password) to send to auth_host
+    :param timeout: Seconds to wait to connect and for each read of a response, for requests sent without a timeout
+    :return: requests Session
+    """
+    session = AuthRedirectSession(auth_host, credentials) if auth_host else requests.Session()
+    retry = Retry(
+        total=retries, backoff_factor=HTTP_BACKOFF_FACTOR, status_forcelist=HTTP_RETRY_STATUS_CODES,
+        allowed_methods=('GET', 'HEAD'), raise_on_status=False
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout, pool_connections=HTTP_POOL_HOSTS, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = COMPRESSED_ENCODINGS if compression else IDENTITY_ENCODING['Accept-Encoding']
+
+    return session
+
+
+def connection_stats(session):
+    """
+    :param session: requests Session
+    :return: Dictionary of {host: {'connections': connections opened, 'requests': requests made}} for the connection
+    pools of the session. Every connection opened to an https host is a TLS handshake.
+    """
+    stats = {}
+    for adapter in {id(x): x for x in session.adapters.values()}.values():
+        pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(f'{pool.scheme}://{pool.host}:{pool.port}', {'connections': 0, 'requests': 0})
+            host_stats['connections'] += pool.num_connections
+            host_stats['requests'] += pool.num_requests
+
+    return stats
+
+
+def log_connection_stats(session):
+    for host, host_stats in connection_stats(session).items():
+        reused = host_stats.get('requests') - host_stats.get('connections')
+        gdg_logger.info(
+            f'HTTP connections to {host}: {host_stats.get("connections")} opened for {host_stats.get("requests")} '
+            f'requests, {max(reused, 0)} requests reused a connection'
+        )
+
+
+if __name__ == '__main__':
+    pass
@@ -1,33 +1,31 @@
+import importlib
 import json
 import os
 
-from task.discover_granules_ftp import DiscoverGranulesFTP
-from task.discover_granules_http import DiscoverGranulesHTTP
-from task.discover_granules_s3 import DiscoverGranulesS3
-from task.discover_granules_sftp import DiscoverGranulesSFTP
 from task.logger import gdg_logger
 
 
 def get_discovery_class(protocol):
     """
-    Takes in a string parameter and attempts to return the class for a particular protocol.
+    Takes in a string parameter and attempts to return the class for a particular protocol. Only the module for the
+    requested protocol is imported so invocations do not pay for the dependencies of the other protocols.
     :param protocol: The protocol that granules need to be discovered on.
     :return A discover granules class for the appropriate protocol
     """
     protocol_switch = {
-        'http': DiscoverGranulesHTTP,
-        'https': DiscoverGranulesHTTP,
-        's3': DiscoverGranulesS3,
-        'sftp': DiscoverGranulesSFTP,
-        'ftp': DiscoverGranulesFTP
+        'http': ('task.discover_granules_http', 'DiscoverGranulesHTTP'),
+        'https': ('task.discover_granules_http', 'DiscoverGranulesHTTP'),
+        's3': ('task.discover_granules_s3', 'DiscoverGranulesS3'),
+        'sftp': ('task.discover_granules_sftp', 'DiscoverGranulesSFTP'),
+        'ftp': ('task.discover_granules_ftp', 'DiscoverGranulesFTP')
     }
     try:
         gdg_logger.info(f'trying protocol: {protocol}')
-        dg_class = protocol_switch[protocol]
+        module_name, class_name = protocol_switch[protocol]
     except Exception as e:
         raise Exception(f"Protocol {protocol} is not supported: {str(e)}")
 
-    return dg_class
+    return getattr(importlib.import_module(module_name), class_name)
 
 def write_results_to_local_store(local_store, collection, res):
     print(f'is {local_store} a directory: {os.path.isdir(local_store)}')
@@ -50,10 +48,10 @@ def main(event, context):
     # gdg_logger.info(f'Event: {event}')
     protocol = event['config']['provider']["protocol"].lower()
     dg_client = get_discovery_class(protocol)(event, context)
-    if dg_client.discovered_files_count == 0 or dg_client.bookmark:
-        res = dg_client.discover_granules()
-    else:
+    if dg_client.continuation:
         res = dg_client.read_batch()
+    else:
+        res = dg_client.discover_granules()
 
     if not res.get('bookmark', None):
         granule_list_dicts = res.pop('batch')
@@ -86,14 +84,16 @@ def main(event, context):
         res.update(
             {
                 'granules': cumulus_output,
-                'queued_granules_count': int(dg_client.discover_tf.get('queued_granules_count', 0)) + len(cumulus_output)
+                'queued_granules_count': int(dg_client.discover_tf.get('queued_granules_count', 0)) + len(cumulus_output),
+                'batch_cursor': dg_client.batch_cursor()
             }
         )
     else:
         res.update(
             {
                 'granules': [],
-                'queued_granules_count': 0
+                'queued_granules_count': 0,
+                'batch_cursor': None
             }
         )
     
@@ -0,0 +1,76 @@
+import json
+from collections import namedtuple
+
+# The result of listing or replaying a directory of an FTP or SFTP crawl. records are add_record keyword arguments for
+# the granules, directories are (subdirectory, modification time or None) pairs, mtime is the directory's own
+# modification time or None if it is not known and replays is how many crawls in a row have replayed the listing.
+DirectoryListing = namedtuple('DirectoryListing', ['records', 'directories', 'mtime', 'replays'])
+DIRECTORY_REVALIDATE_RUNS = 10
+
+
+class MtimeCache:
+    """
+    Lets FTP and SFTP crawls skip directories that have not changed since the previous crawl. The modification time,
+    granule records and subdirectories of every listed directory are stored in the directory_cache table, and a
+    directory whose modification time is the same on the next crawl has its stored records and subdirectories replayed
+    instead of being listed. Files changed in place do not change their directory's modification time, so
+    every revalidate_runs crawls in a row that replay a directory are followed by one that lists it.
+    """
+
+    def __init__(self, dbm, revalidate_runs=DIRECTORY_REVALIDATE_RUNS):
+        self.dbm = dbm
+        self.revalidate_runs = revalidate_runs
+        self.replayed = 0
+        self.listed = 0
+
+    def read(self, url):
+        """
+        :return: The stored listing of the directory at url, or None. Reads the database so it must be called from the
+        thread the crawl records granules in.
+        """
+        return self.dbm.read_directory_cache(url)
+
+    def replay(self, cached, mtime):
+        """
+        :param cached: Stored listing from read
+        :param mtime: The directory's current modification time
+        :return: DirectoryListing of the stored listing or None if the directory has to be listed
+        """
+        if cached is None or mtime is None or cached.get('last_modified') != str(mtime):
+            return None
+        listing = json.loads(cached.get('entries'))
+        replays = listing.get('replays', 0) + 1
+        if 0 < self.revalidate_runs <= replays:
+            return None
+
+        return DirectoryListing(
+            records=listing.get('records'), directories=[(directory, None) for directory in listing.get('directories')],
+            mtime=mtime, replays=replays
+        )
+
+    def store(self, url, listing):
+        """
+        Queues a listing to be written by flush_directory_cache. Listings without a modification time cannot be
+        validated and are not stored.
+        """
+        if listing.replays:
+            self.replayed += 1
+        else:
+            self.listed += 1
+        if listing.mtime is None:
+            return
+
+        self.dbm.write_directory_cache(url, None, str(listing.mtime), json.dumps({
+            'replays': listing.replays,
+            # Modification times are stored as the string the database would store for them so a replayed record is
+            # identical
+            'records': [
+                dict(record, last_modified=str(record['last_modified']) if record.get('last_modified') else None)
+                for record in listing.records
+            ],
+            'directories': [directory for directory, _ in listing.directories]
+        }))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,95 @@
+from xml.etree.ElementTree import Element, XMLPullParser, tostring
+
+from task.timestamp import parse_iso_date, parse_timestamp
+
+LIST_OBJECTS_V2_EVENT = 'before-parse.s3.ListObjectsV2'
+# The Contents fields discovery uses. The rest, such as StorageClass and Owner, are skipped.
+CONTENTS_FIELDS = ('Key', 'ETag', 'Size', 'LastModified')
+# Bytes of the response body handed to the XML parser at a time
+FEED_SIZE = 64 * 1024
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def read_events(body):
+    """
+    Feeds the body to the parser FEED_SIZE bytes at a time and yields the events of each piece before the next is
+    parsed, so elements the caller removes from the tree are freed before the rest of the page is parsed.
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    for index in range(0, len(body), FEED_SIZE):
+        parser.feed(body[index:index + FEED_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def parse_list_objects_v2(body):
+    """
+    Incrementally parses a ListObjectsV2 response body, keeping only the fields of each object discovery uses.
+    :param body: ListBucketResult XML bytes
+    :return: Tuple of (list of dictionaries with Key, ETag, Size and LastModified, the ListBucketResult XML with the
+    Contents elements removed)
+    """
+    contents = []
+    root = None
+    remainder = None
+    depth = 0
+    s3_object = {}
+    for event, element in read_events(body):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = element
+                remainder = Element(element.tag, element.attrib)
+            continue
+
+        depth -= 1
+        if depth == 2:
+            name = local_name(element.tag)
+            if name in CONTENTS_FIELDS:
+                s3_object[name] = element.text or ''
+        elif depth == 1:
+            if local_name(element.tag) == 'Contents':
+                last_modified = s3_object.get('LastModified', '')
+                contents.append({
+                    'Key': s3_object.get('Key', ''),
+                    'ETag': s3_object.get('ETag', ''),
+                    'Size': int(s3_object.get('Size') or 0),
+                    'LastModified': parse_iso_date(last_modified) or parse_timestamp(last_modified)
+                })
+            else:
+                remainder.append(element)
+            s3_object = {}
+            # Parsed objects are dropped from the tree so it never holds more than about one FEED_SIZE piece of the
+            # page. The body itself is already in memory, read by botocore before this handler runs.
+            root.clear()
+
+    return contents, tostring(remainder) if remainder is not None else body
+
+
+def fast_list_objects_v2(response_dict, customized_response_dict, **kwargs):
+    """
+    botocore before-parse handler for ListObjectsV2. The objects are parsed here into small dictionaries and removed
+    from the body before botocore's parser runs, so it only parses the pagination fields and common prefixes.
+    Requests are still signed, retried and paginated by botocore. Error responses are left to botocore.
+    """
+    if response_dict.get('status_code') != 200 or not response_dict.get('body'):
+        return
+    contents, remainder = parse_list_objects_v2(response_dict.get('body'))
+    if contents:
+        customized_response_dict['Contents'] = contents
+    response_dict['body'] = remainder
+
+
+def enable_fast_listing(s3_client):
+    """
+    Registers fast_list_objects_v2 on an S3 client so list_objects_v2 pages carry only the fields discovery uses.
+    """
+    s3_client.meta.events.register(LIST_OBJECTS_V2_EVENT, fast_list_objects_v2)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,106 @@
+import datetime
+import re
+
+# Month abbreviations used by HTTP dates and ls style listings
+MONTHS = {
+    name: index for index, name in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1
+    )
+}
+# RFC 7231 IMF-fixdate as sent in Last-Modified headers: Thu, 02 Apr 2020 15:06:03 GMT
+HTTP_DATE_RE = re.compile(r'(?:[A-Z][a-z]{2}, )?(\d{1,2}) ([A-Z][a-z]{2}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) GMT')
+# Unix ls -l date columns: "May 01 14:08" for files changed in the last six months, "May 01 2020" for older ones
+LS_DATE_RE = re.compile(r'([A-Z][a-z]{2}) (\d{1,2}) (?:(\d{2}):(\d{2})|(\d{4}))')
+# Epoch seconds with optional milliseconds and microseconds appended, the same pattern dateparser accepts
+EPOCH_RE = re.compile(r'(\d{10})(\d{3})?(\d{3})?(?:\.\d*)?')
+ISO_DATE_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(Z|([+-])(\d{2}):(\d{2}))?)?'
+)
+
+
+def parse_http_date(value):
+    match = HTTP_DATE_RE.fullmatch(value)
+    if not match or match.group(2) not in MONTHS:
+        return None
+    day, month, year, hour, minute, second = match.groups()
+    return datetime.datetime(
+        int(year), MONTHS[month], int(day), int(hour), int(minute), int(second), tzinfo=datetime.timezone.utc
+    )
+
+
+def parse_ls_date(value):
+    match = LS_DATE_RE.fullmatch(value)
+    if not match or match.group(1) not in MONTHS:
+        return None
+    month, day, hour, minute, year = match.groups()
+    if year:
+        return datetime.datetime(int(year), MONTHS[month], int(day))
+    # ls leaves the year out for recent files. It is taken to be the current year, as dateparser did.
+    return datetime.datetime(datetime.datetime.now().year, MONTHS[month], int(day), int(hour), int(minute))
+
+
+def parse_epoch(value):
+    match = EPOCH_RE.fullmatch(value)
+    if not match:
+        return None
+    seconds, millis, micros = match.groups()
+    # Fractions after a decimal point are dropped, as dateparser does
+    return datetime.datetime.fromtimestamp(int(seconds)).replace(microsecond=int(millis or 0) * 1000 + int(micros or 0))
+
+
+def parse_iso_date(value):
+    # Built from the fields rather than with datetime.fromisoformat, which only accepts Z and fractions of other than 3
+    # or 6 digits from Python 3.11
+    match = ISO_DATE_RE.fullmatch(value)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, zone, sign, zone_hours, zone_minutes = match.groups()
+    tzinfo = None
+    if zone == 'Z':
+        tzinfo = datetime.timezone.utc
+    elif zone:
+        offset = datetime.timedelta(hours=int(zone_hours), minutes=int(zone_minutes))
+        tzinfo = datetime.timezone(-offset if sign == '-' else offset)
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int((fraction or '0').ljust(6, '0')), tzinfo=tzinfo
+    )
+
+
+FAST_PARSERS = (parse_http_date, parse_ls_date, parse_epoch, parse_iso_date)
+
+
+def parse_timestamp(value):
+    """
+    Parses a modification time from a Last-Modified header, an FTP LIST line, an SFTP st_mtime or a catalog. HTTP dates,
+    ls dates, epoch seconds and ISO 8601 are parsed directly and anything else is handed to dateparser, so the result is
+    the same as dateparser.parse(str(value)) without its cost for every file of a large listing.
+    :param value: Timestamp string or epoch seconds
+    :return: datetime or None if value is empty or cannot be parsed
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+
+    for parser in FAST_PARSERS:
+        try:
+            ret = parser(value)
+        except ValueError:
+            # Out of range fields such as Feb 30 are left for dateparser to reject or interpret
+            break
+        if ret is not None:
+            return ret
+
+    return dateparser_parse(value)
+
+
+def dateparser_parse(value):
+    # dateparser takes a long time to import so it is only loaded if a timestamp needs it
+    import dateparser  # pylint: disable=import-outside-toplevel
+    return dateparser.parse(value)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,68 @@
+"""
+Synthetic ListObjectsV2 pages and an S3 client stubbed to answer with them, shared by test_s3_listing.py and
+dev_utils/benchmark_s3_listing.py.
+"""
+from urllib.parse import parse_qs, quote, urlparse
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+from task.discover_granules_s3 import get_s3_resp_iterator
+from task.s3_listing import enable_fast_listing
+
+NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **_):
+        yield self.body
+
+
+def list_objects_v2_page(keys, token=None, next_token=None, encode=False):
+    contents = ''.join(
+        f'<Contents><Key>{quote(key) if encode else key}</Key>'
+        f'<LastModified>2021-05-07T09:27:{index % 60:02d}.{index:03d}Z</LastModified>'
+        f'<ETag>&quot;{index:032x}&quot;</ETag><ChecksumAlgorithm>CRC32</ChecksumAlgorithm><Size>{index * 7}</Size>'
+        f'<Owner><ID>owner</ID><DisplayName>owner</DisplayName></Owner><StorageClass>STANDARD</StorageClass></Contents>'
+        for index, key in enumerate(keys)
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="{NAMESPACE}"><Name>bucket</Name>'
+        f'<Prefix>ssmi/</Prefix>{f"<ContinuationToken>{token}</ContinuationToken>" if token else ""}'
+        f'{f"<NextContinuationToken>{next_token}</NextContinuationToken>" if next_token else ""}'
+        f'<KeyCount>{len(keys)}</KeyCount><MaxKeys>1000</MaxKeys>'
+        f'{"<EncodingType>url</EncodingType>" if encode else ""}'
+        f'<IsTruncated>{"true" if next_token else "false"}</IsTruncated>{contents}'
+        '<CommonPrefixes><Prefix>ssmi/f16/</Prefix></CommonPrefixes></ListBucketResult>'
+    ).encode()
+
+
+def stubbed_client(pages, fast_listing):
+    """
+    :param pages: Dictionary of continuation token, '' for the first request, to response body
+    :return: S3 client answering list_objects_v2 from pages without network access
+    """
+    client = boto3.client(
+        's3', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret'
+    )
+    requests = []
+
+    def send(request, **_):
+        requests.append(request)
+        token = parse_qs(urlparse(request.url).query).get('continuation-token', [''])[0]
+        return AWSResponse(request.url, 200, {}, RawBody(pages[token]))
+
+    client.meta.events.register('before-send.s3.ListObjectsV2', send)
+    if fast_listing:
+        enable_fast_listing(client)
+    return client, requests
+
+
+def list_contents(client):
+    return [
+        {key: s3_object[key] for key in ('Key', 'ETag', 'Size', 'LastModified')}
+        for page in get_s3_resp_iterator('bucket', 'ssmi/', client) for s3_object in page.get('Contents', [])
+    ]
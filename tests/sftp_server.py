@@ -0,0 +1,171 @@
+import os
+import shlex
+import socket
+import subprocess
+import threading
+import time
+
+import paramiko
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+USERNAME = 'test_username'
+PASSWORD = 'test_password'
+
+
+class StubServer(paramiko.ServerInterface):
+    """
+    Accepts USERNAME and PASSWORD and up to max_sessions session channels per connection
+    """
+
+    def __init__(self, sftp_server):
+        self.sftp_server = sftp_server
+        self.sessions = 0
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind != 'session':
+            return paramiko.OPEN_FAILED_UNKNOWN_CHANNEL_TYPE
+        if self.sessions >= self.sftp_server.max_sessions:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        self.sessions += 1
+        with self.sftp_server.lock:
+            self.sftp_server.stats['sessions'] += 1
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.sftp_server.exec_enabled:
+            return False
+        threading.Thread(target=self.sftp_server.execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class StubSFTPHandler(paramiko.SFTPServerInterface):
+    """
+    Serves the directory tree under the root of the SFTPServer the connection was made to
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.sftp_server = server.sftp_server
+
+    def real_path(self, path):
+        return os.path.join(self.sftp_server.root, self.canonicalize(path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return os.path.normpath(f'/{path}' if not path.startswith('/') else path).replace('//', '/')
+
+    def list_folder(self, path):
+        stats = self.sftp_server.stats
+        with self.sftp_server.lock:
+            stats['listings'].append(path)
+            stats['active'] += 1
+            stats['peak'] = max(stats['peak'], stats['active'])
+        try:
+            # Long enough for listings on other channels to overlap
+            time.sleep(0.02)
+            real_path = self.real_path(path)
+            if not os.path.isdir(real_path):
+                return paramiko.SFTP_NO_SUCH_FILE
+            attrs = []
+            for name in sorted(os.listdir(real_path)):
+                attr = paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(real_path, name)))
+                attr.filename = name
+                attrs.append(attr)
+            return attrs
+        finally:
+            with self.sftp_server.lock:
+                stats['active'] -= 1
+
+    def stat(self, path):
+        with self.sftp_server.lock:
+            self.sftp_server.stats['stats'] += 1
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.real_path(path)))
+        except OSError:
+            return paramiko.SFTP_NO_SUCH_FILE
+
+    lstat = stat
+
+
+class SFTPServer:
+    """
+    An SFTP server on a local port serving root, run in background threads for the length of a with block
+    """
+
+    def __init__(self, root, max_sessions=10, exec_enabled=False):
+        self.root = root
+        self.max_sessions = max_sessions
+        self.exec_enabled = exec_enabled
+        self.lock = threading.Lock()
+        self.stats = {
+            'connections': 0, 'sessions': 0, 'listings': [], 'stats': 0, 'active': 0, 'peak': 0, 'commands': []
+        }
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.transports = []
+
+    def __enter__(self):
+        self.socket.listen(8)
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(HOST_KEY)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSFTPHandler)
+            server = StubServer(self)
+            self.transports.append(transport)
+            with self.lock:
+                self.stats['connections'] += 1
+            transport.start_server(server=server)
+
+    def execute(self, channel, command):
+        """
+        Runs find commands on the served tree, with paths mapped to and from the local directory, and fails anything
+        else as a shell without the command would
+        """
+        self.stats['commands'].append(command)
+        args = shlex.split(command)
+        if args[0] != 'find':
+            channel.sendall_stderr(f'sh: {args[0]}: command not found\n'.encode())
+            channel.send_exit_status(127)
+            channel.close()
+            return
+
+        # Options such as -L come before the starting point
+        index = 1
+        while args[index].startswith('-'):
+            index += 1
+        local_root = os.path.join(self.root, args[index].lstrip('/')).rstrip('/')
+        result = subprocess.run(
+            ['find'] + args[1:index] + [local_root] + args[index + 1:], capture_output=True, check=False
+        )
+        output = result.stdout.decode().replace(f'{local_root}/', f'{args[index].rstrip("/")}/')
+        channel.sendall(output.encode())
+        channel.sendall_stderr(result.stderr)
+        channel.send_exit_status(result.returncode)
+        channel.close()
+
+    def provider(self):
+        return {
+            'protocol': 'sftp', 'host': '127.0.0.1', 'port': self.port, 'username': USERNAME, 'password': PASSWORD
+        }
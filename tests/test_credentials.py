@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from task import credentials
+
+
+class FakeKms:
+    def __init__(self, CiphertextBlob):
+        self.rsp = {'Plaintext': CiphertextBlob}
+
+    def decrypt(self, CiphertextBlob, KeyId):
+        return self.rsp
+
+
+class TestCredentials(unittest.TestCase):
+    def test_kms_decrypt_ciphertext(self):
+        os.environ['AWS_DECRYPT_KEY_ARN'] = 'fake_arn'
+        t = b'test_text'
+        kms_client = FakeKms(t)
+        res = credentials.kms_decrypt_ciphertext(t, kms_client)
+        self.assertEqual(t.decode(), res)
+
+    @patch('boto3.client')
+    def test_kms_decrypt_ciphertext_2(self, mock_client):
+        t = b'test_text'
+        mock_client.side_effect = [FakeKms(t)]
+        os.environ['AWS_DECRYPT_KEY_ARN'] = 'fake_arn'
+        res = credentials.kms_decrypt_ciphertext(t)
+        self.assertEqual(t.decode(), res)
+
+    @patch('task.credentials.kms_decrypt_ciphertext')
+    def test_decrypt_credential_none(self, mock_kms):
+        username = None
+        mock_kms.side_effect = [username]
+        credentials.decrypt_credential(username, True)
+        self.assertEqual(mock_kms.call_count, 0)
+
+    @patch('task.credentials.kms_decrypt_ciphertext')
+    def test_decrypt_credential(self, mock_kms):
+        username = 'something'
+        mock_kms.side_effect = [username]
+        credentials.decrypt_credential(username, True)
+        self.assertEqual(mock_kms.call_count, 1)
+
+    def test_http_does_not_import_paramiko(self):
+        # The HTTP discoverer decrypts its credentials without pulling in the SFTP dependencies
+        code = 'import sys, task.discover_granules_http; print("paramiko" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual('False', result.stdout.strip())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,14 @@
+import multiprocessing
+import os
 import re
+import tempfile
 import time
 import unittest
 
 import dateparser
 
 from task.dbm_get import get_db_manager
-from task.dbm_sqlite import DB_SQLITE, GranuleSQLite
+from task.dbm_sqlite import DB_SQLITE, DBManagerSqlite, GranuleSQLite
 from playhouse.shortcuts import model_to_dict
 
 
@@ -180,7 +183,8 @@ class TestDGM(unittest.TestCase):
         }
         self.dbm.add_record(**record)
         self.dbm.flush_dict()
-        res = self.dbm.read_batch()[0]
+        self.assertEqual(1, len(self.dbm.read_batch()))
+        res = model_to_dict(GranuleSQLite.get(GranuleSQLite.name == record['name']))
         self.assertEqual(res['last_modified'], '2020-02-04 23:07:51+00:00')
         self.assertIsNotNone(re.search(r'\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2}', res['discovered_date']))
         self.assertEqual(res['etag'], record['etag'])
@@ -197,12 +201,216 @@ class TestDGM(unittest.TestCase):
         }
         self.dbm.add_record(**record)
         self.dbm.flush_dict()
-        res = self.dbm.read_batch()[0]
+        self.assertEqual(1, len(self.dbm.read_batch()))
+        res = model_to_dict(GranuleSQLite.get(GranuleSQLite.name == record['name']))
         self.assertEqual(res['last_modified'], '2024-07-01 13:20:15.411938-05:00')
         self.assertIsNotNone(re.search(r'\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2}', res['discovered_date']))
         self.assertEqual(res['etag'], record['etag'])
         self.assertEqual(res['size'], record['size'])
 
+    def test_read_batch_columns(self):
+        test_dict = generate_test_dict(provider_url=self.provider_full_url, collection_id=self.collection_id)
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+
+        batch = self.dbm.read_batch()
+        self.assertEqual([{'name': test_dict.get('granule_list_dict')[0]['name'], 'size': 1}], batch)
+
+    def test_read_batch_too_many_granules(self):
+        self.dbm.batch_limit = 10
+        test_dict = generate_test_dict(
+            provider_url=self.provider_full_url, collection_id=self.collection_id, granule_count=15, file_count=2
+        )
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+
+        self.assertEqual(20, len(self.dbm.read_batch()))
+        self.assertEqual(10, len(self.dbm.read_batch()))
+        self.assertEqual(0, len(self.dbm.read_batch()))
+
+    def test_read_batch_granule_across_pages(self):
+        # Pages hold batch_limit * file_count rows, so the rows of each three-file granule span two pages
+        self.dbm.batch_limit = 2
+        test_dict = generate_test_dict(
+            provider_url=self.provider_full_url, collection_id=self.collection_id, granule_count=3, file_count=3
+        )
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+
+        self.assertEqual(6, len(self.dbm.read_batch()))
+        self.assertEqual(3, len(self.dbm.read_batch()))
+
+    def test_read_batch_complete_multifile_granule(self):
+        self.dbm.file_count = 3
+        test_dict = generate_test_dict(
+            provider_url=self.provider_full_url, collection_id=self.collection_id, file_count=3
+        )
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+
+        self.assertEqual(3, len(self.dbm.read_batch()))
+
+    def test_read_batch_incomplete_multifile_granule(self):
+        self.dbm.file_count = 3
+        test_dict = generate_test_dict(
+            provider_url=self.provider_full_url, collection_id=self.collection_id, file_count=3
+        )
+        last_record = test_dict.get('granule_list_dict').pop(-1)
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+        self.assertEqual(0, len(self.dbm.read_batch()))
+
+        # The granule is claimed once the missing file is discovered
+        self.dbm.add_record(**last_record)
+        self.dbm.flush_dict()
+        self.assertEqual(3, len(self.dbm.read_batch()))
+
+    def test_read_batch_provider_prefix(self):
+        other_dict = generate_test_dict(provider_url='some://other/url', collection_id=self.collection_id)
+        for record in other_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+
+        self.assertEqual(0, len(self.dbm.read_batch()))
+
+    def test_read_batch_uses_index(self):
+        query_plan = ' '.join(str(row) for row in DB_SQLITE.execute_sql(
+            "EXPLAIN QUERY PLAN SELECT discovered_date, granule_id FROM granule "
+            "WHERE collection_id = ? AND status = 'discovered' AND substr(name, 1, ?) = ? "
+            "AND (discovered_date, granule_id) > (?, ?) ORDER BY discovered_date, granule_id LIMIT ?",
+            ['test', 1, 's', '', '', 10]
+        ))
+        self.assertIn('COVERING INDEX granulesqlite_collection_id_status_discovered_date', query_plan)
+        self.assertNotIn('TEMP B-TREE', query_plan)
+
+        query_plan = ' '.join(str(row) for row in DB_SQLITE.execute_sql(
+            "EXPLAIN QUERY PLAN SELECT granule_id FROM granule "
+            "WHERE collection_id = ? AND status = 'discovered' AND substr(name, 1, ?) = ? "
+            "AND granule_id IN (?, ?) GROUP BY granule_id HAVING COUNT(*) >= ?",
+            ['test', 1, 's', 'a', 'b', 1]
+        ))
+        self.assertIn('COVERING INDEX granulesqlite_collection_id_status_granule_id_name', query_plan)
+
+    def test_read_batch_cursor_between_invocations(self):
+        self.dbm.batch_limit = 2
+        test_dict = generate_test_dict(
+            provider_url=self.provider_full_url, collection_id=self.collection_id, granule_count=5
+        )
+        for record in test_dict.get('granule_list_dict'):
+            self.dbm.add_record(**record)
+        self.dbm.flush_dict()
+        first = self.dbm.read_batch()
+        self.assertEqual(2, len(first))
+
+        # A later invocation starts from the cursor the previous one returned and does not scan the claimed rows
+        dbm = DBManagerSqlite(
+            DB_SQLITE, GranuleSQLite, batch_cursor=list(self.dbm.keyset_cursor), collection_id=self.collection_id,
+            provider_url=self.provider_full_url, batch_limit=2
+        )
+        scanned = []
+        scan_discovered = dbm.scan_discovered
+
+        def scan(cursor, scan_size):
+            rows = scan_discovered(cursor, scan_size)
+            scanned.extend(granule_id for _, granule_id in rows)
+            return rows
+
+        dbm.scan_discovered = scan
+        self.assertEqual(2, len(dbm.read_batch()))
+        self.assertEqual('granule_id_2', scanned[0])
+        self.assertNotIn('granule_id_0', scanned)
+        self.assertEqual(1, len(dbm.read_batch()))
+
+    def test_directory_cache(self):
+        url = f'{self.provider_full_url}/dir/'
+        self.assertIsNone(self.dbm.read_directory_cache(url))
+        self.dbm.write_directory_cache(url, '"etag1"', 'Thu, 02 Apr 2020 15:06:03 GMT', '[]')
+        self.assertEqual(1, self.dbm.flush_directory_cache())
+        self.dbm.write_directory_cache(url, '"etag2"', None, '[["url", false, 1, null, null]]')
+        self.dbm.flush_directory_cache()
+
+        self.assertEqual(
+            {'etag': '"etag2"', 'last_modified': None, 'entries': '[["url", false, 1, null, null]]'},
+            self.dbm.read_directory_cache(url)
+        )
+        # The cache is kept per collection
+        self.dbm.collection_id = 'other'
+        self.assertIsNone(self.dbm.read_directory_cache(url))
+
+
+def shared_worker(database, worker_id, granule_count, provider_url, collection_id):
+    """
+    Discovers granule_count granules into a shared database and then claims batches until none remain.
+    :return: The names of the records this worker claimed
+    """
+    dbm = get_db_manager(
+        db_type='sqlite', database=database, collection_id=collection_id, provider_url=provider_url,
+        batch_limit=10, duplicate_handling='skip', sqlite_shared=True, transaction_size=50
+    )
+    try:
+        for x in range(granule_count):
+            dbm.add_record(
+                name=f'{provider_url}/worker_{worker_id}_granule_{x}', granule_id=f'worker_{worker_id}_granule_{x}',
+                collection_id=collection_id, etag='etag', last_modified='modified', size=1
+            )
+        dbm.flush_dict()
+
+        claimed = []
+        while True:
+            batch = dbm.read_batch()
+            if not batch:
+                break
+            claimed.extend(record.get('name') for record in batch)
+    finally:
+        dbm.close_db()
+
+    return claimed
+
+
+class TestDGMSharedAccess(unittest.TestCase):
+    """
+    Tests multiple processes discovering into and claiming from the same SQLite file
+    """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.temp_dir.name, 'shared.db')
+        self.collection_id = 'test'
+        self.provider_full_url = 'some://fake/full/url'
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_shared_mode_settings(self):
+        dbm = get_db_manager(
+            db_type='sqlite', database=self.database, collection_id=self.collection_id,
+            provider_url=self.provider_full_url, batch_limit=10, sqlite_shared=True
+        )
+        try:
+            self.assertEqual('unix', DB_SQLITE.connect_params.get('vfs'))
+            self.assertEqual('wal', DB_SQLITE.execute_sql('PRAGMA journal_mode;').fetchone()[0])
+        finally:
+            dbm.close_db()
+
+    def test_multiple_processes(self):
+        worker_count = 4
+        granule_count = 200
+        ctx = multiprocessing.get_context('spawn')
+        args = [
+            (self.database, x, granule_count, self.provider_full_url, self.collection_id) for x in range(worker_count)
+        ]
+        with ctx.Pool(worker_count) as pool:
+            results = pool.starmap(shared_worker, args)
+
+        claimed = [name for result in results for name in result]
+        self.assertEqual(worker_count * granule_count, len(claimed))
+        self.assertEqual(len(claimed), len(set(claimed)))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,11 @@
 import time
+from unittest.mock import MagicMock, patch
+
 import psycopg2
 import pytest
 
-from task.dbm_postgresql import get_db_manager_psql
+from task import dbm_postgresql
+from task.dbm_postgresql import get_db_manager_psql, get_secret_db_params, DBManagerPSQL
 
 
 @pytest.fixture(scope="session")
@@ -161,7 +164,9 @@ def test_psql_skip_update_check_value(postgresql_service, test_dict_factory):
     orig_record = test_dict['granule_list_dict'][0]
     postgresql_service.add_record(**orig_record)
     postgresql_service.write_batch()
-    orig_row = postgresql_service.read_batch()[0]
+    assert postgresql_service.read_batch()[0] == {'name': orig_record['name'], 'size': orig_record['size']}
+    # The claimed batch only carries the name and size, so the other columns are read from the table
+    orig_row = postgresql_service.model_class.get_by_id(orig_record['name']).__data__
     print(f'Original row: {orig_row}')
 
     assert orig_record['etag'] == orig_row['etag']
@@ -173,7 +178,8 @@ def test_psql_skip_update_check_value(postgresql_service, test_dict_factory):
     updated_record['last_modified'] = '2023-03-33 33:33:33+00:00'
     postgresql_service.add_record(**updated_record)
     postgresql_service.write_batch()
-    updated_row = postgresql_service.read_batch()[0]
+    assert postgresql_service.read_batch()[0] == {'name': updated_record['name'], 'size': updated_record['size']}
+    updated_row = postgresql_service.model_class.get_by_id(updated_record['name']).__data__
     print(f'Updated row: {updated_row}')
 
     assert updated_record['etag'] == updated_row['etag']
@@ -286,3 +292,63 @@ def test_psql_skip_incomplete_multifile_granule(postgresql_service, test_dict_fa
     postgresql_service.write_batch()
     batch = postgresql_service.read_batch()
     assert len(batch) == 0
+
+
+def test_psql_read_batch_name_and_size(postgresql_service, test_dict_factory):
+    test_dict = test_dict_factory(
+        provider_url=postgresql_service.provider_full_url, collection_id=postgresql_service.collection_id,
+        granule_count=postgresql_service.batch_limit + 10, size=4
+    )
+    postgresql_service.file_count = 1
+
+    for record in test_dict.get('granule_list_dict'):
+        postgresql_service.add_record(**record)
+
+    postgresql_service.write_batch()
+    full_batch = postgresql_service.read_batch()
+    assert len(full_batch) == postgresql_service.batch_limit
+    assert full_batch[0] == {'name': full_batch[0]['name'], 'size': 4}
+    rem_batch = postgresql_service.read_batch()
+    assert len(rem_batch) == 10
+    assert not {x['name'] for x in full_batch} & {x['name'] for x in rem_batch}
+    assert len(postgresql_service.read_batch()) == 0
+
+
+def test_psql_directory_cache(postgresql_service):
+    url = f'{postgresql_service.provider_full_url}/dir/'
+    postgresql_service.write_directory_cache(url, '"etag1"', None, '[]')
+    postgresql_service.flush_directory_cache()
+    postgresql_service.write_directory_cache(url, '"etag2"', 'Thu, 02 Apr 2020 15:06:03 GMT', '[]')
+    assert postgresql_service.flush_directory_cache() == 1
+    assert postgresql_service.read_directory_cache(url) == {
+        'etag': '"etag2"', 'last_modified': 'Thu, 02 Apr 2020 15:06:03 GMT', 'entries': '[]'
+    }
+
+
+def test_psql_read_batch_columns():
+    database = MagicMock()
+    cursor = database.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [('a', 1), ('b', 2)]
+    dbm = DBManagerPSQL(database, MagicMock(), collection_id='id', provider_url='url')
+
+    batch = dbm.read_batch()
+    assert batch == [{'name': 'a', 'size': 1}, {'name': 'b', 'size': 2}]
+    assert 'RETURNING granule.name, granule.size' in str(cursor.execute.call_args.args[0])
+    assert dbm.queued_files_count == 2
+
+
+@patch('task.dbm_postgresql.boto3')
+def test_secret_db_params_ttl(mock_boto3):
+    dbm_postgresql.SECRET_CACHE.clear()
+    get_secret_value = mock_boto3.client.return_value.get_secret_value
+    get_secret_value.return_value = {'SecretString': '{"username": "user", "password": "one"}'}
+    assert get_secret_db_params('arn', ttl=60) == get_secret_db_params('arn', ttl=60)
+    assert get_secret_value.call_count == 1
+
+    # A rotated secret is picked up once the cached copy expires or a refresh is asked for
+    get_secret_value.return_value = {'SecretString': '{"username": "user", "password": "two"}'}
+    assert get_secret_db_params('arn', ttl=60, refresh=True)['password'] == 'two'
+    with patch('time.monotonic', return_value=time.monotonic() + 61):
+        get_secret_db_params('arn', ttl=60)
+    assert get_secret_value.call_count == 3
+    dbm_postgresql.SECRET_CACHE.clear()
@@ -103,6 +103,73 @@ class TestDiscoverGranules(unittest.TestCase):
     def test_check_reg_ex_none(self):
         self.assertTrue(check_reg_ex(None, 'test_text'))
 
+    @patch('task.discover_granules_base.get_db_manager')
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def test_directory_cache_enabled(self, mock_get_dbm):
+        event = get_event('s3')
+        discover_tf = event['config']['collection']['meta'].setdefault('discover_tf', {})
+        discover_tf.update({'directory_cache': True, 'db_type': 'sqlite'})
+        # A SQLite database in a temporary directory is gone by the next discovery
+        dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+        self.assertFalse(dg.directory_cache_enabled())
+
+        discover_tf.update({'sqlite_shared': True})
+        with patch.dict(os.environ, {'EBS_MNT': '/mnt/ebs'}):
+            dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+        self.assertTrue(dg.directory_cache_enabled())
+
+        discover_tf.update({'db_type': 'postgresql', 'sqlite_shared': False})
+        dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+        self.assertTrue(dg.directory_cache_enabled())
+
+
+class TestDiscoverGranulesContinuation(unittest.TestCase):
+    """
+    Tests the lightweight setup used when an invocation only needs to claim a batch
+    """
+
+    @staticmethod
+    def get_continuation_event(**discover_tf):
+        event = get_event('s3')
+        event['config']['collection']['meta'].setdefault('discover_tf', {}).update(discover_tf)
+        return event
+
+    @patch('task.discover_granules_base.get_db_manager')
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def test_continuation_skips_setup(self, mock_get_dbm):
+        event = self.get_continuation_event(discovered_files_count=10, cumulus_filter=True)
+        dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+
+        self.assertTrue(dg.continuation)
+        mock_get_dbm.assert_called_once()
+        self.assertFalse(mock_get_dbm.call_args.kwargs.get('create_tables'))
+        self.assertNotIn('cumulus_filter_dbm', mock_get_dbm.call_args.kwargs)
+
+    @patch('task.discover_granules_base.mkdtemp')
+    @patch('task.discover_granules_base.get_db_manager')
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def test_continuation_no_temporary_directory(self, mock_get_dbm, mock_mkdtemp):
+        event = self.get_continuation_event(discovered_files_count=10, db_type='sqlite')
+        DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+
+        mock_mkdtemp.assert_not_called()
+        self.assertEqual(':memory:', mock_get_dbm.call_args.kwargs.get('database'))
+
+    @patch('task.discover_granules_base.get_db_manager')
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def test_bookmark_is_not_continuation(self, mock_get_dbm):
+        event = self.get_continuation_event(discovered_files_count=10, bookmark='some/key')
+        dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+
+        self.assertFalse(dg.continuation)
+        self.assertTrue(mock_get_dbm.call_args.kwargs.get('create_tables'))
+
+    @patch('task.discover_granules_base.get_db_manager')
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def test_initial_run_is_not_continuation(self, mock_get_dbm):
+        dg = DiscoverGranulesBase(self.get_continuation_event())  # pylint: disable=abstract-class-instantiated
+        self.assertFalse(dg.continuation)
+
 
 class TestDiscoverGranulesMultiFile(unittest.TestCase):
     """
@@ -1,23 +1,370 @@
-import os
-import re
+import datetime
+import ftplib
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
-from task.discover_granules_ftp import DiscoverGranulesFTP
+from task.discover_granules_ftp import DiscoverGranulesFTP, RecursiveListingParser
+from task.ftp_listing import parse_list_line, parse_mlsd_line, parse_mlst_modify
 
-THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def ftp_tree(depth, directories, files, path='/data'):
+    """
+    :return: Dictionary of absolute directory path to its LIST rows for a tree with directories subdirectories and
+    files files in each directory down to depth levels below path
+    """
+    tree = {path: []}
+    for x in range(files):
+        tree[path].append(f'-rw-r--r--    1 0        0            {x:4d} May 01 16:32 f16_{len(tree):04d}{x}v7.gz')
+    if depth > 0:
+        for x in range(directories):
+            tree[path].append(f'drwxr-xr-x    2 0        0            4096 May 01 14:08 dir{x}')
+            tree.update(ftp_tree(depth - 1, directories, files, f'{path}/dir{x}'.replace('//', '/')))
+    return tree
+
+
+class FakeFTP:
+    """
+    FTP client listing a dictionary of directory paths to LIST rows
+    """
+    def __init__(self, tree, stats, fail_after=None, mlsd=False, recursive='yes'):
+        self.tree = tree
+        self.stats = stats
+        self.fail_after = fail_after
+        self.mlsd = mlsd
+        self.recursive = recursive
+        self.path = '/'
+        self.closed = False
+        self.listings = 0
+        stats['connections'] += 1
+
+    def cwd(self, path):
+        self.stats['cwd'].append(path)
+        path = path if path.startswith('/') else f'{self.path.rstrip("/")}/{path}'
+        path = path.rstrip('/') or '/'
+        if path not in self.tree:
+            raise ftplib.error_perm(f'550 {path}: No such file or directory')
+        self.path = path
+
+    def pwd(self):
+        return self.path
+
+    def sendcmd(self, cmd):
+        self.stats['commands'].append(cmd)
+        if cmd == 'FEAT':
+            return f'211-Features:\n{" MLST type*;size*;modify*;" if self.mlsd else ""}\n UTF8\n211 End'
+        if cmd.startswith('OPTS MLST'):
+            return '200 MLST OPTS type;size;modify;'
+        if cmd.startswith('MLST ') and self.mlsd:
+            path = cmd[len('MLST '):].rstrip('/')
+            parent, _, name = path.rpartition('/')
+            rows = [row for row in self.tree.get(parent, []) if row.startswith('d') and row.split()[-1] == name]
+            modify = parse_list_line(rows[0]).last_modified.strftime('%Y%m%d%H%M%S') if rows else '20200501140800'
+            return f'250-Listing {path}\n type=dir;modify={modify}; {path}\n250 End'
+        raise ftplib.error_perm(f'500 {cmd} not understood')
+
+    @staticmethod
+    def mlsd_line(row):
+        entry = parse_list_line(row)
+        modify = entry.last_modified.strftime('%Y%m%d%H%M%S')
+        if entry.is_dir:
+            return f'type=dir;modify={modify};UNIX.mode=0755; {entry.name}'
+        return f'type=file;size={entry.size};modify={modify}.250;UNIX.mode=0644; {entry.name}'
+
+    def recursive_lines(self, path, header):
+        lines = [f'{header}:', f'total {len(self.tree[path])}'] + self.tree[path]
+        for row in self.tree[path]:
+            if row.startswith('d'):
+                name = row.split()[-1]
+                lines += [''] + self.recursive_lines(f'{path.rstrip("/")}/{name}', f'{header}/{name}')
+        return lines
+
+    def retrlines(self, cmd, callback):
+        self.stats['commands'].append(cmd)
+        if cmd == 'LIST -R':
+            if self.recursive == 'refuse':
+                raise ftplib.error_perm('550 -R: No such file or directory')
+            if self.recursive == 'yes':
+                for line in self.recursive_lines(self.path, '.'):
+                    callback(line)
+                return
+        if cmd == 'MLSD' and not self.mlsd:
+            raise ftplib.error_perm('500 MLSD not understood')
+        if self.fail_after is not None and self.listings >= self.fail_after:
+            raise ftplib.error_temp('421 Timeout.')
+        self.listings += 1
+        with self.stats['lock']:
+            self.stats['active'] += 1
+            self.stats['peak'] = max(self.stats['peak'], self.stats['active'])
+        time.sleep(0.01)
+        if cmd == 'MLSD':
+            callback(f'type=cdir;modify=20200501140800; {self.path}')
+        else:
+            callback(f'total {len(self.tree[self.path])}')
+        for row in self.tree[self.path]:
+            callback(self.mlsd_line(row) if cmd == 'MLSD' else row)
+        with self.stats['lock']:
+            self.stats['active'] -= 1
+
+    def close(self):
+        self.closed = True
 
 
 class TestDiscoverGranules(unittest.TestCase):
     def setUp(self) -> None:
         self.dg_client = DiscoverGranulesFTP({}, None)
 
-    @patch.object(re, 'search')
-    def test_process_ftp_list_output(self, re_mock):
-        with open(os.path.join(THIS_DIR, 'ftp_list_output.txt'), 'r+', encoding='utf-8') as sample_output:
-            output = sample_output.read()
-        self.dg_client.dbm.add_record = MagicMock()
-        directory_list = []
-        self.dg_client.process_ftp_list_output(output, directory_list)
-        self.assertEqual(3, self.dg_client.dbm.add_record.call_count)
-        self.assertEqual(3, len(directory_list))
+    def create_discoverer(self, depth, connections):
+        event = {
+            'config': {
+                'provider': {'protocol': 'ftp', 'host': 'ftp.example.com'},
+                'collection': {
+                    'name': 'test', 'version': '1', 'granuleIdExtraction': '^(f16_\\d+v7)\\.gz$',
+                    'meta': {'provider_path': '/data/', 'discover_tf': {'depth': depth, 'ftp_connections': connections}}
+                }
+            }
+        }
+        dg_client = DiscoverGranulesFTP(event, None)
+        dg_client.dbm.add_record = MagicMock()
+        return dg_client
+
+    def crawl(self, dg_client, tree, fail_after=None, mlsd=False, recursive='yes'):
+        stats = {'connections': 0, 'cwd': [], 'commands': [], 'active': 0, 'peak': 0, 'lock': threading.Lock()}
+        clients = []
+
+        def setup_ftp_client(**_):
+            clients.append(FakeFTP(tree, stats, fail_after, mlsd, recursive))
+            return clients[-1]
+
+        with patch('task.discover_granules_ftp.setup_ftp_client', side_effect=setup_ftp_client):
+            dg_client.discover()
+        return stats, clients
+
+    def test_discover_recursive(self):
+        tree = ftp_tree(3, 3, 2)
+        dg_client = self.create_discoverer(2, 4)
+        stats, clients = self.crawl(dg_client, tree)
+
+        # The root, 3 subdirectories and 9 below them with 2 files each. The third level is beyond depth.
+        self.assertEqual(26, dg_client.dbm.add_record.call_count)
+        names = {call.kwargs['name'] for call in dg_client.dbm.add_record.call_args_list}
+        self.assertIn('ftp://ftp.example.com/data/f16_00010v7.gz', names)
+        self.assertEqual(2, len([name for name in names if name.startswith('ftp://ftp.example.com/data/dir2/dir1/')]))
+        self.assertFalse([name for name in names if name.count('/dir') > 2])
+        # Connections are reused, every directory is entered by its absolute path and all are closed
+        self.assertLessEqual(stats['connections'], 4)
+        self.assertTrue(all(path.startswith('/') for path in stats['cwd']))
+        self.assertTrue(all(client.closed for client in clients))
+
+    def test_discover_concurrent(self):
+        dg_client = self.create_discoverer(1, 4)
+        stats, _ = self.crawl(dg_client, ftp_tree(1, 8, 1))
+        self.assertEqual(9, dg_client.dbm.add_record.call_count)
+        self.assertGreater(stats['peak'], 1)
+
+    def test_discover_depth_zero(self):
+        dg_client = self.create_discoverer(0, 4)
+        stats, _ = self.crawl(dg_client, ftp_tree(2, 2, 1))
+        self.assertEqual(1, dg_client.dbm.add_record.call_count)
+        self.assertEqual(1, stats['connections'])
+
+    def test_discover_dir_reg_ex(self):
+        dg_client = self.create_discoverer(2, 2)
+        dg_client.dir_reg_ex = 'dir1/$'
+        self.crawl(dg_client, ftp_tree(2, 2, 1))
+        directories = sorted(call.kwargs['name'].rsplit('/', 1)[0] for call in dg_client.dbm.add_record.call_args_list)
+        self.assertEqual([
+            'ftp://ftp.example.com/data', 'ftp://ftp.example.com/data/dir1', 'ftp://ftp.example.com/data/dir1/dir1'
+        ], directories)
+
+    def test_discover_reconnect(self):
+        dg_client = self.create_discoverer(1, 1)
+        stats, clients = self.crawl(dg_client, ftp_tree(1, 3, 1), fail_after=2)
+        self.assertEqual(4, dg_client.dbm.add_record.call_count)
+        self.assertEqual(2, stats['connections'])
+        self.assertTrue(clients[0].closed)
+
+    def test_discover_mlsd(self):
+        dg_client = self.create_discoverer(1, 2)
+        stats, _ = self.crawl(dg_client, ftp_tree(1, 2, 2), mlsd=True)
+        self.assertEqual(6, dg_client.dbm.add_record.call_count)
+        self.assertNotIn('LIST', stats['commands'])
+        self.assertEqual(3, stats['commands'].count('MLSD'))
+        record = dg_client.dbm.add_record.call_args_list[0].kwargs
+        self.assertEqual((16, 32, 250000, datetime.timezone.utc), (
+            record['last_modified'].hour, record['last_modified'].minute, record['last_modified'].microsecond,
+            record['last_modified'].tzinfo
+        ))
+        self.assertEqual(0, record['size'])
+
+    def test_discover_list_fallback(self):
+        dg_client = self.create_discoverer(1, 2)
+        stats, _ = self.crawl(dg_client, ftp_tree(1, 2, 2))
+        self.assertEqual(6, dg_client.dbm.add_record.call_count)
+        self.assertNotIn('MLSD', stats['commands'])
+        self.assertEqual(3, stats['commands'].count('LIST'))
+
+    def test_parse_mlsd_line(self):
+        self.assertEqual(
+            ('f16 20210507v7.gz', False, 1234, datetime.datetime(2021, 5, 7, 9, 27, tzinfo=datetime.timezone.utc)),
+            parse_mlsd_line('type=file;size=1234;modify=20210507092700;UNIX.mode=0644; f16 20210507v7.gz')
+        )
+        self.assertTrue(parse_mlsd_line('Type=dir;Modify=20210507092700; y2021').is_dir)
+        self.assertIsNone(parse_mlsd_line('type=cdir;modify=20210507092700; /data'))
+        self.assertIsNone(parse_mlsd_line('type=pdir;modify=20210507092700; ..'))
+
+    def test_parse_list_line(self):
+        self.assertEqual(
+            ('my file.gz', False, 5, datetime.datetime(2020, 5, 1)),
+            parse_list_line('-rw-r--r--    1 ftp      ftp             5 May  1  2020 my file.gz')
+        )
+        self.assertEqual(
+            ('nogroup.gz', False, 1234, datetime.datetime(2020, 1, 10)),
+            parse_list_line('-rw-r--r-- 1 owner 1234 Jan 10 2020 nogroup.gz')
+        )
+        self.assertEqual('latest.gz', parse_list_line('lrwxrwxrwx 1 0 0 12 Jan 10 2020 latest.gz -> f16_1.gz').name)
+        self.assertTrue(parse_list_line('drwxr-xr-x    2 0        0            4096 May 01 14:08 dir1').is_dir)
+        self.assertEqual(
+            ('file a.gz', False, 1234, datetime.datetime(2021, 5, 7, 21, 27)),
+            parse_list_line('05-07-2021  09:27PM             1234 file a.gz')
+        )
+        self.assertEqual(
+            ('y2021', True, None, datetime.datetime(2021, 5, 7, 9, 27)),
+            parse_list_line('05-07-21  09:27AM       <DIR>          y2021')
+        )
+        self.assertIsNone(parse_list_line('total 12'))
+        self.assertIsNone(parse_list_line('drwxr-xr-x    2 0        0            4096 May 01 14:08 ..'))
+        # A date that cannot be parsed, such as a localised month name, skips the line
+        self.assertIsNone(parse_list_line('-rw-r--r-- 1 owner 1234 Foo 10 14:08 f16_1.gz'))
+
+    def test_parse_list_line_recent(self):
+        now = datetime.datetime.now()
+        future = now + datetime.timedelta(days=7)
+        entry = parse_list_line(f'-rw-r--r-- 1 0 0 1 {future:%b %d %H:%M} f16.gz')
+        self.assertLessEqual(entry.last_modified, now + datetime.timedelta(days=1))
+
+    def test_discover_mlsd_refused(self):
+        dg_client = self.create_discoverer(1, 1)
+        # MLST advertised in FEAT but MLSD rejected
+        with patch('task.discover_granules_ftp.supports_mlsd', return_value=True):
+            stats, _ = self.crawl(dg_client, ftp_tree(1, 2, 2))
+        self.assertEqual(6, dg_client.dbm.add_record.call_count)
+        self.assertEqual(1, stats['commands'].count('MLSD'))
+        self.assertEqual(3, stats['commands'].count('LIST'))
+
+    def test_discover_recursive_listing(self):
+        expected = self.create_discoverer(2, 4)
+        self.crawl(expected, ftp_tree(3, 3, 2))
+        dg_client = self.create_discoverer(2, 4)
+        dg_client.recursive_listing = True
+        stats, _ = self.crawl(dg_client, ftp_tree(3, 3, 2))
+
+        self.assertEqual(
+            sorted(str(call) for call in expected.dbm.add_record.call_args_list),
+            sorted(str(call) for call in dg_client.dbm.add_record.call_args_list)
+        )
+        self.assertEqual(['FEAT', 'LIST -R'], stats['commands'])
+        self.assertEqual(1, stats['connections'])
+
+    def test_discover_recursive_listing_dir_reg_ex(self):
+        dg_client = self.create_discoverer(2, 2)
+        dg_client.recursive_listing = True
+        dg_client.dir_reg_ex = 'dir1/$'
+        self.crawl(dg_client, ftp_tree(2, 2, 1))
+        directories = sorted(call.kwargs['name'].rsplit('/', 1)[0] for call in dg_client.dbm.add_record.call_args_list)
+        self.assertEqual([
+            'ftp://ftp.example.com/data', 'ftp://ftp.example.com/data/dir1', 'ftp://ftp.example.com/data/dir1/dir1'
+        ], directories)
+
+    def test_discover_recursive_listing_ignored(self):
+        dg_client = self.create_discoverer(1, 2)
+        dg_client.recursive_listing = True
+        stats, _ = self.crawl(dg_client, ftp_tree(1, 2, 2), recursive='ignore')
+        self.assertEqual(6, dg_client.dbm.add_record.call_count)
+        self.assertEqual(['FEAT', 'LIST -R', 'LIST', 'LIST'], stats['commands'])
+
+    def test_discover_recursive_listing_refused(self):
+        dg_client = self.create_discoverer(1, 2)
+        dg_client.recursive_listing = True
+        stats, _ = self.crawl(dg_client, ftp_tree(1, 2, 2), recursive='refuse')
+        self.assertEqual(6, dg_client.dbm.add_record.call_count)
+        self.assertEqual(3, stats['commands'].count('LIST'))
+
+    def test_recursive_listing_section_directory(self):
+        dg_client = self.create_discoverer(1, 1)
+        parser = RecursiveListingParser(dg_client, '/data')
+        self.assertEqual('', parser.section_directory('.'))
+        self.assertEqual('', parser.section_directory('/data'))
+        self.assertEqual('y2021/m03/', parser.section_directory('./y2021/m03'))
+        self.assertEqual('y2021/', parser.section_directory('y2021'))
+        self.assertEqual('y2021/', parser.section_directory('/data/y2021'))
+        self.assertEqual('/other', parser.section_directory('/other'))
+        self.assertEqual('y2021/', RecursiveListingParser(dg_client, '').section_directory('/y2021'))
+
+    def create_cached_discoverer(self, stored, revalidate_runs=10):
+        dg_client = self.create_discoverer(2, 2)
+        dg_client.directory_cache = True
+        dg_client.revalidate_runs = revalidate_runs
+        dg_client.dbm.read_directory_cache = stored.get
+        dg_client.dbm.write_directory_cache = lambda url, etag, last_modified, entries: stored.update(
+            {url: {'etag': etag, 'last_modified': last_modified, 'entries': entries}}
+        )
+        return dg_client
+
+    @staticmethod
+    def recorded(dg_client):
+        return sorted(
+            str(dict(call.kwargs, last_modified=str(call.kwargs['last_modified'])))
+            for call in dg_client.dbm.add_record.call_args_list
+        )
+
+    def test_discover_directory_cache(self):
+        stored = {}
+        tree = ftp_tree(2, 2, 2)
+        first = self.create_cached_discoverer(stored)
+        stats, _ = self.crawl(first, tree, mlsd=True)
+        self.assertEqual(7, stats['commands'].count('MLSD'))
+        self.assertEqual(7, len(stored))
+
+        second = self.create_cached_discoverer(stored)
+        stats, _ = self.crawl(second, tree, mlsd=True)
+        self.assertEqual(0, stats['commands'].count('MLSD'))
+        self.assertEqual(self.recorded(first), self.recorded(second))
+
+        # A directory that has changed is listed again and the unchanged directories below it are not
+        tree['/data'] = [row.replace('May 01 14:08 dir1', 'May 02 14:08 dir1') for row in tree['/data']]
+        tree['/data/dir1'].append('-rw-r--r--    1 0        0            9 May 02 14:08 f16_99999v7.gz')
+        third = self.create_cached_discoverer(stored)
+        stats, _ = self.crawl(third, tree, mlsd=True)
+        self.assertEqual(1, stats['commands'].count('MLSD'))
+        self.assertEqual(15, third.dbm.add_record.call_count)
+        self.assertIn('MLST /data/dir1/', stats['commands'])
+
+    def test_discover_directory_cache_revalidate(self):
+        stored = {}
+        tree = ftp_tree(2, 2, 2)
+        listings = []
+        for _ in range(4):
+            stats, _ = self.crawl(self.create_cached_discoverer(stored, revalidate_runs=2), tree, mlsd=True)
+            listings.append(stats['commands'].count('MLSD'))
+        self.assertEqual([7, 0, 7, 0], listings)
+
+    def test_discover_directory_cache_list(self):
+        stored = {}
+        tree = ftp_tree(2, 2, 2)
+        self.crawl(self.create_cached_discoverer(stored), tree)
+        dg_client = self.create_cached_discoverer(stored)
+        stats, _ = self.crawl(dg_client, tree)
+        # LIST times are too coarse to tell a directory changed within the same minute, so without MLSD every
+        # directory is listed again and nothing is stored
+        self.assertEqual(7, stats['commands'].count('LIST'))
+        self.assertEqual(14, dg_client.dbm.add_record.call_count)
+        self.assertEqual({}, stored)
+
+    def test_parse_mlst_modify(self):
+        self.assertEqual(
+            datetime.datetime(2021, 5, 7, 9, 27, tzinfo=datetime.timezone.utc),
+            parse_mlst_modify('250-Listing /data\n type=dir;modify=20210507092700;UNIX.mode=0755; /data\n250 End')
+        )
+        self.assertIsNone(parse_mlst_modify('250 /data'))
@@ -1,23 +1,107 @@
+import datetime
 import json
 import os
+import threading
+import time
 from unittest.mock import MagicMock, patch
+from zoneinfo import ZoneInfo
 import unittest
 
 from task.discover_granules_http import DiscoverGranulesHTTP
+from task.http_catalog import ThreddsCatalogReader
+from task.http_session import IDENTITY_ENCODING
 from .helpers import configure_event
+from .test_http_catalog import FakeCatalogSession, THREDDS_CATALOG
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 class FakeResponse:
-    def __init__(self, text):
+    def __init__(self, text, url='url'):
         self.text = text
+        self.url = url
+        self.encoding = 'utf-8'
+        self.status_code = 200
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        content = self.text.encode(self.encoding)
+        for index in range(0, len(content), 7):
+            yield content[index:index + 7]
 
 
 class FakeHeadResponse:
-    def __init__(self, headers):
+    def __init__(self, headers, url='url'):
         self.headers = headers
-        self.url = 'url'
+        self.url = url
+
+
+class FakeTreeSession:
+    """
+    Serves a directory tree from a dictionary of {directory_url: [(name, is_directory), ...]} and records the requests
+    that were made and the highest number of requests in flight at once. With listing_metadata the pages are Apache
+    style listings that show the size and modification time of each file. Pages carry an ETag made from their contents
+    and conditional requests for an unchanged page get a 304.
+    """
+    def __init__(self, tree, redirects=None, delay=0, listing_metadata=False):
+        self.tree = tree
+        self.redirects = redirects if redirects else {}
+        self.delay = delay
+        self.listing_metadata = listing_metadata
+        self.not_modified = []
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def track(self, method, url):
+        with self.lock:
+            self.requests.append((method, url))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+    def get(self, url, **kwargs):
+        self.track('GET', url)
+        url = self.redirects.get(url.rstrip('/'), url)
+        if self.listing_metadata:
+            links = ''.join(
+                f'<a href="{name}/">{name}/</a>    2021-05-07 09:27    -\n' if is_dir else
+                f'<a href="{name}">{name}</a>    2021-05-07 09:27    1024\n'
+                for name, is_dir in self.tree.get(url, [])
+            )
+        else:
+            links = ''.join(
+                f'<a href="{name}/">{name}/</a>' if is_dir else f'<a href="{name}">{name}</a>'
+                for name, is_dir in self.tree.get(url, [])
+            )
+        response = FakeResponse(
+            f'<html><body><pre><a href="../">Parent</a>\n<a href="?C=N;O=D">Name</a>\n{links}</pre></body></html>', url
+        )
+        etag = f'"{hash(response.text)}"'
+        response.headers = {'ETag': etag}
+        if kwargs.get('headers', {}).get('If-None-Match') == etag:
+            self.not_modified.append(url)
+            response.status_code = 304
+            response.text = ''
+        return response
+
+    def head(self, url, **kwargs):
+        self.track('HEAD', url)
+        url = self.redirects.get(url, url)
+        if f'{url.rstrip("/")}/' in self.tree:
+            return FakeHeadResponse({'Content-Type': 'text/html'}, f'{url.rstrip("/")}/')
+        return FakeHeadResponse(
+            {'ETag': '"etag"', 'Last-Modified': 'Thu, 02 Apr 2020 15:06:03 GMT', 'Content-Length': '10'}, url
+        )
 
 
 class TestDiscoverGranules(unittest.TestCase):
@@ -69,6 +153,160 @@ class TestDiscoverGranules(unittest.TestCase):
         self.assertTrue(mock_session.called)
         self.assertTrue(self.dg.discover.called)
 
+    def test_crawl_depth(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        root = self.dg.provider_url
+        tree = {
+            root: [('f16_20210101v7.gz', False), ('m01', True)],
+            f'{root}m01/': [('f16_20210102v7.gz', False), ('d01', True)],
+            f'{root}m01/d01/': [('f16_20210103v7.gz', False)]
+        }
+        self.dg.depth = 1
+        session = FakeTreeSession(tree)
+        self.dg.discover(session)
+
+        names = sorted(x['name'] for x in self.dg.dbm.list_dict)
+        self.assertEqual([f'{root}f16_20210101v7.gz', f'{root}m01/f16_20210102v7.gz'], names)
+        self.assertNotIn(('GET', f'{root}m01/d01/'), session.requests)
+
+    def test_crawl_cross_linked_directories(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        root = self.dg.provider_url
+        tree = {
+            root: [('a', True), ('b', True)],
+            f'{root}a/': [('f16_20210101v7.gz', False), ('link', True)],
+            f'{root}b/': [('f16_20210102v7.gz', False)]
+        }
+        # a/link is a symlink to b that the server redirects
+        redirects = {f'{root}a/link': f'{root}b/'}
+        self.dg.depth = 5
+        session = FakeTreeSession(tree, redirects)
+        self.dg.discover(session)
+
+        gets = [url for method, url in session.requests if method == 'GET']
+        heads = [url for method, url in session.requests if method == 'HEAD']
+        self.assertEqual(len(gets), len(set(gets)))
+        self.assertEqual(len(heads), len(set(heads)))
+        # a/link/ is requested once and dropped when it resolves to b/
+        self.assertEqual(4, len(gets))
+        self.assertEqual(2, len(heads))
+        self.assertEqual(2, len(self.dg.dbm.list_dict))
+
+    def test_crawl_listing_metadata(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        root = self.dg.provider_url
+        tree = {
+            root: [('f16_20210101v7.gz', False), ('f16_20210101v7.txt', False), ('m01', True)],
+            f'{root}m01/': [('f16_20210102v7.gz', False)]
+        }
+        self.dg.depth = 1
+        self.dg.listing_metadata = True
+        session = FakeTreeSession(tree, listing_metadata=True)
+        self.dg.discover(session)
+
+        self.assertEqual([('GET', root), ('GET', f'{root}m01/')], session.requests)
+        records = sorted(self.dg.dbm.list_dict, key=lambda x: x['name'])
+        self.assertEqual([f'{root}f16_20210101v7.gz', f'{root}m01/f16_20210102v7.gz'], [x['name'] for x in records])
+        self.assertEqual(1024, records[0]['size'])
+        self.assertEqual('N/A', records[0]['etag'])
+        self.assertEqual(datetime.timezone.utc, records[0]['last_modified'].tzinfo)
+
+    def test_get_links_listing_timezone(self):
+        page = '<pre><a href="../">../</a>\n<a href="f16_1.gz">f16_1.gz</a>  07-May-2021 09:28  10\n</pre>'
+        self.dg.listing_metadata = True
+        self.dg.listing_timezone = ZoneInfo('America/Chicago')
+        entries = self.dg.get_links('https://host/data/', FakeResponse(page))
+        self.assertEqual(
+            datetime.datetime(2021, 5, 7, 14, 28, tzinfo=datetime.timezone.utc), entries[0].last_modified
+        )
+
+    def test_crawl_listing_metadata_disabled(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        self.dg.listing_metadata = False
+        root = self.dg.provider_url
+        tree = {root: [('f16_20210101v7.gz', False), ('f16_20210101v7.txt', False)]}
+        session = FakeTreeSession(tree, listing_metadata=True)
+        self.dg.discover(session)
+
+        self.assertEqual([('GET', root), ('HEAD', f'{root}f16_20210101v7.gz')], session.requests)
+        self.assertEqual('etag', self.dg.dbm.list_dict[0]['etag'])
+
+    def test_crawl_concurrency_limit(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        root = self.dg.provider_url
+        tree = {root: [(f'd{x}', True) for x in range(6)]}
+        for x in range(6):
+            tree[f'{root}d{x}/'] = [(f'f16_2021010{x}v7.gz', False)]
+        self.dg.depth = 1
+        self.dg.concurrency = 3
+        session = FakeTreeSession(tree, delay=0.01)
+        self.dg.discover(session)
+
+        self.assertEqual(6, len(self.dg.dbm.list_dict))
+        self.assertLessEqual(session.max_in_flight, 3)
+        self.assertGreater(session.max_in_flight, 1)
+
+    def test_get_links_multibyte_characters(self):
+        # The 7 byte chunks of FakeResponse split the two byte characters
+        page = '<pre><a href="../">../</a>\n<a href="f16_ééé.gz">f16_ééé.gz</a>  07-May-2021 09:28  10\n</pre>'
+        self.dg.listing_metadata = True
+        entries = self.dg.get_links('https://host/data/', FakeResponse(page))
+        self.assertEqual(['https://host/data/f16_ééé.gz'], [x.url for x in entries])
+        self.assertEqual(10, entries[0].size)
+
+    def test_crawl_thredds_catalog(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        self.dg.catalog_reader = ThreddsCatalogReader({})
+        self.dg.depth = 1
+        root = self.dg.provider_url
+        sub_catalog = THREDDS_CATALOG.replace(b'y2020/f16_202004', b'y2020/m04/f16_202104')
+        sub_catalog = sub_catalog.replace(b'm04/catalog', b'x')
+        sub_catalog = sub_catalog.replace(b'units="Mbytes">1.804', b'units="bytes">1891993')
+        session = FakeCatalogSession({f'{root}catalog.xml': THREDDS_CATALOG, f'{root}m04/catalog.xml': sub_catalog})
+        rounded_size_file = 'https://data.remss.com/thredds/fileServer/ssmi/y2020/f16_20200402v7.gz'
+        session.head = MagicMock(return_value=FakeHeadResponse(
+            {'ETag': '"etag"', 'Last-Modified': 'Fri, 03 Apr 2020 13:51:00 GMT', 'Content-Length': '1891993'},
+            rounded_size_file
+        ))
+        self.dg.discover(session)
+
+        # One request per catalog page, a HEAD for the file with a rounded size and the depth limit stops at m04/x
+        self.assertEqual([f'{root}catalog.xml', f'{root}m04/catalog.xml'], session.requests)
+        session.head.assert_called_once_with(rounded_size_file, allow_redirects=True, headers=IDENTITY_ENCODING)
+        self.assertEqual(4, len(self.dg.dbm.list_dict))
+
+    def test_crawl_directory_cache(self):
+        self.dg.granule_id_extraction = 'f16_\\d{8}v7.gz$'
+        self.dg.directory_cache = True
+        self.dg.depth = 1
+        root = self.dg.provider_url
+        tree = {
+            root: [('f16_20210101v7.gz', False), ('m01', True), ('m02', True)],
+            f'{root}m01/': [('f16_20210102v7.gz', False)],
+            f'{root}m02/': [('f16_20210103v7.gz', False)]
+        }
+        self.dg.discover(FakeTreeSession(tree))
+        self.dg.dbm.flush_directory_cache()
+        first_names = sorted(x['name'] for x in self.dg.dbm.list_dict)
+        self.dg.dbm.list_dict.clear()
+
+        tree[f'{root}m02/'].append(('f16_20210104v7.gz', False))
+        session = FakeTreeSession(tree)
+        self.dg.discover(session)
+
+        # Unchanged directories cost one request each and their files are replayed without a HEAD
+        self.assertEqual([root, f'{root}m01/'], sorted(session.not_modified))
+        heads = [url for method, url in session.requests if method == 'HEAD']
+        self.assertEqual([f'{root}m02/f16_20210103v7.gz', f'{root}m02/f16_20210104v7.gz'], sorted(heads))
+        names = sorted(x['name'] for x in self.dg.dbm.list_dict)
+        self.assertEqual(sorted(first_names + [f'{root}m02/f16_20210104v7.gz']), names)
+
+    def test_crawl_error(self):
+        session = MagicMock()
+        session.get.side_effect = ValueError('connection failed')
+        with self.assertRaises(ValueError):
+            self.dg.discover(session)
+
     # TODO: Fix unit tests for directory and file regexes
     # @patch('requests.Session')
     # def test_get_file_link_remss_without_regex(self, mock_session):
@@ -123,6 +123,54 @@ class TestDiscoverGranules(unittest.TestCase):
         discover_count = len(self.dg.dbm.list_dict)
         self.assertEqual(1, discover_count)
 
+    @staticmethod
+    def synthetic_pages(pages, page_size):
+        return [
+            {
+                'Contents': [
+                    {
+                        'Key': f'key/y{x % 3}/f16_{page * page_size + x:08d}v7.{"gz" if x % 4 else "nc"}',
+                        'ETag': f'"etag{x}"',
+                        'LastModified': datetime.datetime(2020, 8, 14, 17, 19, 34, tzinfo=tzutc()),
+                        'Size': x
+                    } for x in range(page_size)
+                ]
+            } for page in range(pages)
+        ]
+
+    def test_discover_granules_s3_match_processes(self):
+        self.dg.granule_id_extraction = '^(f16_\\d{8}v7).gz$'
+        self.dg.dir_reg_ex = 'y[01]'
+        pages = self.synthetic_pages(7, 50)
+        self.assertIsNone(self.dg.discover(pages))
+        expected = list(self.dg.dbm.list_dict)
+        self.dg.dbm.list_dict = []
+
+        self.dg.match_processes = 2
+        self.assertIsNone(self.dg.discover(pages + [{}]))
+        self.assertEqual(expected, self.dg.dbm.list_dict)
+        first = expected[0]
+        self.assertEqual(('f16_00000001v7', 'etag1', 1), (first.get('granule_id'), first.get('etag'), first.get('size')))
+
+    def test_discover_granules_s3_match_processes_early_return(self):
+        self.dg.granule_id_extraction = '^(f16_\\d{8}v7).gz$'
+        self.dg.match_processes = 2
+        self.dg.early_return_threshold = 1000
+        self.dg.lambda_context = MagicMock()
+        # Out of time once the third page is handed to a matching process
+        self.dg.lambda_context.get_remaining_time_in_millis.side_effect = [5000, 5000, 0]
+        pages = self.synthetic_pages(5, 10)
+        self.assertEqual(pages[2].get('Contents')[-1].get('Key'), self.dg.discover(pages))
+        self.assertEqual(3 * 7, len(self.dg.dbm.list_dict))
+
+    @patch('concurrent.futures.ProcessPoolExecutor', side_effect=OSError('Function not implemented'))
+    def test_discover_granules_s3_match_processes_unavailable(self, mock_pool):
+        self.dg.granule_id_extraction = '^(f16_\\d{8}v7).gz$'
+        self.dg.match_processes = 2
+        self.dg.discover(self.synthetic_pages(2, 10))
+        self.assertTrue(mock_pool.called)
+        self.assertEqual(2 * 7, len(self.dg.dbm.list_dict))
+
     @patch('boto3.client')
     def test_move_granule(self, mock_client):
         mock_client = MagicMock()
@@ -1,10 +1,18 @@
 import json
 import os
 import re
+import stat
+import subprocess
+import tempfile
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
+import paramiko
+
 import task.discover_granules_sftp as sftp
+from tests.helpers import configure_event
+from tests.sftp_server import SFTPServer
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -15,6 +23,7 @@ class SFTPTestFile:
         self.file_type = file_type
         self.st_mtime = mod_time
         self.st_size = size
+        self.st_mode = (stat.S_IFDIR | 0o755) if file_type == 'dir' else (stat.S_IFREG | 0o644)
 
     def stat(self):
         return self
@@ -26,6 +35,7 @@ class SFTPTestFile:
 class SFTPTestClient:
     def __init__(self, path, dir_count, file_count):
         self.listdir_resp = self.listdir_setup(path, dir_count, file_count)
+        self.stat_count = 0
 
     def listdir_setup(self, path, dir_count, file_count):
         resp = []
@@ -43,7 +53,18 @@ class SFTPTestClient:
     def listdir(self):
         return self.listdir_resp
 
+    def listdir_attr(self, path='.'):
+        return self.listdir_resp
+
+    def normalize(self, path):
+        return path
+
+    def get_channel(self):
+        # Further sessions are refused, as by a server with MaxSessions 1
+        raise paramiko.ChannelException(1, 'Administratively prohibited')
+
     def stat(self, sftp_test_file):
+        self.stat_count += 1
         return sftp_test_file.stat()
 
 
@@ -92,6 +113,19 @@ class TestDiscoverGranules(unittest.TestCase):
         }
 
         self.assertEqual(3, len(self.dg_sftp.dbm.list_dict))
+        self.assertEqual(0, sftp_test_client.stat_count)
+        self.assertEqual({'file_0', 'file_1', 'file_2'}, {x['granule_id'] for x in self.dg_sftp.dbm.list_dict})
+        self.assertEqual({1}, {x['size'] for x in self.dg_sftp.dbm.list_dict})
+
+    def test_discover_granules_sftp_directory_mode(self):
+        # Directories are told apart by their mode, not the first letter of their name
+        event = self.get_sample_event('sftp')
+        event['config']['collection']['granuleIdExtraction'] = '(.*_\\d)'
+        dg_sftp = sftp.DiscoverGranulesSFTP(event, None)
+        sftp_test_client = SFTPTestClient(event.get('config').get('provider_path'), 2, 2)
+        sftp_test_client.listdir_resp.append(SFTPTestFile('data_9', 'file', 1, 1))
+        dg_sftp.discover(sftp_test_client)
+        self.assertEqual({'file_0', 'file_1', 'data_9'}, {x['granule_id'] for x in dg_sftp.dbm.list_dict})
 
     @patch.object(re, 'search')
     def test_discover_granules_sftp_recursion(self, re_test):
@@ -202,5 +236,272 @@ class TestDiscoverGranules(unittest.TestCase):
         self.assertEqual(mock_kms.call_count, 1)
 
 
+class TestSFTPCrawler(unittest.TestCase):
+    def setUp(self):
+        sftp.CREDENTIAL_CACHE.clear()
+        sftp.SSH_CLIENT_CACHE.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        # Three levels of four directories with two granules and an unrelated file in each
+        for path in [''] + [f'y{x}' for x in range(4)] + [f'y{x}/m{y}' for x in range(4) for y in range(4)]:
+            os.makedirs(os.path.join(self.root, 'data', path), exist_ok=True)
+            for z in range(2):
+                granule = os.path.join(self.root, 'data', path, f'f16_{path.replace("/", "")}{z}v7.gz')
+                with open(granule, 'w', encoding='utf-8') as f:
+                    f.write('x' * z)
+            with open(os.path.join(self.root, 'data', path, 'readme.txt'), 'w', encoding='utf-8') as f:
+                f.write('readme')
+
+    def tearDown(self):
+        for ssh_client in sftp.SSH_CLIENT_CACHE.values():
+            ssh_client.close()
+        sftp.SSH_CLIENT_CACHE.clear()
+        sftp.CREDENTIAL_CACHE.clear()
+        self.tmp_dir.cleanup()
+
+    def discover(self, server, discover_tf):
+        event = configure_event(server.provider(), '^(f16_.*v7)\\.gz$', '/data/', discover_tf)
+        dg_sftp = sftp.DiscoverGranulesSFTP(event, None)
+        dg_sftp.dbm.add_record = MagicMock()
+        sftp_client = sftp.setup_ssh_sftp_client(**sftp.create_ssh_sftp_config(**dg_sftp.provider))
+        try:
+            dg_sftp.discover(sftp_client)
+        finally:
+            sftp_client.close()
+        return dg_sftp, sorted(call.kwargs['name'] for call in dg_sftp.dbm.add_record.call_args_list)
+
+    def test_crawl(self):
+        with SFTPServer(self.root) as server:
+            dg_sftp, names = self.discover(server, {'depth': 2, 'sftp_channels': 4})
+
+        self.assertEqual(42, len(names))
+        self.assertIn('sftp://127.0.0.1/data/f16_0v7.gz', names)
+        self.assertIn('sftp://127.0.0.1/data/y3/m2/f16_y3m21v7.gz', names)
+        record = dg_sftp.dbm.add_record.call_args_list[0].kwargs
+        self.assertEqual('f16_0v7', record['granule_id'])
+        self.assertEqual(0, record['size'])
+        # One connection with several channels listing at once, every path absolute and no stat per file
+        self.assertEqual(1, server.stats['connections'])
+        self.assertLessEqual(server.stats['sessions'], 4)
+        self.assertGreater(server.stats['peak'], 1)
+        self.assertTrue(all(path.startswith('/data') for path in server.stats['listings']))
+        self.assertEqual(0, server.stats['stats'])
+
+    def test_crawl_directory_cache(self):
+        stored = {}
+
+        def discover(server):
+            discover_tf = {'depth': 2, 'directory_cache': True}
+            event = configure_event(server.provider(), '^(f16_.*v7)\\.gz$', '/data/', discover_tf)
+            dg_sftp = sftp.DiscoverGranulesSFTP(event, None)
+            # The listings are kept in stored instead of a database that persists between runs
+            dg_sftp.directory_cache = True
+            dg_sftp.dbm.add_record = MagicMock()
+            dg_sftp.dbm.read_directory_cache = stored.get
+            dg_sftp.dbm.write_directory_cache = lambda url, etag, last_modified, entries: stored.update(
+                {url: {'etag': etag, 'last_modified': last_modified, 'entries': entries}}
+            )
+            sftp_client = sftp.setup_ssh_sftp_client(**sftp.create_ssh_sftp_config(**dg_sftp.provider))
+            try:
+                dg_sftp.discover(sftp_client)
+            finally:
+                sftp_client.close()
+            return sorted(
+                str(dict(call.kwargs, last_modified=str(call.kwargs['last_modified'])))
+                for call in dg_sftp.dbm.add_record.call_args_list
+            )
+
+        with SFTPServer(self.root) as server:
+            first = discover(server)
+            self.assertEqual(21, len(server.stats['listings']))
+            second = discover(server)
+            self.assertEqual(21, len(server.stats['listings']))
+            self.assertEqual(first, second)
+
+            # Only the directory whose modification time changed is listed again
+            changed = os.path.join(self.root, 'data', 'y1', 'm2')
+            with open(os.path.join(changed, 'f16_newv7.gz'), 'w', encoding='utf-8') as f:
+                f.write('new')
+            modified = os.stat(changed).st_mtime + 100
+            os.utime(changed, (modified, modified))
+            third = discover(server)
+            self.assertEqual(22, len(server.stats['listings']))
+            self.assertEqual('/data/y1/m2/', server.stats['listings'][-1])
+            self.assertEqual(43, len(third))
+
+    def test_crawl_depth(self):
+        with SFTPServer(self.root) as server:
+            _, names = self.discover(server, {'depth': 1})
+        self.assertEqual(10, len(names))
+        self.assertEqual(5, len(server.stats['listings']))
+
+    def test_crawl_symlinks(self):
+        other = os.path.join(self.root, 'other')
+        os.makedirs(other)
+        with open(os.path.join(other, 'f16_otherv7.gz'), 'w', encoding='utf-8') as f:
+            f.write('x' * 5)
+        os.symlink(os.path.join(other, 'f16_otherv7.gz'), os.path.join(self.root, 'data', 'f16_linkv7.gz'))
+        os.symlink(other, os.path.join(self.root, 'data', 'ylink'))
+        os.symlink(os.path.join(self.root, 'missing'), os.path.join(self.root, 'data', 'f16_brokenv7.gz'))
+        with SFTPServer(self.root) as server:
+            dg_sftp, names = self.discover(server, {'depth': 2})
+
+        # Links are followed, so a linked file has the size of its target and a linked directory is listed
+        self.assertEqual(44, len(names))
+        self.assertIn('sftp://127.0.0.1/data/ylink/f16_otherv7.gz', names)
+        self.assertIn('/data/ylink/', server.stats['listings'])
+        self.assertEqual(3, server.stats['stats'])
+        sizes = {call.kwargs['name']: call.kwargs['size'] for call in dg_sftp.dbm.add_record.call_args_list}
+        self.assertEqual(5, sizes['sftp://127.0.0.1/data/f16_linkv7.gz'])
+        self.assertEqual(5, sizes['sftp://127.0.0.1/data/ylink/f16_otherv7.gz'])
+
+    def test_crawl_dir_reg_ex(self):
+        with SFTPServer(self.root) as server:
+            _, names = self.discover(server, {'depth': 2, 'dir_reg_ex': '/y1/(m3/)?$'})
+        self.assertEqual([
+            'sftp://127.0.0.1/data/f16_0v7.gz', 'sftp://127.0.0.1/data/f16_1v7.gz',
+            'sftp://127.0.0.1/data/y1/f16_y10v7.gz', 'sftp://127.0.0.1/data/y1/f16_y11v7.gz',
+            'sftp://127.0.0.1/data/y1/m3/f16_y1m30v7.gz', 'sftp://127.0.0.1/data/y1/m3/f16_y1m31v7.gz'
+        ], names)
+        # Pruned directories are never listed
+        self.assertEqual(3, len(server.stats['listings']))
+
+    def test_crawl_sessions_refused(self):
+        # The server allows two sessions, the first channel and one more
+        with SFTPServer(self.root, max_sessions=2) as server:
+            _, names = self.discover(server, {'depth': 2, 'sftp_channels': 4})
+        self.assertEqual(42, len(names))
+        self.assertEqual(2, server.stats['sessions'])
+
+    def test_find_listing(self):
+        discover_tf = {'depth': 2, 'dir_reg_ex': '/y[12]/(m[03]/)?$'}
+        with SFTPServer(self.root) as server:
+            walked, _ = self.discover(server, discover_tf)
+        with SFTPServer(self.root, exec_enabled=True) as server:
+            dg_sftp, names = self.discover(server, dict(discover_tf, sftp_find_listing=True))
+
+        self.assertEqual(14, len(names))
+        self.assertEqual(
+            sorted(str(call) for call in walked.dbm.add_record.call_args_list),
+            sorted(str(call) for call in dg_sftp.dbm.add_record.call_args_list)
+        )
+        self.assertEqual(
+            ["find -L /data -mindepth 1 -maxdepth 3 -printf '%p\\t%s\\t%T@\\t%y\\n'"], server.stats['commands']
+        )
+        self.assertEqual([], server.stats['listings'])
+
+    def test_find_listing_symlinks(self):
+        other = os.path.join(self.root, 'other')
+        os.makedirs(other)
+        with open(os.path.join(other, 'f16_otherv7.gz'), 'w', encoding='utf-8') as f:
+            f.write('x' * 5)
+        os.symlink(os.path.join(other, 'f16_otherv7.gz'), os.path.join(self.root, 'data', 'f16_linkv7.gz'))
+        os.symlink(other, os.path.join(self.root, 'data', 'ylink'))
+        os.symlink(os.path.join(self.root, 'missing'), os.path.join(self.root, 'data', 'f16_brokenv7.gz'))
+        with SFTPServer(self.root) as server:
+            walked, _ = self.discover(server, {'depth': 2})
+        with SFTPServer(self.root, exec_enabled=True) as server:
+            dg_sftp, names = self.discover(server, {'depth': 2, 'sftp_find_listing': True})
+
+        # Links are followed as in the walk and the broken link is skipped
+        self.assertEqual(44, len(names))
+        self.assertEqual(
+            sorted(str(call) for call in walked.dbm.add_record.call_args_list),
+            sorted(str(call) for call in dg_sftp.dbm.add_record.call_args_list)
+        )
+
+    def test_find_output_parser_types(self):
+        event = configure_event({'protocol': 'sftp', 'host': 'host'}, '^(f16_.*v7)\\.gz$', '/data/', {})
+        dg_sftp = sftp.DiscoverGranulesSFTP(event, None)
+        dg_sftp.dbm.add_record = MagicMock()
+        parser = sftp.FindOutputParser(dg_sftp, '/data')
+        for file_type in ('d', 'l', 'p', 's', 'f'):
+            parser.feed(f'/data/f16_{file_type}v7.gz\t10\t1620379680.5\t{file_type}\n')
+        self.assertEqual(5, parser.lines)
+        self.assertEqual(
+            ['sftp://host/data/f16_fv7.gz'], [call.kwargs['name'] for call in dg_sftp.dbm.add_record.call_args_list]
+        )
+
+    def test_find_listing_depth(self):
+        with SFTPServer(self.root, exec_enabled=True) as server:
+            _, names = self.discover(server, {'depth': 0, 'sftp_find_listing': True})
+        self.assertEqual(['sftp://127.0.0.1/data/f16_0v7.gz', 'sftp://127.0.0.1/data/f16_1v7.gz'], names)
+
+    def test_find_listing_exec_refused(self):
+        with SFTPServer(self.root) as server:
+            _, names = self.discover(server, {'depth': 2, 'sftp_find_listing': True})
+        self.assertEqual(42, len(names))
+        self.assertEqual(21, len(server.stats['listings']))
+
+    def test_find_listing_find_failed(self):
+        with SFTPServer(self.root, exec_enabled=True) as server:
+            with patch.object(sftp, 'FIND_FORMAT', '%Z'):
+                _, names = self.discover(server, {'depth': 2, 'sftp_find_listing': True})
+        self.assertEqual(42, len(names))
+        self.assertEqual(1, len(server.stats['commands']))
+        self.assertEqual(21, len(server.stats['listings']))
+
+    def test_find_listing_large_stderr(self):
+        run = subprocess.run
+
+        def run_with_errors(*args, **kwargs):
+            # More errors than the channel window holds, which find would block on if stderr were not drained
+            result = run(*args, **kwargs)
+            return subprocess.CompletedProcess(result.args, 1, result.stdout, b'find: Permission denied\n' * 200000)
+
+        with SFTPServer(self.root, exec_enabled=True) as server:
+            with patch('tests.sftp_server.subprocess.run', side_effect=run_with_errors):
+                _, names = self.discover(server, {'depth': 2, 'sftp_find_listing': True})
+        self.assertEqual(42, len(names))
+        self.assertEqual([], server.stats['listings'])
+
+    def discover_granules(self, server, discover_tf):
+        event = configure_event(server.provider(), '^(f16_.*v7)\\.gz$', '/data/', discover_tf)
+        return sftp.DiscoverGranulesSFTP(event, None).discover_granules()
+
+    @patch('task.discover_granules_sftp.kms_decrypt_ciphertext', side_effect=lambda x: x)
+    def test_credential_cache(self, mock_decrypt):
+        with SFTPServer(self.root) as server:
+            provider = dict(server.provider(), encrypted=True)
+            self.assertEqual(sftp.get_ssh_sftp_config(60, **provider), sftp.get_ssh_sftp_config(60, **provider))
+            self.assertEqual(2, mock_decrypt.call_count)
+            # Another provider or an expired entry is decrypted again
+            sftp.get_ssh_sftp_config(60, **dict(provider, username='other'))
+            self.assertEqual(4, mock_decrypt.call_count)
+            with patch('time.monotonic', return_value=time.monotonic() + 61):
+                sftp.get_ssh_sftp_config(60, **provider)
+            self.assertEqual(6, mock_decrypt.call_count)
+            sftp.get_ssh_sftp_config(0, **provider)
+            sftp.get_ssh_sftp_config(0, **provider)
+            self.assertEqual(10, mock_decrypt.call_count)
+
+    def test_reuse_connection(self):
+        with SFTPServer(self.root) as server:
+            first = self.discover_granules(server, {'depth': 1, 'sftp_reuse_connection': True})
+            second = self.discover_granules(server, {'depth': 1, 'sftp_reuse_connection': True})
+            self.assertEqual(1, server.stats['connections'])
+            self.assertEqual(1, len(sftp.SSH_CLIENT_CACHE))
+
+            # A connection the server has closed is replaced
+            for transport in server.transports:
+                transport.close()
+            time.sleep(0.1)
+            third = self.discover_granules(server, {'depth': 1, 'sftp_reuse_connection': True})
+            self.assertEqual(2, server.stats['connections'])
+
+        for ret in (first, second, third):
+            self.assertEqual(10, ret['discovered_files_count'])
+        self.assertEqual(sorted(x['name'] for x in first['batch']), sorted(x['name'] for x in third['batch']))
+
+    def test_no_reuse_connection(self):
+        with SFTPServer(self.root) as server:
+            self.discover_granules(server, {'depth': 0})
+            self.discover_granules(server, {'depth': 0})
+            self.assertEqual(2, server.stats['connections'])
+            self.assertEqual({}, sftp.SSH_CLIENT_CACHE)
+            time.sleep(0.1)
+            self.assertFalse(any(transport.is_active() for transport in server.transports))
+
+
 if __name__ == "__main__":
     unittest.main()
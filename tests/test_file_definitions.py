@@ -0,0 +1,116 @@
+import random
+import re
+import unittest
+from unittest import mock
+from unittest.mock import patch, MagicMock
+
+from task.discover_granules_base import DiscoverGranulesBase
+from task.file_definitions import FileDefinitions
+from .helpers import get_event
+
+BUCKETS = {
+    'private': {'name': 'sharedsbx-private', 'type': 'private'},
+    'protected': {'name': 'sharedsbx-protected', 'type': 'protected'},
+    'public': {'name': 'sharedsbx-public', 'type': 'public'},
+    'dashboard': {'name': 'sharedsbx-dashboard', 'type': 'public'},
+    'untyped': {'name': 'sharedsbx-untyped'},
+    'blank': {'name': 'sharedsbx-blank', 'type': ''}
+}
+FILES = [
+    {'bucket': 'protected', 'regex': '^f16_\\d{8}v7\\.gz$', 'type': 'data'},
+    {'bucket': 'public', 'regex': '\\.cmr\\.xml$', 'type': 'metadata'},
+    {'bucket': 'private', 'regex': '^.*_NALMA_.*(\\.dat)$'},
+    {'bucket': 'public', 'regex': 'v7\\.gz\\Z', 'type': 'browse'},
+    {'regex': '(?i)\\.MD5$', 'type': 'checksum'},
+    {'bucket': None, 'regex': 'readme', 'type': 'doc'},
+    {'bucket': 'missing', 'regex': '\\.png$'}
+]
+
+
+def file_description(files, buckets, filename):
+    """
+    The type and bucket generate_cumulus_output gave a file by matching every definition and scanning the buckets
+    """
+    file_desc = {}
+    for file_def in files:
+        if re.search(file_def.get('regex'), filename):
+            file_desc = file_def
+
+    bucket_name = ''
+    for bucket in buckets.values():
+        if bucket.get('type') == file_desc.get('bucket', ''):
+            bucket_name = bucket.get('name')
+
+    return file_desc.get('type', ''), bucket_name
+
+
+def random_names(count):
+    rng = random.Random(0)
+    parts = ['f16_', '2021', '0101', 'v7', '.gz', '.nc', '.md5', '.MD5', '.cmr', '.xml', 'LK_NALMA_', '.dat',
+             'readme', '.png', '\n', '_', 'x']
+    return [''.join(rng.choice(parts) for _ in range(rng.randint(0, 6))) for _ in range(count)] + [
+        'f16_20210101v7.gz', 'f16_20210101v7.gz.cmr.xml', 'f16_20210101v7.gz\n', 'LK_NALMA_courtland_201015.dat'
+    ]
+
+
+class TestFileDefinitions(unittest.TestCase):
+    @patch.multiple(DiscoverGranulesBase, __abstractmethods__=set())
+    def setUp(self) -> None:
+        event = get_event('s3')
+        event['config']['buckets'] = BUCKETS
+        event['config']['collection']['files'] = FILES
+        self.dg = DiscoverGranulesBase(event)  # pylint: disable=abstract-class-instantiated
+
+    def test_same_as_file_description(self):
+        file_definitions = FileDefinitions(FILES, BUCKETS)
+        for name in random_names(5000):
+            self.assertEqual(file_description(FILES, BUCKETS, name), file_definitions.describe(name), name)
+
+    def test_describe(self):
+        file_definitions = FileDefinitions(FILES, BUCKETS)
+        self.assertEqual(('browse', 'sharedsbx-dashboard'), file_definitions.describe('f16_20210101v7.gz'))
+        self.assertEqual(('metadata', 'sharedsbx-dashboard'), file_definitions.describe('f16_20210101v7.cmr.xml'))
+        self.assertEqual(('', 'sharedsbx-private'), file_definitions.describe('LK_NALMA_courtland_201015.dat'))
+        self.assertEqual(('doc', 'sharedsbx-untyped'), file_definitions.describe('readme.txt'))
+        self.assertEqual(('', ''), file_definitions.describe('f16_20210101v7.png'))
+        self.assertEqual(('', 'sharedsbx-blank'), file_definitions.describe('f16_20210101v7.nc'))
+        self.assertEqual(('', ''), FileDefinitions(None, {}).describe('f16_20210101v7.nc'))
+
+    def test_extension_candidates(self):
+        files = FILES + [
+            {'bucket': 'private', 'regex': 'gz$', 'type': 'any_gz'},
+            {'bucket': 'private', 'regex': '\\.txt\n$', 'type': 'newline'},
+            {'bucket': 'private', 'regex': '\\.$', 'type': 'dot'}
+        ]
+        file_definitions = FileDefinitions(files, BUCKETS)
+        names = random_names(2000) + ['a.txt\n', 'a.txt\n\n', 'a.', 'a..', 'agz', 'a.tar.gz', '.gz', 'gz']
+        for name in names:
+            self.assertEqual(file_description(files, BUCKETS, name), file_definitions.describe(name), name)
+        # Suffixes of other extensions are not tried
+        types = [description[0] for _, description in file_definitions.candidates('xml')]
+        self.assertEqual(['newline', 'any_gz', 'doc', 'checksum', '', 'metadata', 'data'], types)
+        types = [description[0] for _, description in file_definitions.candidates('png')]
+        self.assertNotIn('metadata', types)
+        self.assertIn('', types)
+
+    @mock.patch('time.time', mock.MagicMock(return_value=0))
+    def test_generate_cumulus_output(self):
+        names = [name for name in random_names(2000) if name.startswith('f16_2021')]
+        granules = [
+            {'name': f's3://sharedsbx-private/lma/nalma/raw/short_test/{name}', 'size': size}
+            for size, name in enumerate(names)
+        ]
+        self.dg.matcher.cumulus_granule_id = MagicMock(side_effect=lambda filename: filename[:12])
+
+        expected = {}
+        for granule in granules:
+            path, filename = granule['name'][len('s3://sharedsbx-private/'):].rsplit('/', maxsplit=1)
+            file_type, bucket_name = file_description(FILES, BUCKETS, filename)
+            expected.setdefault(filename[:12], self.dg.generate_cumulus_granule(filename[:12]))['files'].append(
+                self.dg.generate_cumulus_file(filename, path, granule['size'], bucket_name, file_type)
+            )
+        self.assertEqual(list(expected.values()), self.dg.generate_cumulus_output(granules))
+
+
+if __name__ == "__main__":
+    unittest.main()
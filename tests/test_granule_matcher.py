@@ -0,0 +1,81 @@
+import random
+import re
+import unittest
+
+from task.granule_matcher import GranuleMatcher, literal_affixes, literal_suffix_pattern
+
+PATTERNS = [
+    '^(f16_\\d{8}v7.gz)$', 'f16_\\d{8}v7.gz$', '^(f16_\\d{8}v7).*\\.nc$', '^(LK_NALMA_.*_\\d{6}).dat.gz$',
+    '(msut_\\d{4})_v6\\.0\\.txt', '^(?:abc|abd)_(\\d+)$', '(?i)^F16_(\\d{8})', '^(a\\.b)\\Z', '.*', '',
+    '^(f16_(?i:v)\\d)$', 'x\\b', '^(?P<id>f16_\\d{8})v7\\.gz$'
+]
+
+
+def random_names(count):
+    rng = random.Random(0)
+    parts = ['f16_', 'F16_', '2021', '0101', 'v7', '.gz', '.nc', '.txt', 'abc_', 'abd_', '12', 'a.b', 'LK_NALMA_',
+             'msut_', '_v6.0', '.dat', '\n', 'x', ' ', '_']
+    return [''.join(rng.choice(parts) for _ in range(rng.randint(0, 6))) for _ in range(count)] + [
+        'f16_20210101v7.gz', 'f16_20210101v7.gz\n', 'https://host/y2021/f16_20210101v7.gz', 'f16_20210101v7_d3d.nc',
+        'LK_NALMA_courtland_201015_035000.dat.gz', 'msut_2021_v6.0.txt', 'abd_12', 'a.b', 'a.b\n', 'F16_20210101'
+    ]
+
+
+class TestGranuleMatcher(unittest.TestCase):
+    def test_literal_affixes(self):
+        self.assertEqual(('f16_', 'gz', True, 'f16_'), literal_affixes('^(f16_\\d{8}v7.gz)$'))
+        self.assertEqual(('', 'v7.gz', True, 'v7.gz'), literal_affixes('f16_\\d{8}v7\\.gz$'))
+        self.assertEqual(('a.b', 'a.b', False, 'a.b'), literal_affixes('^(a\\.b)\\Z'))
+        self.assertEqual(('', '', False, ''), literal_affixes('(?i)^F16_(\\d{8})'))
+        # The alternation is parsed as ab followed by [cd]
+        self.assertEqual(('ab', '', False, 'ab'), literal_affixes('^(?:abc|abd)_(\\d+)$'))
+        self.assertEqual(('', '', False, '_v6.0.txt'), literal_affixes('(msut_\\d{4})_v6\\.0\\.txt'))
+
+    def test_literal_suffix_pattern(self):
+        self.assertEqual(('.nc', True), literal_suffix_pattern('\\.nc$'))
+        self.assertEqual(('v7.gz', False), literal_suffix_pattern('(v7\\.gz)\\Z'))
+        self.assertEqual(('', True), literal_suffix_pattern('$'))
+        self.assertIsNone(literal_suffix_pattern('^f16\\.nc$'))
+        self.assertIsNone(literal_suffix_pattern('.\\.nc$'))
+        self.assertIsNone(literal_suffix_pattern('(?i)\\.nc$'))
+        self.assertIsNone(literal_suffix_pattern('\\.nc'))
+        for pattern in ('\\.nc$', '(v7\\.gz)\\Z', '$'):
+            suffix, newline = literal_suffix_pattern(pattern)
+            for name in random_names(2000):
+                expected = re.search(pattern, name) is not None
+                self.assertEqual(expected, name.endswith(suffix) or newline and name.endswith(f'{suffix}\n'), name)
+
+    def test_same_as_re(self):
+        names = random_names(5000)
+        for pattern in PATTERNS:
+            matcher = GranuleMatcher(pattern)
+            for name in names:
+                expected = re.search(pattern, name)
+                actual = matcher.search(name)
+                self.assertEqual(expected and expected.span(), actual and actual.span(), (pattern, name))
+                expected = re.match(pattern, name)
+                actual = matcher.match(name)
+                self.assertEqual(expected and expected.span(), actual and actual.span(), (pattern, name))
+
+    def test_match_granule(self):
+        matcher = GranuleMatcher('^(f16_\\d{8}v7).*\\.gz$')
+        path = 's3://bucket/ssmi/f16_20210101v7_d3d.gz'
+        self.assertEqual((path, 'f16_20210101v7'), matcher.match_granule(path, 'f16_20210101v7_d3d.gz'))
+        self.assertEqual((path, 'f16_20210101v7_d3d.gz'), matcher.match_granule(path, 'f16_20210101v7_d3d.gz', 0))
+        self.assertIsNone(matcher.match_granule(path))
+        self.assertIsNone(matcher.match_granule(path, 'f16_20210101v7_d3d.nc'))
+
+    def test_cumulus_granule_id(self):
+        matcher = GranuleMatcher('^(f16_\\d{8}v7).*\\.gz$', '^f16_\\d{8}')
+        self.assertEqual('f16_20210101v7', matcher.cumulus_granule_id('f16_20210101v7_d3d.gz'))
+        self.assertEqual('f16_20210101', matcher.cumulus_granule_id('f16_20210101v7.nc'))
+
+    def test_match_directory(self):
+        self.assertTrue(GranuleMatcher('', dir_reg_ex=None).match_directory('any/dir'))
+        self.assertTrue(GranuleMatcher('', dir_reg_ex='').match_directory('any/dir'))
+        self.assertTrue(GranuleMatcher('', dir_reg_ex='y20\\d{2}').match_directory('ssmi/y2021'))
+        self.assertFalse(GranuleMatcher('', dir_reg_ex='y20\\d{2}').match_directory('ssmi/m01'))
+
+
+if __name__ == "__main__":
+    unittest.main()
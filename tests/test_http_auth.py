@@ -0,0 +1,148 @@
+import base64
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, quote, urlsplit
+
+from task.discover_granules_http import DiscoverGranulesHTTP
+from task.http_auth import RedirectCache
+from .helpers import configure_event
+
+FILE_NAMES = [f'f16_202101{x:02d}v7.gz' for x in range(1, 21)]
+CREDENTIALS = ('user', 'secret')
+
+
+class FakeLoginHandler(BaseHTTPRequestHandler):
+    """
+    OAuth login server that checks the basic auth credentials and redirects back to the provider's login callback.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        expected = base64.b64encode(':'.join(CREDENTIALS).encode()).decode()
+        if self.headers.get('Authorization') != f'Basic {expected}':
+            self.send_response(401)
+        else:
+            self.send_response(302)
+            self.send_header('Location', parse_qs(urlsplit(self.path).query).get('redirect_uri')[0])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """
+    Provider with a public directory listing under /data/ whose files redirect to the login server until the login
+    cookie is set, then to where the file is stored under /store/.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        path = urlsplit(self.path).path
+        body = b''
+        if path == '/data/':
+            self.send_response(200)
+            body = ''.join(f'<a href="{x}">{x}</a>\n' for x in FILE_NAMES).encode()
+        elif path == '/login':
+            self.send_response(302)
+            self.send_header('Set-Cookie', 'session=ok; Path=/')
+            self.send_header('Location', parse_qs(urlsplit(self.path).query).get('next')[0])
+        elif path.startswith('/data/'):
+            self.send_response(302)
+            if 'session=ok' in self.headers.get('Cookie', ''):
+                self.send_header('Location', path.replace('/data/', '/store/'))
+            else:
+                callback = quote(f'http://{self.headers.get("Host")}/login?next={quote(path)}')
+                self.send_header('Location', f'http://{self.server.login_host}/authorize?redirect_uri={callback}')
+        elif path.startswith('/store/'):
+            self.send_response(200)
+            self.send_header('ETag', '"etag"')
+            self.send_header('Last-Modified', 'Thu, 02 Apr 2020 15:06:03 GMT')
+            self.send_header('Content-Length', '10')
+            self.end_headers()
+            return
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPAuth(unittest.TestCase):
+    def setUp(self) -> None:
+        self.servers = []
+        self.login = self.start_server(FakeLoginHandler)
+        self.provider = self.start_server(FakeProviderHandler)
+        self.provider.login_host = self.host(self.login)
+
+    def tearDown(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start_server(self, handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return server
+
+    @staticmethod
+    def host(server):
+        return f'127.0.0.1:{server.server_address[1]}'
+
+    def discover(self, auth_redirects):
+        provider = {'host': self.host(self.provider), 'protocol': 'http', 'username': CREDENTIALS[0],
+                    'password': CREDENTIALS[1]}
+        discover_tf = {'depth': 0, 'http_auth_redirects': auth_redirects, 'http_auth_host': self.host(self.login)}
+        event = configure_event(provider, 'f16_\\d{8}v7.gz$', '/data/', discover_tf)
+        dg = DiscoverGranulesHTTP(event, None)
+        dg.dbm.flush_dict = lambda: None
+        dg.dbm.read_batch = lambda: []
+        dg.dbm.close_db = lambda: None
+        dg.discover_granules()
+        return sorted(x.get('name') for x in dg.dbm.list_dict)
+
+    def test_login_once(self):
+        names = self.discover(True)
+        self.assertEqual([f'http://{self.host(self.provider)}/store/{x}' for x in FILE_NAMES], names)
+        # One login, then every other file is a single request straight to where it is stored
+        self.assertEqual(1, len(self.login.requests))
+        file_requests = [x for x in self.provider.requests if x.startswith(('/data/f16', '/store/'))]
+        self.assertEqual(3 + len(FILE_NAMES) - 1, len(file_requests))
+
+    def test_without_auth_redirects(self):
+        # The credentials are not sent to the login server so every file stops at the login
+        names = self.discover(False)
+        self.assertEqual(len(FILE_NAMES), len(self.login.requests))
+        self.assertFalse([x for x in names if '/store/' in x])
+
+    def test_redirect_cache(self):
+        cache = RedirectCache()
+        cache.learn('https://host/data/a.gz', SimpleNamespace(url='https://cdn/store/a.gz'))
+        cache.learn('https://host/other/b.gz', SimpleNamespace(url='https://cdn/store/b.gz?signature=1'))
+        cache.learn('https://host/link/c.gz', SimpleNamespace(url='https://host/data/d.gz'))
+        self.assertEqual('https://cdn/store/e.gz', cache.resolve('https://host/data/e.gz'))
+        self.assertEqual('https://host/other/e.gz', cache.resolve('https://host/other/e.gz'))
+        self.assertEqual('https://host/link/e.gz', cache.resolve('https://host/link/e.gz'))
+        cache.forget('https://host/data/e.gz')
+        self.assertEqual('https://host/data/e.gz', cache.resolve('https://host/data/e.gz'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import datetime
+import json
+import unittest
+from urllib.parse import urlencode
+
+from task.http_catalog import get_catalog_reader, JSONListingReader, JSONStream, S3ListingReader, ThreddsCatalogReader
+from task.http_listing import ListingEntry
+
+THREDDS_CATALOG = b'''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+         xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.1">
+  <service name="all" serviceType="Compound" base="">
+    <service name="odap" serviceType="OpenDAP" base="/thredds/dodsC/"/>
+    <service name="http" serviceType="HTTPServer" base="/thredds/fileServer/"/>
+  </service>
+  <dataset name="y2020" ID="ssmi/y2020">
+    <metadata inherited="true"><serviceName>all</serviceName></metadata>
+    <dataset name="f16_20200401v7.gz" ID="ssmi/y2020/f16_20200401v7.gz" urlPath="ssmi/y2020/f16_20200401v7.gz">
+      <dataSize units="bytes">1882122</dataSize>
+      <date type="modified">2020-04-02T15:06:03Z</date>
+    </dataset>
+    <dataset name="f16_20200402v7.gz" ID="ssmi/y2020/f16_20200402v7.gz" urlPath="ssmi/y2020/f16_20200402v7.gz">
+      <dataSize units="Mbytes">1.804</dataSize>
+      <date type="modified">2020-04-03T13:51:00Z</date>
+    </dataset>
+    <catalogRef xlink:href="m04/catalog.xml" xlink:title="m04" name=""/>
+  </dataset>
+</catalog>
+'''
+
+S3_PAGE_1 = b'''<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+  <Name>bucket</Name><Prefix>ssmi/</Prefix><KeyCount>2</KeyCount><MaxKeys>1000</MaxKeys><Delimiter>/</Delimiter>
+  <IsTruncated>true</IsTruncated><NextContinuationToken>token-1</NextContinuationToken>
+  <Contents>
+    <Key>ssmi/</Key><LastModified>2020-04-02T15:06:03.000Z</LastModified><ETag>"d41d8cd9"</ETag><Size>0</Size>
+  </Contents>
+  <Contents>
+    <Key>ssmi/f16_20200401v7.gz</Key><LastModified>2020-04-02T15:06:03.000Z</LastModified>
+    <ETag>"ec5273963f74811028e38a367beaf7a5"</ETag><Size>1882122</Size><StorageClass>STANDARD</StorageClass>
+  </Contents>
+</ListBucketResult>
+'''
+
+S3_PAGE_2 = b'''<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+  <Name>bucket</Name><Prefix>ssmi/</Prefix><KeyCount>1</KeyCount><MaxKeys>1000</MaxKeys><Delimiter>/</Delimiter>
+  <IsTruncated>false</IsTruncated>
+  <CommonPrefixes><Prefix>ssmi/y 2021/</Prefix></CommonPrefixes>
+</ListBucketResult>
+'''
+
+
+class FakeCatalogResponse:
+    def __init__(self, content):
+        self.content = content
+        self.encoding = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        # Small chunks so elements are split across feeds
+        for index in range(0, len(self.content), 16):
+            yield self.content[index:index + 16]
+
+
+class FakeCatalogSession:
+    """
+    Serves catalog pages from a dictionary keyed by URL, with the query string appended when there are parameters.
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, params=None, **kwargs):
+        key = f'{url}?{urlencode(params)}' if params else url
+        self.requests.append(key)
+        return FakeCatalogResponse(self.pages[key])
+
+
+class TestHTTPCatalog(unittest.TestCase):
+    def test_thredds(self):
+        url = 'https://host/thredds/catalog/ssmi/y2020/catalog.xml'
+        session = FakeCatalogSession({url: THREDDS_CATALOG})
+        entries = ThreddsCatalogReader({}).read(session, url)
+        self.assertEqual(
+            [
+                ListingEntry(
+                    'https://host/thredds/fileServer/ssmi/y2020/f16_20200401v7.gz', False, 1882122,
+                    datetime.datetime(2020, 4, 2, 15, 6, 3, tzinfo=datetime.timezone.utc)
+                ),
+                # Rounded sizes are left to a HEAD request
+                ListingEntry(
+                    'https://host/thredds/fileServer/ssmi/y2020/f16_20200402v7.gz', False, None,
+                    datetime.datetime(2020, 4, 3, 13, 51, tzinfo=datetime.timezone.utc)
+                ),
+                ListingEntry('https://host/thredds/catalog/ssmi/y2020/m04/catalog.xml', True, None, None)
+            ],
+            entries
+        )
+
+    def test_thredds_root_url(self):
+        reader = ThreddsCatalogReader({})
+        self.assertEqual('https://host/thredds/catalog.xml', reader.root_url('https://host/thredds/'))
+        reader = ThreddsCatalogReader({'catalog_url': 'https://host/thredds/catalog/ssmi/catalog.xml'})
+        self.assertEqual('https://host/thredds/catalog/ssmi/catalog.xml', reader.root_url('https://host/thredds/'))
+
+    def test_s3_pagination(self):
+        list_params = {'list-type': 2, 'delimiter': '/', 'prefix': 'ssmi/', 'max-keys': 1000}
+        session = FakeCatalogSession({
+            f'https://bucket.host/?{urlencode(list_params)}': S3_PAGE_1,
+            f'https://bucket.host/?{urlencode({**list_params, "continuation-token": "token-1"})}': S3_PAGE_2
+        })
+        entries = S3ListingReader({}).read(session, 'https://bucket.host/ssmi/')
+        self.assertEqual(2, len(session.requests))
+        self.assertEqual(
+            [
+                ListingEntry(
+                    'https://bucket.host/ssmi/f16_20200401v7.gz', False, 1882122,
+                    datetime.datetime(2020, 4, 2, 15, 6, 3, tzinfo=datetime.timezone.utc),
+                    'ec5273963f74811028e38a367beaf7a5'
+                ),
+                ListingEntry('https://bucket.host/ssmi/y%202021/', True, None, None)
+            ],
+            entries
+        )
+
+    def test_s3_sub_prefix_and_endpoint(self):
+        list_params = {'list-type': 2, 'delimiter': '/', 'prefix': 'ssmi/y 2021/', 'max-keys': 1000}
+        session = FakeCatalogSession({f'https://host/bucket/?{urlencode(list_params)}': S3_PAGE_2})
+        reader = S3ListingReader({'catalog_endpoint': 'https://host/bucket'})
+        entries = reader.read(session, 'https://host/bucket/ssmi/y%202021/')
+        self.assertEqual([ListingEntry('https://host/bucket/ssmi/y%202021/', True, None, None)], entries)
+
+    def test_json(self):
+        url = 'https://host/data/'
+        listing = [
+            {'name': '2021', 'type': 'directory', 'mtime': 'Fri, 07 May 2021 09:27:00 GMT'},
+            {'name': 'f16_20210101v7.gz', 'type': 'file', 'mtime': 'Fri, 07 May 2021 09:28:00 GMT', 'size': 1882122},
+            {'name': '../', 'is_dir': True}
+        ]
+        session = FakeCatalogSession({url: json.dumps(listing).encode()})
+        entries = JSONListingReader({}).read(session, url)
+        self.assertEqual(
+            [
+                ListingEntry(f'{url}2021/', True, None, None),
+                ListingEntry(
+                    f'{url}f16_20210101v7.gz', False, 1882122,
+                    datetime.datetime(2021, 5, 7, 9, 28, tzinfo=datetime.timezone.utc)
+                )
+            ],
+            entries
+        )
+
+    def test_json_items(self):
+        url = 'https://host/data/'
+        listing = {'items': [{'url': './f16.gz', 'is_dir': False, 'size': 10, 'mod_time': 1620379680, 'etag': 'e'}]}
+        session = FakeCatalogSession({url: json.dumps(listing).encode()})
+        entry = JSONListingReader({}).read(session, url)[0]
+        self.assertEqual((f'{url}f16.gz', False, 10, 'e'), (entry.url, entry.is_dir, entry.size, entry.etag))
+        self.assertIsNotNone(entry.last_modified)
+
+    def test_json_stream(self):
+        text = json.dumps({
+            'path': '/data/', 'meta': {'items': [1, 2], 'count': 12345}, 'total': 1234567,
+            'entries': [{'name': 'a é', 'size': 1234567890}, {'name': 'b', 'nested': {'x': [1, {'y': 'z'}]}}, 7],
+            'items': [{'name': 'ignored'}]
+        }, indent=1)
+        for chunk_size in (1, 5, 1000):
+            chunks = [text[index:index + chunk_size] for index in range(0, len(text), chunk_size)]
+            self.assertEqual(
+                [{'name': 'a é', 'size': 1234567890}, {'name': 'b', 'nested': {'x': [1, {'y': 'z'}]}}, 7],
+                list(JSONStream(chunks).items(('items', 'entries'))), chunk_size
+            )
+        self.assertEqual([], list(JSONStream(['{"other": [1]}']).items(('items',))))
+        self.assertEqual([1, 2], list(JSONStream([' [1', ',', ' 2] ']).items(('items',))))
+        with self.assertRaises(ValueError):
+            list(JSONStream(['[{"name": ']).items(('items',)))
+
+    def test_s3_contents_without_key(self):
+        page = S3_PAGE_2.replace(b'<CommonPrefixes>', b'<Contents><Key></Key><Size>0</Size></Contents><CommonPrefixes>')
+        list_params = {'list-type': 2, 'delimiter': '/', 'prefix': 'ssmi/', 'max-keys': 1000}
+        session = FakeCatalogSession({f'https://bucket.host/?{urlencode(list_params)}': page})
+        entries = S3ListingReader({}).read(session, 'https://bucket.host/ssmi/')
+        self.assertEqual([ListingEntry('https://bucket.host/ssmi/y%202021/', True, None, None)], entries)
+
+    def test_get_catalog_reader(self):
+        self.assertIsNone(get_catalog_reader(None, {}))
+        self.assertIsInstance(get_catalog_reader('THREDDS', {}), ThreddsCatalogReader)
+        with self.assertRaises(ValueError):
+            get_catalog_reader('opendap', {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from task.http_limiter import AdaptiveLimiter, ThrottledError, parse_retry_after
+
+
+class FakeStatusResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers if headers else {}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeCapacityHost:
+    """
+    Answers 429 with "Retry-After: 0" to the requests beyond capacity in one round trip. Each request takes delay
+    seconds on the fake clock.
+    """
+    def __init__(self, capacity, clock, delay=0.005):
+        self.capacity = capacity
+        self.clock = clock
+        self.delay = delay
+        self.in_flight = 0
+
+    def request(self):
+        self.in_flight += 1
+        self.clock.now += self.delay
+        if self.in_flight > self.capacity:
+            return FakeStatusResponse(429, {'Retry-After': '0'})
+        return FakeStatusResponse(200)
+
+
+class RoundTripExecutor:
+    """
+    Runs the requests submitted during one pass of the event loop together as one round trip to the host, so the
+    requests in flight and their latencies only depend on the fake clock and not on thread scheduling.
+    """
+    def __init__(self, loop, host):
+        self.loop = loop
+        self.host = host
+        self.pending = []
+
+    def submit(self, func, *args):
+        future = concurrent.futures.Future()
+        if not self.pending:
+            self.loop.call_soon(self.round_trip)
+        self.pending.append((future, func, args))
+        return future
+
+    def round_trip(self):
+        pending, self.pending = self.pending, []
+        start = self.host.clock.now
+        for future, func, args in pending:
+            self.host.clock.now = start
+            future.set_result(func(*args))
+        self.host.in_flight = 0
+        self.host.clock.now = start + self.host.delay
+
+
+class TestHTTPLimiter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=32)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown()
+
+    def test_parse_retry_after(self):
+        self.assertEqual(5, parse_retry_after('5'))
+        self.assertEqual(0, parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'))
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_aimd(self):
+        loop = MagicMock()
+        loop.time.return_value = 100
+        limiter = AdaptiveLimiter('host', 16)
+        for _ in range(7):
+            limiter.on_success(loop, None)
+        # Slow start adds one per success
+        self.assertEqual(8, limiter.limit)
+
+        limiter.on_congestion(loop, 0, 0)
+        self.assertEqual(4, limiter.limit)
+        # A second failure from the same round does not cut the limit again
+        limiter.on_congestion(loop, 0, 0)
+        self.assertEqual(4, limiter.limit)
+
+        # Then about one per round of successes
+        for _ in range(5):
+            limiter.on_success(loop, None)
+        self.assertEqual(5, int(limiter.limit))
+        self.assertEqual({'concurrency': 5, 'peak_concurrency': 8, 'requests': 14, 'throttled': 2}, limiter.metrics())
+
+    def test_latency_spike(self):
+        loop = MagicMock()
+        loop.time.return_value = 100
+        limiter = AdaptiveLimiter('host', 16)
+        limiter.limit = 8
+        limiter.on_success(loop, 0.1)
+        limiter.on_success(loop, 1)
+        self.assertEqual(4.5, limiter.limit)
+
+    def test_retry_after(self):
+        responses = [FakeStatusResponse(503, {'Retry-After': '0.2'}), FakeStatusResponse(200)]
+        limiter = AdaptiveLimiter('host', 16)
+
+        async def run():
+            st = time.time()
+            response = await limiter.call(self.executor, lambda: responses.pop(0))
+            return response, time.time() - st
+
+        response, elapsed = asyncio.run(run())
+        self.assertEqual(200, response.status_code)
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertEqual(1, limiter.throttled)
+
+    def test_http_error_retry(self):
+        calls = []
+
+        def request():
+            calls.append(1)
+            if len(calls) == 1:
+                raise requests.HTTPError(response=FakeStatusResponse(429, {'Retry-After': '0'}))
+            return 'page'
+
+        limiter = AdaptiveLimiter('host', 16)
+        self.assertEqual('page', asyncio.run(limiter.call(self.executor, request)))
+        self.assertEqual(2, len(calls))
+
+    def test_retries_exhausted(self):
+        limiter = AdaptiveLimiter('host', 16)
+        with self.assertRaises(ThrottledError):
+            asyncio.run(limiter.call(self.executor, lambda: FakeStatusResponse(429, {'Retry-After': '0'})))
+
+    def test_other_errors_raised(self):
+        def request():
+            raise requests.HTTPError(response=FakeStatusResponse(404))
+
+        with self.assertRaises(requests.HTTPError):
+            asyncio.run(AdaptiveLimiter('host', 16).call(self.executor, request))
+
+    def test_settles_near_capacity(self):
+        clock = FakeClock()
+        host = FakeCapacityHost(capacity=6, clock=clock)
+        limiter = AdaptiveLimiter('host', 32)
+        loop = asyncio.new_event_loop()
+        loop.time = clock.time
+        executor = RoundTripExecutor(loop, host)
+
+        async def run():
+            await asyncio.gather(*[limiter.call(executor, host.request, True) for _ in range(600)])
+
+        try:
+            with patch('task.http_limiter.time', clock):
+                loop.run_until_complete(run())
+        finally:
+            loop.close()
+        metrics = limiter.metrics()
+        self.assertGreater(metrics.get('throttled'), 0)
+        # Slow start can overshoot up to twice the capacity before the first 429 comes back
+        self.assertLessEqual(metrics.get('peak_concurrency'), 2 * host.capacity + 4)
+        self.assertEqual(host.capacity, metrics.get('concurrency'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import datetime
+import os
+import unittest
+
+from task.http_listing import parse_listing, ListingEntry, ListingParser
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NGINX_PAGE = (
+    '<html><head><title>Index of /data/</title></head><body><h1>Index of /data/</h1><hr><pre>'
+    '<a href="../">../</a>\n'
+    '<a href="2021/">2021/</a>                                              07-May-2021 09:27                   -\n'
+    '<a href="f16_20210101v7.gz">f16_20210101v7.gz</a>                      07-May-2021 09:28             1882122\n'
+    '</pre><hr></body></html>'
+)
+
+IIS_LONG_DATE_PAGE = (
+    '<pre><A HREF="/data/">[To Parent Directory]</A><br><br>'
+    ' Thursday, April 2, 2020  3:06 PM        &lt;dir&gt; <A HREF="/data/y2020/m04/">m04</A><br>'
+    ' Thursday, April 2, 2020  3:06 PM      1882122 <A HREF="/data/y2020/f16_20200401v7.gz">f16_20200401v7.gz</A><br>'
+    '</pre>'
+)
+
+
+class TestHTTPListing(unittest.TestCase):
+    @staticmethod
+    def get_html(provider):
+        with open(os.path.join(THIS_DIR, f'test_page_{provider}.html'), 'r', encoding='UTF-8') as test_html_file:
+            return test_html_file.read()
+
+    def test_parse_apache_fancy_index(self):
+        url = 'https://www.nsstc.uah.edu/public/msu/v6.0/tlt/'
+        entries = parse_listing(url, self.get_html('msut'))
+        self.assertEqual(4, len(entries))
+        # Human readable sizes are rounded so the file size is left for a HEAD request
+        self.assertEqual(
+            ListingEntry(f'{url}tltglhmam_6.0', None, None, datetime.datetime(2021, 5, 7, 9, 27)), entries[0]
+        )
+
+    def test_parse_iis(self):
+        url = 'https://data.remss.com/ssmi/f16/bmaps_v07/y2020/m04/'
+        entries = parse_listing(url, self.get_html('remss'))
+        self.assertEqual(5, len(entries))
+        self.assertEqual(
+            ListingEntry(f'{url}f16_20200401v7.gz', False, 1882122, datetime.datetime(2020, 4, 2, 15, 6)), entries[0]
+        )
+
+    def test_parse_iis_long_date(self):
+        url = 'https://host/data/y2020/'
+        entries = parse_listing(url, IIS_LONG_DATE_PAGE)
+        self.assertEqual(
+            [
+                ListingEntry(f'{url}m04', True, None, None),
+                ListingEntry(f'{url}f16_20200401v7.gz', False, 1882122, datetime.datetime(2020, 4, 2, 15, 6))
+            ],
+            entries
+        )
+
+    def test_parse_nginx(self):
+        url = 'https://host/data/'
+        entries = parse_listing(url, NGINX_PAGE)
+        self.assertEqual(
+            [
+                ListingEntry(f'{url}2021', True, None, None),
+                ListingEntry(f'{url}f16_20210101v7.gz', False, 1882122, datetime.datetime(2021, 5, 7, 9, 28))
+            ],
+            entries
+        )
+
+    def test_parse_plain_links(self):
+        url = 'https://host/data/'
+        page = '<html><body><a href="../">Parent</a><a href="#top">Top</a><a href="file.gz">file.gz</a></body></html>'
+        self.assertEqual([ListingEntry(f'{url}file.gz', None, None, None)], parse_listing(url, page))
+
+    def test_incremental_feed(self):
+        pages = [
+            ('https://www.nsstc.uah.edu/public/msu/v6.0/tlt/', self.get_html('msut')),
+            ('https://data.remss.com/ssmi/f16/bmaps_v07/y2020/m04/', self.get_html('remss')),
+            ('https://host/data/', NGINX_PAGE),
+            ('https://host/data/y2020/', IIS_LONG_DATE_PAGE)
+        ]
+        for url, page in pages:
+            expected = parse_listing(url, page)
+            for chunk_size in (1, 3, 100):
+                parser = ListingParser(url)
+                for index in range(0, len(page), chunk_size):
+                    parser.feed(page[index:index + chunk_size])
+                self.assertEqual(expected, parser.close(), f'{url} in chunks of {chunk_size}')
+
+    def test_incremental_rows_parsed_before_close(self):
+        url = 'https://host/data/'
+        parser = ListingParser(url)
+        parser.feed(NGINX_PAGE[:NGINX_PAGE.index('<a href="f16')])
+        # The delimiter is only picked once two entries have been seen
+        self.assertEqual([], parser.entries)
+        parser.feed(NGINX_PAGE[NGINX_PAGE.index('<a href="f16'):NGINX_PAGE.index('</pre>')])
+        self.assertEqual(2, len(parser.entries))
+        self.assertEqual(2, len(parser.close()))
+
+    def test_incremental_rows_single_entry(self):
+        url = 'https://host/data/'
+        parser = ListingParser(url)
+        parser.feed(NGINX_PAGE[:NGINX_PAGE.index('<a href="f16')])
+        # Without a second entry rows are only split on lines once enough of the page has been seen
+        parser.feed(' ' * 16 * 1024)
+        self.assertEqual(1, len(parser.entries))
+
+    def test_parse_pre_below_header_br(self):
+        url = 'https://host/data/'
+        page = NGINX_PAGE.replace(
+            '<pre>', 'Mirror of the archive<br>Updated daily<br><pre>'
+        ).replace('1882122\n', '1882122\n<a href="f16_20210102v7.gz">f16_20210102v7.gz</a>  08-May-2021 10:00  2048\n')
+        self.assertEqual(
+            [
+                ListingEntry(f'{url}2021', True, None, None),
+                ListingEntry(f'{url}f16_20210101v7.gz', False, 1882122, datetime.datetime(2021, 5, 7, 9, 28)),
+                ListingEntry(f'{url}f16_20210102v7.gz', False, 2048, datetime.datetime(2021, 5, 8, 10, 0))
+            ],
+            parse_listing(url, page)
+        )
+
+    def test_parse_entries_on_one_line(self):
+        url = 'https://host/data/'
+        page = (
+            '<pre><a href="a.gz">a.gz</a> 07-May-2021 09:27 1024 '
+            '<a href="b.gz">b.gz</a> 08-May-2021 10:00 2048</pre>'
+        )
+        self.assertEqual(
+            [
+                ListingEntry(f'{url}a.gz', False, 1024, datetime.datetime(2021, 5, 7, 9, 27)),
+                ListingEntry(f'{url}b.gz', False, 2048, datetime.datetime(2021, 5, 8, 10, 0))
+            ],
+            parse_listing(url, page)
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import concurrent.futures
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from task.http_session import connection_stats, create_session
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        time.sleep(0.005)
+        self.respond(b'')
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path.startswith('/flaky') and self.server.failures.get(self.path, 0) < 2:
+            self.server.failures[self.path] = self.server.failures.get(self.path, 0) + 1
+            self.send_response(502)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.respond(self.headers.get('Accept-Encoding', '').encode())
+
+    def respond(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPSession(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.failures = {}
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def head_all(self, session, workers, count):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda x: session.head(f'{self.url}/file_{x}').raise_for_status(), range(count)))
+
+    def test_connections_reused(self):
+        session = create_session(16)
+        self.head_all(session, 16, 200)
+        stats = connection_stats(session).get(f'http://127.0.0.1:{self.server.server_address[1]}')
+        self.assertEqual(200, stats.get('requests'))
+        self.assertLessEqual(stats.get('connections'), 16)
+
+    def test_default_pool_discards_connections(self):
+        # What the discovery session did before: more threads than the default pool of 10 connections holds
+        session = requests.Session()
+        with self.assertLogs('urllib3.connectionpool', 'WARNING') as logs:
+            self.head_all(session, 16, 200)
+        self.assertIn('Connection pool is full, discarding connection', logs.output[0])
+
+    def test_retries(self):
+        response = create_session(4).get(f'{self.url}/flaky')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, self.server.failures.get('/flaky'))
+
+        response = create_session(4, retries=1).get(f'{self.url}/flaky_no_retry')
+        self.assertEqual(502, response.status_code)
+
+    def test_compression(self):
+        self.assertEqual('gzip, deflate', create_session(4).get(self.url).text)
+        self.assertEqual('identity', create_session(4, compression=False).get(self.url).text)
+        self.assertEqual('identity', create_session(4).get(self.url, headers={'Accept-Encoding': 'identity'}).text)
+
+    def test_timeout(self):
+        with self.assertRaises((requests.Timeout, requests.ConnectionError)):
+            create_session(4, retries=0, timeout=0.1).get(f'{self.url}/slow')
+        # A timeout given to the request is used instead of the session's
+        self.assertEqual(200, create_session(4, retries=0, timeout=0.1).get(f'{self.url}/slow', timeout=5).status_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
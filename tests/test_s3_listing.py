@@ -0,0 +1,68 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+from tests.s3_listing_pages import list_contents, list_objects_v2_page, stubbed_client
+from task import s3_listing
+from task.s3_listing import parse_list_objects_v2
+
+
+class TestS3Listing(unittest.TestCase):
+    def setUp(self):
+        self.pages = {
+            '': list_objects_v2_page([f'ssmi/f16_{x:08d}v7.gz' for x in range(3)], next_token='page2'),
+            'page2': list_objects_v2_page(['ssmi/f16_00000003v7.gz', 'ssmi/f16 00000004+v7.gz'], token='page2')
+        }
+
+    def test_same_as_botocore(self):
+        expected = list_contents(stubbed_client(self.pages, False)[0])
+        client, requests = stubbed_client(self.pages, True)
+        actual = list_contents(client)
+        self.assertEqual(5, len(actual))
+        self.assertEqual(expected, actual)
+        self.assertEqual([str(x['LastModified']) for x in expected], [str(x['LastModified']) for x in actual])
+        self.assertEqual('"00000000000000000000000000000001"', actual[1]['ETag'])
+        # Requests are still signed and paginated by botocore
+        self.assertEqual(2, len(requests))
+        self.assertIn('Authorization', requests[0].headers)
+
+    def test_url_encoded_keys(self):
+        pages = {
+            '': list_objects_v2_page(['ssmi/f16 00000004+v7.gz', 'ssmi/f16_%v7.gz'], encode=True)
+        }
+        client, _ = stubbed_client(pages, True)
+        self.assertEqual(['ssmi/f16 00000004+v7.gz', 'ssmi/f16_%v7.gz'], [x['Key'] for x in list_contents(client)])
+
+    def test_pagination_fields_kept(self):
+        client, _ = stubbed_client(self.pages, True)
+        page = client.list_objects_v2(Bucket='bucket', Prefix='ssmi/')
+        self.assertTrue(page['IsTruncated'])
+        self.assertEqual('page2', page['NextContinuationToken'])
+        self.assertEqual(3, page['KeyCount'])
+        self.assertEqual([{'Prefix': 'ssmi/f16/'}], page['CommonPrefixes'])
+        self.assertEqual({'Key', 'ETag', 'Size', 'LastModified'}, set(page['Contents'][0]))
+
+    def test_parse_list_objects_v2(self):
+        contents, remainder = parse_list_objects_v2(list_objects_v2_page(['a.gz']))
+        self.assertEqual([{
+            'Key': 'a.gz', 'ETag': '"00000000000000000000000000000000"', 'Size': 0,
+            'LastModified': datetime.datetime(2021, 5, 7, 9, 27, tzinfo=datetime.timezone.utc)
+        }], contents)
+        self.assertNotIn(b'Contents', remainder)
+        self.assertIn(b'IsTruncated', remainder)
+
+    def test_parse_in_pieces(self):
+        page = list_objects_v2_page([f'ssmi/f16_{x:08d}v7.gz' for x in range(50)], next_token='page2')
+        expected = parse_list_objects_v2(page)
+        with patch.object(s3_listing, 'FEED_SIZE', 7):
+            self.assertEqual(expected, parse_list_objects_v2(page))
+
+    def test_empty_page(self):
+        client, _ = stubbed_client({'': list_objects_v2_page([])}, True)
+        page = client.list_objects_v2(Bucket='bucket', Prefix='ssmi/')
+        self.assertNotIn('Contents', page)
+        self.assertEqual(0, page['KeyCount'])
+
+
+if __name__ == "__main__":
+    unittest.main()
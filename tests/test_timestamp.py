@@ -0,0 +1,65 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import dateparser
+
+from task import timestamp
+from task.timestamp import parse_timestamp
+
+EQUIVALENT_VALUES = [
+    # Last-Modified headers
+    'Thu, 02 Apr 2020 15:06:03 GMT', 'Sun, 06 Nov 1994 08:49:37 GMT', 'Thu, 2 Apr 2020 15:06:03 GMT',
+    '02 Apr 2020 15:06:03 GMT',
+    # FTP LIST columns
+    'May 01 14:08', 'Dec 31 23:59', 'Jan 1 00:00', 'May 01 2020', 'Feb 29 2020', 'Sep 9 1999',
+    # SFTP st_mtime
+    1625000000, '1625000000', '1625000000123', '1625000000123456', '1625000000.75', 1625000000.5, 9999999999,
+    # S3, THREDDS and JSON catalogs
+    '2021-05-07T09:27:00Z', '2021-05-07T09:27:00.000Z', '2021-05-07T09:27:00.123Z', '2021-05-07T09:27:00.123456Z',
+    '2021-05-07T09:27:00', '2021-05-07 09:27:00', '2021-05-07T09:27Z', '2021-05-07T09:27:00+01:00', '2021-05-07',
+    '2021-05-07T09:27:00-05:00', '2021-05-07T09:27:00+05:30', '2021-05-07T09:27:00.5Z',
+]
+# Formats left to dateparser, which must still get the same result
+FALLBACK_VALUES = [
+    'Thursday, 02-Apr-20 15:06:03 GMT', 'Thu Apr  2 15:06:03 2020', 'Thu, 02 Apr 2020 15:06:03 +0100',
+    '162500000', '0', 'Feb 30 2020', 'Foo 01 2020', 'not a date'
+]
+
+
+class TestTimestamp(unittest.TestCase):
+    def test_equivalent_to_dateparser(self):
+        for value in EQUIVALENT_VALUES + FALLBACK_VALUES:
+            expected = dateparser.parse(str(value))
+            actual = parse_timestamp(value)
+            self.assertEqual(expected, actual, value)
+            # Records store the string form, which includes the UTC offset
+            self.assertEqual(str(expected), str(actual), value)
+
+    def test_fast_paths(self):
+        with patch.object(timestamp, 'dateparser_parse') as dateparser_parse:
+            for value in EQUIVALENT_VALUES:
+                parse_timestamp(value)
+            dateparser_parse.assert_not_called()
+
+            for value in FALLBACK_VALUES:
+                parse_timestamp(value)
+            self.assertEqual(len(FALLBACK_VALUES), dateparser_parse.call_count)
+
+    def test_empty(self):
+        self.assertIsNone(parse_timestamp(None))
+        self.assertIsNone(parse_timestamp(''))
+        self.assertIsNone(parse_timestamp('  '))
+
+    def test_http_date(self):
+        self.assertEqual(
+            datetime.datetime(2020, 4, 2, 15, 6, 3, tzinfo=datetime.timezone.utc),
+            parse_timestamp('Thu, 02 Apr 2020 15:06:03 GMT')
+        )
+
+    def test_ls_date_current_year(self):
+        self.assertEqual(datetime.datetime.now().year, parse_timestamp('May 01 14:08').year)
+
+
+if __name__ == "__main__":
+    unittest.main()